@@ -0,0 +1,104 @@
+# dockerpty: bench_frames.py
+#
+# Copyright 2014 Chris Corbyn <chris@w3style.co.uk>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Measure frame codec throughput in frames per second.
+
+Usage:
+
+    python benchmarks/bench_frames.py [payload size] [frames per buffer]
+"""
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import dockerpty.frames as frames
+import dockerpty.io as io
+import dockerpty.records as records
+
+
+class Chunks(object):
+    """
+    A stream returning the same buffer of frames on every read, without I/O.
+    """
+
+    def __init__(self, data, size):
+        self.data = data
+        self.size = size
+        self.pos = 0
+
+    def read(self, n):
+        data = self.data[self.pos:self.pos + self.size]
+        self.pos = (self.pos + self.size) % len(self.data)
+        return data
+
+
+def bench(name, count, fn):
+    best = min(timeit.repeat(fn, number=1, repeat=5))
+    print("{0:<32} {1:12,.0f} frames/s".format(name, count / best))
+
+
+def main(size=64, count=10000):
+    payload = b'x' * size
+    data = b''.join(frames.encode(frames.STDOUT, payload) for _ in range(count))
+
+    def encode():
+        for _ in range(count):
+            frames.encode(frames.STDOUT, payload)
+
+    buffer = memoryview(bytearray(len(data)))
+
+    def encode_into():
+        offset = 0
+        for _ in range(count):
+            offset = frames.encode_into(buffer, offset, frames.STDOUT, payload)
+
+    def parse():
+        frames.parse(data)
+
+    def decode_whole():
+        frames.Decoder().feed(data)
+
+    def decode_split():
+        # fed in socket-sized reads which split frames anywhere
+        decoder = frames.Decoder()
+        for i in range(0, len(data), 4096):
+            decoder.feed(data[i:i + 4096])
+
+    def demux():
+        demuxer = io.Demuxer(Chunks(data, 65536))
+        for _ in range(count):
+            demuxer.read(65536)
+
+    def record():
+        recorder = records.Recorder(Chunks(data, 65536))
+        for _ in range(0, len(data), 65536):
+            recorder.read(65536)
+
+    bench('encode', count, encode)
+    bench('encode_into', count, encode_into)
+    bench('parse (one buffer)', count, parse)
+    bench('Decoder.feed (one buffer)', count, decode_whole)
+    bench('Decoder.feed (4 KiB reads)', count, decode_split)
+    bench('Demuxer.read (64 KiB reads)', count, demux)
+    bench('Recorder.read (64 KiB reads)', count, record)
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
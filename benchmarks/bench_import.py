@@ -0,0 +1,65 @@
+# dockerpty: bench_import.py
+#
+# Copyright 2014 Chris Corbyn <chris@w3style.co.uk>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Measure the cost of importing dockerpty in a fresh interpreter.
+
+Usage:
+
+    python benchmarks/bench_import.py [runs]
+"""
+
+import os
+import subprocess
+import sys
+import time
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+STATEMENTS = [
+    'pass',
+    'import dockerpty',
+    'import dockerpty.io',
+    'import dockerpty; dockerpty.PseudoTerminal',
+]
+
+
+def best_of(statement, runs):
+    """
+    Returns the fastest wall time, in seconds, of `runs` interpreters running
+    `statement`.
+    """
+
+    best = None
+    for _ in range(runs):
+        start = time.time()
+        subprocess.check_call([sys.executable, '-c', statement], cwd=ROOT)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main(runs=20):
+    baseline = best_of('pass', runs)
+    for statement in STATEMENTS:
+        elapsed = best_of(statement, runs)
+        print("{0:<45} {1:8.2f} ms (+{2:.2f} ms)".format(
+            statement, elapsed * 1000, (elapsed - baseline) * 1000))
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
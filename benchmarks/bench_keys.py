@@ -0,0 +1,68 @@
+# dockerpty: bench_keys.py
+#
+# Copyright 2014 Chris Corbyn <chris@w3style.co.uk>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Measure the throughput of stdin key interception on pasted text.
+
+Usage:
+
+    python benchmarks/bench_keys.py [chunk size] [chunks]
+"""
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import dockerpty.io as io
+import dockerpty.transform as transform
+
+
+def bench(name, total, fn):
+    best = min(timeit.repeat(fn, number=1, repeat=5))
+    print("{0:<40} {1:10,.1f} MB/s".format(name, total / best / 1e6))
+
+
+def main(size=4096, count=2000):
+    # pasted code: no sequences, but escapes and control bytes now and then
+    line = b'    if x:\n        print("\x1b[1mhi\x1b[0m")\t\x10\n'
+    chunk = (line * (size // len(line) + 1))[:size]
+    total = size * count
+
+    def matcher():
+        keys = io.KeyMatcher(b'\x10\x11')
+        for _ in range(count):
+            keys.feed(chunk)
+
+    def intercept(**kwargs):
+        stage = transform.Intercept({b'\x10\x11': len, b'\x1b[21~': len}, **kwargs)
+        for _ in range(count):
+            stage.feed(chunk)
+
+    def pasted():
+        stage = transform.Intercept({b'\x10\x11': len}, bracketed_paste=True)
+        stage.feed(transform.PASTE_START)
+        for _ in range(count):
+            stage.feed(chunk)
+
+    bench('KeyMatcher (one sequence)', total, matcher)
+    bench('Intercept (two sequences)', total, intercept)
+    bench('Intercept (bracketed paste)', total, pasted)
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
@@ -0,0 +1,76 @@
+# dockerpty: bench_sessions.py
+#
+# Copyright 2014 Chris Corbyn <chris@w3style.co.uk>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Pump many concurrent sessions against dockerpty.testing.FakeDocker.
+
+Every session attaches to a scripted container and copies its output to
+/dev/null on one Loop, as a server would. The Loop uses select(), so each
+session's three sockets count towards the FD_SETSIZE limit of 1024.
+
+Usage:
+
+    python benchmarks/bench_sessions.py [sessions] [bytes per session] [tty|mux]
+"""
+
+import os
+import resource
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dockerpty.loop import Loop
+from dockerpty.pty import RunOperation
+from dockerpty.testing import FakeDocker
+
+
+def main(sessions=200, size=1 << 20, mode='mux'):
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+    devnull = open(os.devnull, 'wb')
+    client = FakeDocker()
+    loop = Loop()
+    line = b'x' * 79 + b'\n'
+    output = line * (size // len(line))
+
+    for _ in range(sessions):
+        container = client.create_container(output=output, tty=(mode == 'tty'))
+        operation = RunOperation(client, container, stdin=devnull, stdout=devnull,
+                                 stderr=devnull, logs=0, interactive=False)
+        pumps = operation.start()
+        for pump in pumps:
+            pump.set_blocking(False)
+        loop.add(pumps)
+
+    started = time.time()
+    loop.run()
+    elapsed = time.time() - started
+
+    total = sessions * len(output)
+    print("{0} {1} sessions, {2:.1f} MiB in {3:.2f}s: {4:.1f} MiB/s".format(
+        sessions, mode, total / 1048576.0, elapsed, total / 1048576.0 / elapsed))
+
+    client.close()
+    loop.close()
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    main(int(args[0]) if args else 200,
+         int(args[1]) if len(args) > 1 else 1 << 20,
+         args[2] if len(args) > 2 else 'mux')
@@ -0,0 +1,64 @@
+# dockerpty: bench_spool.py
+#
+# Copyright 2014 Chris Corbyn <chris@w3style.co.uk>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Measure capturing output to disk in MiB per second, through a Stream over a
+regular file and through a Spool.
+
+Usage:
+
+    python benchmarks/bench_spool.py [MiB] [chunk size]
+"""
+
+import os
+import sys
+import tempfile
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import dockerpty.io as io
+from dockerpty.spool import Spool
+
+
+def bench(name, mib, fn):
+    best = min(timeit.repeat(fn, number=1, repeat=3))
+    print("{0:<32} {1:10,.0f} MiB/s".format(name, mib / best))
+
+
+def main(mib=256, chunk=4096):
+    data = os.urandom(chunk)
+    count = (mib << 20) // chunk
+
+    def stream():
+        with tempfile.TemporaryFile() as f:
+            s = io.Stream(f)
+            for _ in range(count):
+                s.write(data)
+            s.close()
+
+    def spool():
+        with Spool() as s:
+            for _ in range(count):
+                s.write(data)
+            s.close()
+
+    bench('Stream (os.write per chunk)', mib, stream)
+    bench('Spool', mib, spool)
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
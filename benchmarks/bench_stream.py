@@ -0,0 +1,176 @@
+# dockerpty: bench_stream.py
+#
+# Copyright 2014 Chris Corbyn <chris@w3style.co.uk>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Measure the per-call overhead of Stream and Demuxer on small chunks.
+
+Usage:
+
+    python benchmarks/bench_stream.py [calls]
+"""
+
+import os
+import socket
+import struct
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import dockerpty.io as io
+
+
+CHUNK = b'x' * 16
+
+
+class NullSocket(object):
+    """
+    A socket which does no I/O, leaving only the Stream's own overhead.
+    """
+
+    def recv(self, n):
+        return CHUNK
+
+    def send(self, data):
+        return len(data)
+
+    def fileno(self):
+        return -1
+
+
+class NullFrames(object):
+    """
+    A stream endlessly returning multiplexed frames of CHUNK, one per read,
+    without I/O.
+    """
+
+    frame = struct.pack('>BxxxL', 1, len(CHUNK)) + CHUNK
+
+    def read(self, n):
+        return self.frame
+
+    def fileno(self):
+        return -1
+
+
+def bench(name, calls, setup, call):
+    """
+    Print the best mean time per call of `call` over 5 runs, after `setup`.
+    """
+
+    args = setup()
+    best = min(timeit.repeat(lambda: call(*args), number=calls, repeat=5))
+    print("{0:<30} {1:8.0f} ns/call".format(name, best / calls * 1e9))
+
+
+def null_read():
+    return (io.Stream(NullSocket()),)
+
+
+def null_read_call(stream):
+    stream.read(4096)
+
+
+def null_write():
+    return (io.Stream(NullSocket()),)
+
+
+def null_write_call(stream):
+    stream.write(CHUNK)
+
+
+def socket_read():
+    a, b = socket.socketpair()
+    return a, io.Stream(b)
+
+
+def socket_read_call(a, stream):
+    a.send(CHUNK)
+    stream.read(4096)
+
+
+def socket_write():
+    a, b = socket.socketpair()
+    return io.Stream(a), b
+
+
+def socket_write_call(stream, b):
+    stream.write(CHUNK)
+    b.recv(4096)
+
+
+def pipe_read():
+    r, w = os.pipe()
+    return w, io.Stream(os.fdopen(r, 'rb', 0))
+
+
+def pipe_read_call(w, stream):
+    os.write(w, CHUNK)
+    stream.read(4096)
+
+
+def pipe_write():
+    r, w = os.pipe()
+    return io.Stream(os.fdopen(w, 'wb', 0)), r
+
+
+def pipe_write_call(stream, r):
+    stream.write(CHUNK)
+    os.read(r, 4096)
+
+
+def null_demux():
+    return (io.Demuxer(NullFrames()),)
+
+
+def null_demux_call(demuxer):
+    demuxer.read(4096)
+
+
+def demux():
+    a, b = socket.socketpair()
+    return a, io.Demuxer(io.Stream(b)), struct.pack('>BxxxL', 1, len(CHUNK)) + CHUNK
+
+
+def demux_call(a, demuxer, frame):
+    a.send(frame)
+    demuxer.read(4096)
+
+
+def baseline():
+    a, b = socket.socketpair()
+    return a, b
+
+
+def baseline_call(a, b):
+    a.send(CHUNK)
+    b.recv(4096)
+
+
+def main(calls=100000):
+    bench('Stream.read (no I/O)', calls, null_read, null_read_call)
+    bench('Stream.write (no I/O)', calls, null_write, null_write_call)
+    bench('Demuxer.read (no I/O)', calls, null_demux, null_demux_call)
+    bench('raw socket send+recv', calls, baseline, baseline_call)
+    bench('Stream.read (socket)', calls, socket_read, socket_read_call)
+    bench('Stream.write (socket)', calls, socket_write, socket_write_call)
+    bench('Stream.read (pipe)', calls, pipe_read, pipe_read_call)
+    bench('Stream.write (pipe)', calls, pipe_write, pipe_write_call)
+    bench('Demuxer.read (socket)', calls, demux, demux_call)
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
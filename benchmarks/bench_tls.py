@@ -0,0 +1,79 @@
+# dockerpty: bench_tls.py
+#
+# Copyright 2014 Chris Corbyn <chris@w3style.co.uk>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Pump data from a local TLS socketpair to /dev/null on a Loop.
+
+Reports the throughput and the longest single loop iteration; a pump missing
+bytes held inside the SSL object shows up as an iteration as long as the
+select() timeout.
+
+Usage:
+
+    python benchmarks/bench_tls.py [MiB] [read size]
+"""
+
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import dockerpty.io as io
+from dockerpty.loop import Loop
+from tests.util import ssl_socketpair
+
+
+def main(mib=64, n=4096):
+    server, client = ssl_socketpair()
+    chunk = os.urandom(1 << 16)
+    total = mib << 20
+
+    def send():
+        for _ in range(total // len(chunk)):
+            server.sendall(chunk)
+        server.close()
+
+    devnull = open(os.devnull, 'wb')
+    stream = io.Stream(client)
+    pump = io.Pump(stream, io.Stream(devnull), propagate_close=False)
+    pump.set_blocking(False)
+
+    loop = Loop()
+    group = loop.add([pump])
+    writer = threading.Thread(target=send)
+
+    started = time.time()
+    writer.start()
+    worst = 0
+    while not group.done:
+        before = time.time()
+        loop.run_once(timeout=5)
+        worst = max(worst, time.time() - before)
+    elapsed = time.time() - started
+    writer.join()
+
+    print("{0} MiB over TLS in {1:.2f}s: {2:.1f} MiB/s, longest iteration {3:.1f} ms".format(
+        mib, elapsed, mib / elapsed, worst * 1000))
+
+    loop.close()
+    client.close()
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    main(int(args[0]) if args else 64, int(args[1]) if len(args) > 1 else 4096)
@@ -14,37 +14,106 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from dockerpty.pty import PseudoTerminal, RunOperation, ExecOperation, exec_create
+import importlib
+import sys
 
 
-def start(client, container, interactive=True, stdout=None, stderr=None, stdin=None, logs=None):
+# Public names and the modules defining them. These are imported on first
+# use, so that `import dockerpty` (or `dockerpty.io`) does not pay for
+# modules the caller never touches.
+_LAZY = {
+    'PseudoTerminal': 'dockerpty.pty',
+    'RunOperation': 'dockerpty.pty',
+    'ExecOperation': 'dockerpty.pty',
+    'exec_create': 'dockerpty.pty',
+    'Session': 'dockerpty.session',
+    'exec_many': 'dockerpty.batch',
+    'Spool': 'dockerpty.spool',
+}
+
+# Submodules which `import dockerpty` used to load, and which callers may
+# still reach as attributes (e.g. `dockerpty.io`).
+_SUBMODULES = ('io', 'pty', 'tty')
+
+__all__ = sorted(list(_LAZY) + ['start', 'exec_command', 'start_exec'])
+
+
+def __getattr__(name):
+    if name in _SUBMODULES:
+        return importlib.import_module('dockerpty.' + name)
+
+    module = _LAZY.get(name)
+    if module is None:
+        raise AttributeError("module {0!r} has no attribute {1!r}".format(__name__, name))
+
+    value = getattr(__import__(module, fromlist=[name]), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY) | set(_SUBMODULES))
+
+
+if sys.version_info < (3, 7):
+    # module __getattr__ (PEP 562) is not supported
+    from dockerpty.pty import PseudoTerminal, RunOperation, ExecOperation, exec_create
+    from dockerpty.session import Session
+    from dockerpty.spool import Spool
+
+    def exec_many(*args, **kwargs):
+        """
+        See dockerpty.batch.exec_many(), which needs concurrent.futures.
+        """
+
+        from dockerpty.batch import exec_many
+        return exec_many(*args, **kwargs)
+
+
+def start(client, container, interactive=True, stdout=None, stderr=None, stdin=None, logs=None,
+          detach_keys=None, rate_limits=None, transforms=None, resume=None, local_pty=False,
+          merged=None):
     """
     Present the PTY of the container inside the current process.
 
     This is just a wrapper for PseudoTerminal(client, container).start()
     """
 
+    from dockerpty.pty import PseudoTerminal, RunOperation
+
     operation = RunOperation(client, container, interactive=interactive, stdout=stdout,
-                             stderr=stderr, stdin=stdin, logs=logs)
+                             stderr=stderr, stdin=stdin, logs=logs, detach_keys=detach_keys,
+                             rate_limits=rate_limits, transforms=transforms, resume=resume,
+                             local_pty=local_pty, merged=merged)
 
     PseudoTerminal(client, operation).start()
 
 
 def exec_command(
-        client, container, command, interactive=True, stdout=None, stderr=None, stdin=None):
+        client, container, command, interactive=True, stdout=None, stderr=None, stdin=None,
+        detach_keys=None, rate_limits=None, transforms=None):
     """
     Run provided command via exec API in provided container.
 
     This is just a wrapper for PseudoTerminal(client, container).exec_command()
     """
+    from dockerpty.pty import PseudoTerminal, ExecOperation, exec_create
+
     exec_id = exec_create(client, container, command, interactive=interactive)
 
     operation = ExecOperation(client, exec_id,
-                              interactive=interactive, stdout=stdout, stderr=stderr, stdin=stdin)
+                              interactive=interactive, stdout=stdout, stderr=stderr, stdin=stdin,
+                              detach_keys=detach_keys, rate_limits=rate_limits,
+                              transforms=transforms)
     PseudoTerminal(client, operation).start()
 
 
-def start_exec(client, exec_id, interactive=True, stdout=None, stderr=None, stdin=None):
+def start_exec(client, exec_id, interactive=True, stdout=None, stderr=None, stdin=None,
+               detach_keys=None, rate_limits=None, transforms=None):
+    from dockerpty.pty import PseudoTerminal, ExecOperation
+
     operation = ExecOperation(client, exec_id,
-                              interactive=interactive, stdout=stdout, stderr=stderr, stdin=stdin)
+                              interactive=interactive, stdout=stdout, stderr=stderr, stdin=stdin,
+                              detach_keys=detach_keys, rate_limits=rate_limits,
+                              transforms=transforms)
     PseudoTerminal(client, operation).start()
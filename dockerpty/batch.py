@@ -0,0 +1,226 @@
+# dockerpty: batch.py
+#
+# Copyright 2014 Chris Corbyn <chris@w3style.co.uk>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import sys
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import dockerpty.io as io
+import dockerpty.transform as transform
+from dockerpty.loop import Loop
+from dockerpty.pty import ExecOperation, exec_create
+
+
+class Result(object):
+    """
+    The outcome of running a command in one container.
+
+    Times are io.clock() values: `queued` when the batch started, `started`
+    once the exec instance was running and `finished` once its exit code was
+    known. `error` holds the exception if any docker call failed.
+    """
+
+    def __init__(self, container, name, queued):
+        self.container = container
+        self.name = name
+        self.exec_id = None
+        self.exit_code = None
+        self.error = None
+        self.queued = queued
+        self.started = None
+        self.finished = None
+
+    @property
+    def elapsed(self):
+        """
+        Returns the seconds from the exec starting to its exit code being known.
+        """
+
+        if self.started is None or self.finished is None:
+            return None
+
+        return self.finished - self.started
+
+    def __repr__(self):
+        return "{cls}({name}, exit_code={exit_code})".format(cls=type(self).__name__,
+                                                              name=self.name,
+                                                              exit_code=self.exit_code)
+
+
+def container_name(container):
+    """
+    Returns a short name for `container`, for prefixing its output.
+    """
+
+    if isinstance(container, dict):
+        name = container.get('Name') or (container.get('Names') or [None])[0]
+        if name:
+            return name.lstrip('/')
+        container = container.get('Id') or container.get('id')
+
+    return str(container)[:12]
+
+
+class Batch(object):
+    """
+    Runs a command in many containers at once, pumping all output on one Loop.
+
+    At most `concurrency` exec instances are in flight at a time, counting from
+    `exec_create` until their exit code has been inspected. The docker calls
+    for each one are made on a pool of as many threads, so they overlap with
+    each other and with the pumping, while the pumps themselves all run on the
+    calling thread.
+
+    Each line of output is written to `stdout` prefixed by the container's
+    name, unless `prefix` is False.
+    """
+
+    def __init__(self, client, containers, command, concurrency=10, stdout=None,
+                 prefix=True, loop=None):
+        """
+        Initialize a Batch. Nothing runs until `run()`.
+        """
+
+        if concurrency < 1:
+            raise ValueError("concurrency must be at least 1")
+
+        self.client = client
+        self.containers = list(containers)
+        self.command = command
+        self.concurrency = concurrency
+        self.stdout = io.as_stream(stdout or sys.stdout)
+        self.prefix = prefix
+        self.loop = loop
+        self.pool = None
+        self.results = []
+        self.queue = deque()
+        self.inflight = 0
+        self.remaining = 0
+
+    def run(self):
+        """
+        Run the command everywhere and return a Result per container, in order.
+
+        Unless a loop was given, one is created for the run and closed after.
+        """
+
+        now = io.clock()
+        names = [container_name(c) for c in self.containers]
+        width = max([len(n) for n in names] or [0])
+
+        self.results = [Result(c, n.ljust(width), now) for c, n in zip(self.containers, names)]
+        self.queue.extend(self.results)
+        self.remaining = len(self.results)
+
+        owned = self.loop is None
+        if owned:
+            self.loop = Loop()
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+                self.pool = pool
+                self._schedule()
+                while self.remaining:
+                    self.loop.run_once()
+        finally:
+            if owned:
+                loop, self.loop = self.loop, None
+                loop.close()
+
+        return self.results
+
+    def _schedule(self):
+        while self.queue and self.inflight < self.concurrency:
+            result = self.queue.popleft()
+            self.inflight += 1
+            self.pool.submit(self._start, result)
+
+    def _start(self, result):
+        """
+        Create and start the exec instance. Runs on the pool.
+        """
+
+        try:
+            result.exec_id = exec_create(self.client, result.container, self.command,
+                                         interactive=False)
+            operation = ExecOperation(self.client, result.exec_id, interactive=False,
+                                      stdout=self.stdout, transforms=self._transforms(result))
+            sockets = operation.sockets()
+        except Exception as e:
+            result.error = e
+            self.loop.call_soon_threadsafe(self._finished, result)
+            return
+
+        result.started = io.clock()
+        self.loop.call_soon_threadsafe(self._attach, result, operation, sockets)
+
+    def _attach(self, result, operation, sockets):
+        pumps = operation.start(sockets=sockets)
+        for pump in pumps:
+            pump.set_blocking(False)
+
+        def done(group):
+            sockets.close()
+            if group.error is not None:
+                result.error = group.error
+                self._finished(result)
+            else:
+                self.pool.submit(self._inspect, result, operation)
+
+        self.loop.add(pumps, on_done=done)
+
+    def _inspect(self, result, operation):
+        """
+        Fetch the exit code. Runs on the pool.
+        """
+
+        try:
+            result.exit_code = operation.exit_code()
+        except Exception as e:
+            result.error = e
+
+        self.loop.call_soon_threadsafe(self._finished, result)
+
+    def _finished(self, result):
+        result.finished = io.clock()
+        self.inflight -= 1
+        self.remaining -= 1
+        self._schedule()
+
+    def _transforms(self, result):
+        if not self.prefix:
+            return None
+
+        prefix = '{0} | '.format(result.name).encode('utf-8')
+        return {'stdout': [transform.Lines(terminate=True), transform.Prefix(prefix)]}
+
+    def __repr__(self):
+        return "{cls}({command!r}, containers={containers})".format(
+            cls=type(self).__name__,
+            command=self.command,
+            containers=len(self.containers))
+
+
+def exec_many(client, containers, command, concurrency=10, stdout=None, prefix=True):
+    """
+    Run `command` in each of `containers`, at most `concurrency` at a time.
+
+    Output is streamed to `stdout` as it arrives, each line prefixed with its
+    container's name. Returns a list of Results, one per container.
+    """
+
+    return Batch(client, containers, command, concurrency=concurrency,
+                 stdout=stdout, prefix=prefix).run()
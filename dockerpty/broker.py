@@ -0,0 +1,532 @@
+# dockerpty: broker.py
+#
+# Copyright 2014 Chris Corbyn <chris@w3style.co.uk>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+A local attach broker, sharing one attach socket per container among any
+number of viewers.
+
+Viewers connect to the broker's unix socket and send a request line, a JSON
+object such as `{"container": "<id>", "write": true}`. The broker answers
+with a JSON line, `{"tty": true, "writer": true}` or `{"error": "..."}`,
+followed by the container's output, framed as docker frames it when the
+container has no tty. Whatever the one viewer holding the writer role sends
+goes to the container's stdin; what other viewers send is discarded.
+"""
+
+import errno
+import json
+import os
+import socket
+import sys
+
+import dockerpty.frames as frames
+import dockerpty.io as io
+from dockerpty.control import Executor
+from dockerpty.loop import Loop
+from dockerpty.pty import Operation
+
+
+class Reframer(object):
+    """
+    Wraps a multiplexed Stream so that each read returns whole frames.
+
+    Viewers join a broadcast between two reads, so must never be given the
+    rest of a frame which began before they joined.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.decoder = frames.Decoder(views=False)
+
+    def fileno(self):
+        return self.stream.fileno()
+
+    def set_blocking(self, value):
+        return self.stream.set_blocking(value)
+
+    def read(self, n=4096):
+        """
+        Read up to `n` bytes and return the frames they complete.
+        """
+
+        data = self.stream.read(n)
+        if not data:
+            return data
+
+        pieces = self.decoder.feed(data)
+        if not pieces:
+            raise OSError(errno.EAGAIN, "Waiting for the rest of a frame")
+
+        return b''.join(frames.encode(s, p) for s, p in pieces)
+
+    def buffered(self):
+        """
+        Delegates to the underlying Stream.
+        """
+
+        buffered = getattr(self.stream, 'buffered', None)
+        return buffered is not None and buffered()
+
+    def close(self):
+        return self.stream.close()
+
+    def __repr__(self):
+        return "{cls}({stream})".format(cls=type(self).__name__, stream=self.stream)
+
+
+class Discard(object):
+    """
+    A writer which drops everything, for input from viewers without the
+    writer role.
+    """
+
+    def write(self, data):
+        return len(data)
+
+    def needs_write(self):
+        return False
+
+    def do_write(self):
+        return 0
+
+    def close(self):
+        pass
+
+
+class Attachment(object):
+    """
+    One container's attach socket and the viewers sharing it.
+    """
+
+    def __init__(self, broker, container):
+        self.broker = broker
+        self.container = container
+        self.tty = None
+        self.stream = None
+        self.pump = None
+        self.group = None
+        self.writer = None
+        self.viewers = []
+        self.waiting = []
+
+    def open(self):
+        """
+        Attach to the container. Runs on the broker's executor.
+        """
+
+        client = self.broker.client
+        info = client.inspect_container(self.container)
+        sock = client.attach_socket(self.container,
+                                    {'stdin': 1, 'stdout': 1, 'stderr': 1, 'stream': 1})
+        return info['Config']['Tty'], sock
+
+    def opened(self, future):
+        try:
+            self.tty, sock = future.result()
+        except Exception as e:
+            self._forget()
+            for viewer in self.waiting:
+                viewer.refuse(str(e))
+            return
+
+        self.stream = io.Stream(sock)
+        self.stream.set_blocking(False)
+        reader = self.stream if self.tty else Reframer(self.stream)
+        self.pump = io.BroadcastPump(reader, [])
+        self.group = self.broker.loop.add([self.pump], on_done=self._done)
+
+        waiting, self.waiting = self.waiting, []
+        for viewer in waiting:
+            self.join(viewer)
+
+    def join(self, viewer):
+        """
+        Start sending the container's output to `viewer`.
+        """
+
+        if self.stream is None:
+            self.waiting.append(viewer)
+            return
+
+        writer = viewer.wants_write and self.writer is None
+        if writer:
+            self.writer = viewer
+
+        self.viewers.append(viewer)
+        viewer.joined(self, writer)
+        self.pump.add_sink(viewer.sink)
+        if self.pump.eof:
+            viewer.sink.close()
+
+    def leave(self, viewer):
+        """
+        Stop sending output to `viewer`, detaching once no viewer is left.
+        """
+
+        if viewer in self.viewers:
+            self.viewers.remove(viewer)
+        if viewer.sink in self.pump.sinks:
+            self.pump.sinks.remove(viewer.sink)
+        if self.writer is viewer:
+            self.writer = None
+
+        if not self.viewers and not self.group.done:
+            self.group.cancel()
+
+    def _done(self, group):
+        # the output normally ends with the sinks drained and closed, but not
+        # if the attach socket failed, or nobody was left watching
+        self._forget()
+        for viewer in self.viewers:
+            viewer.close()
+        self.stream.abort()
+
+    def _forget(self):
+        if self.broker.attachments.get(self.container) is self:
+            del self.broker.attachments[self.container]
+
+    def __repr__(self):
+        return "{cls}({container}, viewers={viewers})".format(cls=type(self).__name__,
+                                                              container=self.container,
+                                                              viewers=len(self.viewers))
+
+
+class Viewer(object):
+    """
+    One local client of the broker.
+
+    The Viewer is also the stream its Sink writes to, so that the container's
+    output is not sent before the response line, and so that the end of the
+    output shuts down only the sending side of the socket.
+    """
+
+    MAX_REQUEST = 4096
+
+    def __init__(self, broker, sock):
+        self.broker = broker
+        self.sock = sock
+        self.request = b''
+        self.stream = io.Stream(sock)
+        self.sink = io.Sink(self, policy=io.Sink.DISCONNECT, limit=broker.limit)
+        self.wants_write = False
+        self.attachment = None
+        self.group = None
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def handshake(self):
+        """
+        Read the request line and, once complete, join the container.
+        """
+
+        try:
+            data = self.sock.recv(Viewer.MAX_REQUEST)
+        except EnvironmentError as e:
+            if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                return
+            data = b''
+
+        self.request += data
+        if b'\n' not in self.request:
+            if not data or len(self.request) > Viewer.MAX_REQUEST:
+                self.broker.loop.remove_reader(self)
+                self.stream.abort()
+            return
+
+        self.broker.loop.remove_reader(self)
+
+        try:
+            request = json.loads(self.request.split(b'\n', 1)[0].decode('utf-8'))
+            container = request['container']
+        except (ValueError, KeyError, TypeError):
+            return self.refuse("Invalid request")
+
+        self.wants_write = bool(request.get('write'))
+        self.broker.attach(self, container)
+
+    def joined(self, attachment, writer):
+        """
+        Start the session, once the container is attached.
+        """
+
+        self.attachment = attachment
+        self.stream.write(_line({'tty': attachment.tty, 'writer': writer}))
+
+        target = attachment.stream if writer else Discard()
+        pump = io.Pump(self.stream, target, propagate_close=False)
+        self.group = self.broker.loop.add([pump], on_done=self._left)
+
+    def refuse(self, message):
+        try:
+            self.sock.send(_line({'error': message}))
+        except EnvironmentError:
+            pass
+        self.stream.abort()
+
+    def write_some(self, data):
+        """
+        Write output from the container, after the response line.
+        """
+
+        if self.stream.needs_write():
+            self.stream.do_write()
+            if self.stream.needs_write():
+                return 0
+
+        try:
+            return self.stream.write_some(data)
+        except EnvironmentError as e:
+            if e.errno == errno.EPIPE:
+                raise e
+            # however the viewer went away, the Sink only disconnects on EPIPE
+            raise IOError(errno.EPIPE, os.strerror(errno.EPIPE))
+
+    def close(self):
+        """
+        Signal the end of the container's output.
+        """
+
+        if not self.stream.closed:
+            self.stream.shutdown_write()
+
+    def _left(self, group):
+        self.attachment.leave(self)
+        self.stream.abort()
+
+    def __repr__(self):
+        return "{cls}({sock})".format(cls=type(self).__name__, sock=self.sock)
+
+
+class Broker(object):
+    """
+    Serves containers' output to local viewers over a unix socket, attaching
+    to each container once however many are watching it.
+
+    The first viewer of a container which asks to write becomes its writer,
+    until it disconnects. Viewers more than `limit` bytes behind are
+    disconnected rather than holding up the others. A container is detached
+    from once its last viewer leaves.
+
+    Example:
+
+        broker = Broker(docker.Client(), '/run/dockerpty.sock')
+        broker.listen()
+        broker.serve_forever()
+
+    and, in each viewer:
+
+        operation = BrokerOperation('/run/dockerpty.sock', container)
+        PseudoTerminal(None, operation).start()
+    """
+
+    def __init__(self, client, path, loop=None, workers=4, limit=1 << 20):
+        """
+        Initialize a Broker. Nothing is listened on until `listen()`.
+        """
+
+        self.client = client
+        self.path = path
+        self.limit = limit
+        self.loop = loop or Loop()
+        self.executor = Executor(self.loop, workers=workers)
+        self.listener = None
+        self.attachments = {}
+
+    def listen(self, backlog=128, mode=0o600):
+        """
+        Listen on the unix socket, replacing any left by an earlier Broker.
+        """
+
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+        self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.listener.bind(self.path)
+        os.chmod(self.path, mode)
+        self.listener.listen(backlog)
+        self.listener.setblocking(False)
+        self.loop.add_reader(self.listener, self._accept)
+
+    def attach(self, viewer, container):
+        """
+        Add `viewer` to the container's Attachment, attaching if need be.
+        """
+
+        attachment = self.attachments.get(container)
+        if attachment is None:
+            attachment = self.attachments[container] = Attachment(self, container)
+            attachment.join(viewer)
+            self.executor.submit(attachment.opened, attachment.open)
+        else:
+            attachment.join(viewer)
+
+    def serve_forever(self):
+        """
+        Run the loop until `stop()` is called.
+        """
+
+        self.loop.run()
+
+    def stop(self):
+        """
+        Stop serving. Safe to call from any thread.
+        """
+
+        self.loop.stop()
+
+    def close(self):
+        """
+        Stop listening and remove the socket. Viewers are left to finish.
+        """
+
+        self.executor.close()
+        if self.listener is not None:
+            self.loop.remove_reader(self.listener)
+            self.listener.close()
+            self.listener = None
+            os.unlink(self.path)
+
+    def _accept(self):
+        try:
+            sock, _ = self.listener.accept()
+        except EnvironmentError as e:
+            if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                return
+            raise e
+
+        if io.SELECT_LIMIT is not None and sock.fileno() >= io.SELECT_LIMIT:
+            # select() would fail for every viewer on the loop
+            sock.close()
+            return
+
+        sock.setblocking(False)
+        viewer = Viewer(self, sock)
+        self.loop.add_reader(viewer, viewer.handshake)
+
+    def __repr__(self):
+        return "{cls}({path})".format(cls=type(self).__name__, path=self.path)
+
+
+def connect(path, container, write=False):
+    """
+    Connect to the Broker at `path` to view `container`.
+
+    Returns the connected socket and the broker's response, a dict with `tty`
+    and `writer` keys. Raises IOError if the broker refuses.
+    """
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+        sock.sendall(_line({'container': container, 'write': write}))
+
+        # read no further than the response, leaving the output
+        response = b''
+        while not response.endswith(b'\n'):
+            byte = sock.recv(1)
+            if not byte:
+                raise IOError("Broker closed the connection")
+            response += byte
+
+        response = json.loads(response.decode('utf-8'))
+        if 'error' in response:
+            raise IOError(response['error'])
+    except Exception:
+        sock.close()
+        raise
+
+    return sock, response
+
+
+class BrokerOperation(Operation):
+    """
+    class for viewing a container through a Broker
+    """
+
+    def __init__(self, path, container, interactive=True, stdout=None, stdin=None,
+                 detach_keys=None, rate_limits=None, transforms=None):
+        """
+        Initialize a view of `container` through the Broker at `path`.
+
+        An `interactive` view asks to be the writer. If another viewer is
+        already writing, it sees the output but its input is not sent.
+        """
+
+        self.path = path
+        self.container = container
+        self.interactive = interactive
+        self.stdout = stdout or sys.stdout
+        self.stdin = stdin or sys.stdin
+        self.detach_keys = io.parse_keys(detach_keys) if detach_keys else None
+        self.rate_limits = rate_limits
+        self.transforms = transforms
+        self.tty = None
+        self.writer = False
+
+    def sockets(self):
+        """
+        Returns the stream connected to the broker.
+        """
+
+        sock, response = connect(self.path, self.container, write=self.interactive)
+        self.tty = response['tty']
+        self.writer = response['writer']
+
+        stream = io.Stream(sock)
+        if self.tty:
+            return stream
+        return io.Demuxer(stream)
+
+    def start(self, sockets=None, **kwargs):
+        """
+        Returns the pumps for the view.
+        """
+
+        stream = sockets or self.sockets()
+        pumps = []
+
+        if self.interactive and self.writer:
+            # other viewers are still watching, so the broker is never closed
+            pumps.append(io.Pump(io.as_stream(self.stdin), stream, wait_for_output=False,
+                                 propagate_close=False, detach_keys=self.detach_keys,
+                                 limits=self.limits('stdin'), transforms=self.stages('stdin')))
+
+        pumps.append(io.Pump(stream, io.as_stream(self.stdout), propagate_close=False,
+                             limits=self.limits('stdout'), transforms=self.stages('stdout')))
+
+        return pumps
+
+    def israw(self, **kwargs):
+        """
+        Returns True if the PTY should operate in raw mode.
+        """
+
+        return bool(self.tty) and self.stdout.isatty()
+
+    def resize(self, height, width, **kwargs):
+        """
+        The container's PTY is shared, so viewers leave its size alone.
+        """
+
+    def __repr__(self):
+        return "{cls}({path}, {container})".format(cls=type(self).__name__,
+                                                   path=self.path,
+                                                   container=self.container)
+
+
+def _line(obj):
+    return json.dumps(obj).encode('utf-8') + b'\n'
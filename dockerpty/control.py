@@ -0,0 +1,294 @@
+# dockerpty: control.py
+#
+# Copyright 2014 Chris Corbyn <chris@w3style.co.uk>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import functools
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import dockerpty.io as io
+
+
+class Stats(object):
+    """
+    Counters for the calls made through a Pool.
+
+    `hits` counts calls served by an idle client (and so an already open
+    keep-alive connection), `misses` calls which had to create a client, and
+    `waits` calls which found the pool exhausted and waited for a client to
+    be returned. Latencies are kept per method.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.waits = 0
+        self.errors = 0
+        self.methods = {}
+
+    def record(self, name, elapsed, failed=False):
+        """
+        Record a call to `name` which took `elapsed` seconds.
+        """
+
+        with self.lock:
+            count, total, worst = self.methods.get(name, (0, 0.0, 0.0))
+            self.methods[name] = (count + 1, total + elapsed, max(worst, elapsed))
+            if failed:
+                self.errors += 1
+
+    def calls(self, name=None):
+        """
+        Returns the number of calls to `name`, or to any method.
+        """
+
+        if name is not None:
+            return self.methods.get(name, (0,))[0]
+
+        return sum(m[0] for m in self.methods.values())
+
+    def latency(self, name):
+        """
+        Returns the (mean, max) latency of calls to `name`, in seconds.
+        """
+
+        count, total, worst = self.methods.get(name, (0, 0.0, 0.0))
+        if count == 0:
+            return (0.0, 0.0)
+
+        return (total / count, worst)
+
+    def __repr__(self):
+        return "{cls}(calls={calls}, hits={hits}, misses={misses}, waits={waits})".format(
+            cls=type(self).__name__,
+            calls=self.calls(),
+            hits=self.hits,
+            misses=self.misses,
+            waits=self.waits)
+
+
+class Pool(object):
+    """
+    A pool of docker clients for control calls, shared by many sessions.
+
+    Every docker.Client keeps its own keep-alive HTTP connection pool. Giving
+    each session its own client churns connections on the daemon's socket,
+    while sharing one client serializes busy sessions behind it. A Pool keeps
+    up to `size` clients created by `factory()`, lends each call the most
+    recently returned one (so its connection is still warm) and records
+    Stats.
+
+    The Pool has the same methods as the client, so it can be passed anywhere
+    dockerpty expects one:
+
+        pool = Pool(lambda: docker.APIClient(base_url='unix://var/run/docker.sock'))
+        dockerpty.start(pool, container)
+        print(pool.stats)
+    """
+
+    def __init__(self, factory, size=4, clock=io.clock):
+        """
+        Initialize an empty Pool of up to `size` clients.
+        """
+
+        if size < 1:
+            raise ValueError("Pool size must be at least 1")
+
+        self.factory = factory
+        self.size = size
+        self.clock = clock
+        self.idle = []
+        self.created = 0
+        self.closed = False
+        self.available = threading.Condition(threading.Lock())
+        self.stats = Stats()
+
+    def acquire(self):
+        """
+        Returns a client, waiting for one to be released if the pool is full.
+        """
+
+        with self.available:
+            if self.closed:
+                raise RuntimeError("{0!r} is closed".format(self))
+
+            if not self.idle and self.created >= self.size:
+                self.stats.waits += 1
+            while not self.idle and self.created >= self.size:
+                self.available.wait()
+
+            if self.idle:
+                self.stats.hits += 1
+                return self.idle.pop()
+
+            self.stats.misses += 1
+            self.created += 1
+
+        try:
+            return self.factory()
+        except Exception:
+            with self.available:
+                self.created -= 1
+                self.available.notify()
+            raise
+
+    def release(self, client):
+        """
+        Return `client` to the pool.
+        """
+
+        with self.available:
+            if self.closed:
+                _close(client)
+                return
+
+            self.idle.append(client)
+            self.available.notify()
+
+    def call(self, name, *args, **kwargs):
+        """
+        Call the client method `name` on a pooled client.
+        """
+
+        client = self.acquire()
+        started = self.clock()
+        failed = True
+        try:
+            result = getattr(client, name)(*args, **kwargs)
+            failed = False
+            return result
+        finally:
+            self.stats.record(name, self.clock() - started, failed)
+            self.release(client)
+
+    def close(self):
+        """
+        Close the idle clients. Clients in use are closed when released.
+        """
+
+        with self.available:
+            self.closed = True
+            idle, self.idle = self.idle, []
+
+        for client in idle:
+            _close(client)
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+
+        return functools.partial(self.call, name)
+
+    def __repr__(self):
+        return "{cls}(size={size}, created={created})".format(cls=type(self).__name__,
+                                                              size=self.size,
+                                                              created=self.created)
+
+
+class Executor(object):
+    """
+    Runs blocking control calls off a Loop's thread.
+
+    Calls such as resize or inspect go to the daemon and may take a while
+    when it is busy. Making them on the Loop's thread would stall the pumps of
+    every session in it, so they run on `workers` threads instead, and each
+    `callback(future)` is then called back on the Loop's thread with a
+    concurrent.futures.Future holding the outcome.
+
+    `submit_latest()` suits calls where only the newest matters, such as a
+    burst of resizes while the user drags a window: a call still waiting is
+    replaced rather than queued behind, and calls with the same key never run
+    concurrently, so they cannot complete out of order.
+    """
+
+    def __init__(self, loop, workers=2):
+        """
+        Initialize an Executor delivering results to `loop`.
+        """
+
+        self.loop = loop
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.lock = threading.Lock()
+        self.latest = {}
+        self.running = set()
+        self.closed = False
+
+    def submit(self, callback, fn, *args):
+        """
+        Call `fn(*args)` on a worker, then `callback(future)` on the Loop.
+
+        `callback` may be None to ignore the outcome.
+        """
+
+        self.pool.submit(self._call, callback, fn, args)
+
+    def submit_latest(self, key, callback, fn, *args):
+        """
+        Like `submit()`, but replacing any call for `key` which has not begun.
+        """
+
+        with self.lock:
+            scheduled = key in self.latest or key in self.running
+            self.latest[key] = (callback, fn, args)
+
+        if not scheduled:
+            self.pool.submit(self._call_latest, key)
+
+    def close(self):
+        """
+        Stop accepting calls. Calls in progress finish in the background and
+        their callbacks are dropped.
+        """
+
+        self.closed = True
+        self.pool.shutdown(wait=False)
+
+    def _call(self, callback, fn, args):
+        future = Future()
+        try:
+            future.set_result(fn(*args))
+        except Exception as e:
+            future.set_exception(e)
+
+        if callback is not None and not self.closed:
+            self.loop.call_soon_threadsafe(callback, future)
+
+    def _call_latest(self, key):
+        with self.lock:
+            callback, fn, args = self.latest.pop(key)
+            self.running.add(key)
+
+        try:
+            self._call(callback, fn, args)
+        finally:
+            with self.lock:
+                self.running.discard(key)
+                again = key in self.latest
+
+            if again:
+                try:
+                    self.pool.submit(self._call_latest, key)
+                except RuntimeError:  # shut down
+                    pass
+
+    def __repr__(self):
+        return "{cls}({loop})".format(cls=type(self).__name__, loop=self.loop)
+
+
+def _close(client):
+    close = getattr(client, 'close', None)
+    if close is not None:
+        close()
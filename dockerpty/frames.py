@@ -0,0 +1,188 @@
+# dockerpty: frames.py
+#
+# Copyright 2014 Chris Corbyn <chris@w3style.co.uk>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Docker's framing of multiplexed attach streams.
+
+When a container has no tty, docker sends its streams over one socket as
+frames: an 8-byte header holding the stream type (first byte) and the payload
+length (last 4 bytes, big endian), followed by the payload.
+"""
+
+import struct
+
+
+STDIN = 0
+STDOUT = 1
+STDERR = 2
+SYSTEMERR = 3
+
+HEADER = struct.Struct('>BxxxL')
+
+
+def encode(stream, data):
+    """
+    Returns `data` framed for `stream`.
+    """
+
+    return HEADER.pack(stream, len(data)) + data
+
+
+def encode_into(buffer, offset, stream, data):
+    """
+    Frame `data` for `stream` into the writable `buffer` at `offset`, without
+    intermediate copies.
+
+    Returns the offset just past the frame. `buffer` must have room for
+    `HEADER.size + len(data)` bytes. Encoding many frames is fastest into a
+    memoryview of the buffer.
+    """
+
+    end = offset + HEADER.size + len(data)
+    if end > len(buffer):
+        raise ValueError("Frame of {0} bytes does not fit".format(end - offset))
+
+    if not isinstance(buffer, memoryview):
+        # slice assignment to a memoryview never resizes, so is cheaper
+        buffer = memoryview(buffer)
+
+    HEADER.pack_into(buffer, offset, stream, len(data))
+    buffer[offset + HEADER.size:end] = data
+    return end
+
+
+def parse(buffer, offset=0):
+    """
+    Parse the complete frames in `buffer` from `offset`.
+
+    Returns a list of (stream, payload) tuples, whose payloads are memoryviews
+    into `buffer`, and the offset of the first byte not consumed.
+    """
+
+    view = memoryview(buffer)
+    unpack_from = HEADER.unpack_from
+    size = HEADER.size
+    end = len(view)
+    frames = []
+    append = frames.append
+
+    while end - offset >= size:
+        stream, length = unpack_from(view, offset)
+        start = offset + size
+        if end - start < length:
+            break
+        offset = start + length
+        append((stream, view[start:offset]))
+
+    return frames, offset
+
+
+class Decoder(object):
+    """
+    Incremental frame decoder.
+
+    Bytes are fed in as they arrive, split anywhere, and `feed()` returns the
+    (stream, payload) pieces they complete. Payloads are not held back until
+    their frame is complete: a large frame comes out in pieces as it arrives,
+    so memory stays bounded by what was fed. Pieces are never empty.
+
+    With `views` set, pieces are memoryviews into the fed data, which avoids
+    copying payloads; otherwise they are slices of the same type as the data.
+    """
+
+    __slots__ = ('views', 'header', 'stream', 'remain')
+
+    def __init__(self, views=True):
+        self.views = views
+        self.header = bytearray()
+        self.stream = None
+        self.remain = 0
+
+    def feed(self, data):
+        """
+        Decode `data`, returning a list of (stream, payload) pieces.
+        """
+
+        buf = memoryview(data) if self.views else data
+        end = len(buf)
+        pos = 0
+        pieces = []
+
+        if self.remain or self.header:
+            pos = self._resume(pieces, buf)
+            if self.remain or self.header:
+                return pieces
+
+        unpack_from = HEADER.unpack_from
+        append = pieces.append
+
+        while end - pos >= 8:
+            stream, length = unpack_from(buf, pos)
+            start = pos + 8
+            pos = start + length
+            if pos > end:
+                # the rest of the payload has yet to arrive
+                if start < end:
+                    append((stream, buf[start:end]))
+                self.stream = stream
+                self.remain = pos - end
+                return pieces
+            if length:
+                append((stream, buf[start:pos]))
+
+        if pos < end:
+            self.header += buf[pos:]
+
+        return pieces
+
+    def pending(self):
+        """
+        Returns True if a frame has been started but not finished.
+        """
+
+        return bool(self.header or self.remain)
+
+    def _resume(self, pieces, buf):
+        """
+        Continue the frame left unfinished by the last feed.
+        """
+
+        end = len(buf)
+
+        if self.remain:
+            take = min(self.remain, end)
+            if take:
+                pieces.append((self.stream, buf[:take]))
+            self.remain -= take
+            return take
+
+        need = HEADER.size - len(self.header)
+        self.header += buf[:need]
+        if len(self.header) < HEADER.size:
+            return end
+
+        self.stream, length = HEADER.unpack(self.header)
+        del self.header[:]
+
+        take = min(length, end - need)
+        if take:
+            pieces.append((self.stream, buf[need:need + take]))
+        self.remain = length - take
+        return need + take
+
+    def __repr__(self):
+        return "{cls}(remain={remain})".format(cls=type(self).__name__,
+                                               remain=self.remain)
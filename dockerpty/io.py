@@ -17,9 +17,19 @@
 import os
 import fcntl
 import errno
-import struct
+import functools
+import math
 import select as builtin_select
-import six
+import socket
+import sys
+import time
+from collections import deque
+
+import dockerpty.frames as frames
+import dockerpty.transform as transform
+
+
+clock = getattr(time, 'monotonic', time.time)
 
 
 def set_blocking(fd, blocking=True):
@@ -41,38 +51,306 @@ def set_blocking(fd, blocking=True):
     return not bool(old_flag & os.O_NONBLOCK)
 
 
+# poll() on macOS does not support terminals
+_poll = getattr(builtin_select, 'poll', None) if sys.platform != 'darwin' else None
+
+# select() cannot watch descriptors from FD_SETSIZE on; poll() has no limit
+SELECT_LIMIT = None if _poll is not None else 1024
+
+_POLL_READ = _POLL_WRITE = 0
+if _poll is not None:
+    # errors and hang ups are reported as ready, so the read or write fails
+    _POLL_ERRORS = builtin_select.POLLERR | builtin_select.POLLHUP | builtin_select.POLLNVAL
+    _POLL_READ = builtin_select.POLLIN | builtin_select.POLLPRI | _POLL_ERRORS
+    _POLL_WRITE = builtin_select.POLLOUT | _POLL_ERRORS
+
+
 def select(read_streams, write_streams, timeout=0):
     """
     Select the streams from `read_streams` that are ready for reading, and
     streams from `write_streams` ready for writing.
 
-    Uses `select.select()` internally but only returns two lists of ready streams.
+    Uses `poll()` where it is available, so that descriptors above select()'s
+    FD_SETSIZE limit can be watched, and `select.select()` otherwise. Either
+    way, only the two lists of ready streams are returned.
     """
 
-    exception_streams = []
-
     try:
+        if _poll is not None:
+            return _poll_streams(read_streams, write_streams, timeout)
+
         return builtin_select.select(
             read_streams,
             write_streams,
-            exception_streams,
+            [],
             timeout,
         )[0:2]
     except builtin_select.error as e:
         # POSIX signals interrupt select()
-        no = e.errno if six.PY3 else e[0]
+        no = e.args[0]
         if no == errno.EINTR:
             return ([], [])
         else:
             raise e
 
 
+def _poll_streams(read_streams, write_streams, timeout):
+    # as with select(), descriptors may be given as ints
+    reads = [(s, s if isinstance(s, int) else s.fileno()) for s in read_streams]
+    writes = [(s, s if isinstance(s, int) else s.fileno()) for s in write_streams]
+
+    masks = {}
+    for _, fd in reads:
+        masks[fd] = masks.get(fd, 0) | builtin_select.POLLIN | builtin_select.POLLPRI
+    for _, fd in writes:
+        masks[fd] = masks.get(fd, 0) | builtin_select.POLLOUT
+
+    poller = _poll()
+    for fd, mask in masks.items():
+        poller.register(fd, mask)
+
+    ready = dict(poller.poll(None if timeout is None else int(math.ceil(timeout * 1000))))
+    # poll() ignores closed (negative) descriptors, which select() rejects;
+    # they are reported as ready, so that using them fails
+    return ([s for s, fd in reads if fd < 0 or ready.get(fd, 0) & _POLL_READ],
+            [s for s, fd in writes if fd < 0 or ready.get(fd, 0) & _POLL_WRITE])
+
+
+def parse_keys(spec):
+    """
+    Convert a detach key specification into the bytes it produces.
+
+    The format follows docker's `--detach-keys` option: a comma separated list
+    of keys, each either a single character or `ctrl-<value>` where `<value>`
+    is a letter or one of `@`, `[`, `\\`, `]`, `^` or `_`.
+
+    Example:
+
+        parse_keys('ctrl-p,ctrl-q') == b'\\x10\\x11'
+    """
+
+    keys = bytearray()
+
+    for key in spec.split(','):
+        key = key.strip()
+        if key.lower().startswith('ctrl-') and len(key) == 6:
+            code = ord(key[5].upper())
+            if not 0x40 <= code <= 0x5f:
+                raise ValueError("Invalid detach key: {0!r}".format(key))
+            keys.append(code - 0x40)
+        elif len(key) == 1:
+            keys.extend(key.encode('utf-8'))
+        else:
+            raise ValueError("Invalid detach key: {0!r}".format(key))
+
+    return bytes(keys)
+
+
+class TokenBucket(object):
+    """
+    Token bucket limiting the rate at which bytes are pumped.
+
+    The bucket holds up to `burst` tokens, one per byte, and refills at `rate`
+    tokens per second. A Pump only reads as many bytes as there are tokens, and
+    while the bucket is empty it is left out of select(), with `deadline()`
+    telling the loop when to try again. Nothing busy waits.
+
+    The same bucket may be given to several pumps to limit them together.
+
+    `throttled` counts the reads which the bucket cut short while the reader
+    had more data waiting. Pumps ask for a full chunk whatever is waiting, so
+    a request larger than the tokens left is not counted by itself.
+    """
+
+    def __init__(self, rate, burst=None, clock=clock):
+        """
+        Initialize a full TokenBucket refilling at `rate` bytes per second.
+        """
+
+        if rate <= 0:
+            raise ValueError("TokenBucket rate must be positive")
+
+        self.rate = float(rate)
+        self.burst = float(burst or rate)
+        self.tokens = self.burst
+        self.clock = clock
+        self.updated = clock()
+        self.throttled = 0
+
+    def available(self):
+        """
+        Returns the number of whole bytes which may be pumped now.
+        """
+
+        now = self.clock()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return int(self.tokens)
+
+    def allow(self, n):
+        """
+        Returns how many of `n` requested bytes may be pumped now.
+        """
+
+        return min(n, self.available())
+
+    def throttle(self):
+        """
+        Count a read which this bucket held back while data was waiting.
+        """
+
+        self.throttled += 1
+
+    def consume(self, n):
+        """
+        Take `n` tokens from the bucket.
+        """
+
+        self.tokens -= n
+
+    def deadline(self):
+        """
+        Returns the clock() time at which a byte may next be pumped.
+        """
+
+        if self.available() >= 1:
+            return self.updated
+
+        return self.updated + (1 - self.tokens) / self.rate
+
+    def __repr__(self):
+        return "{cls}({rate}, burst={burst})".format(cls=type(self).__name__,
+                                                     rate=self.rate,
+                                                     burst=self.burst)
+
+
+class Waker(object):
+    """
+    Self-pipe used to interrupt a blocking select() from another thread.
+
+    The Waker is selectable for reading; after `wake()` is called it becomes
+    readable until `clear()` drains it.
+    """
+
+    def __init__(self):
+        """
+        Initialize a new Waker, allocating its pipe.
+        """
+
+        self.r, self.w = os.pipe()
+        set_blocking(self.r, False)
+        set_blocking(self.w, False)
+
+    def fileno(self):
+        """
+        Returns the read end of the pipe, for use with select().
+        """
+
+        return self.r
+
+    def wake(self):
+        """
+        Make the Waker readable. Safe to call from any thread.
+        """
+
+        try:
+            os.write(self.w, b'\0')
+        except OSError as e:
+            # a full pipe is already readable
+            if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                raise e
+
+    def clear(self):
+        """
+        Drain any pending wake-ups.
+        """
+
+        try:
+            while os.read(self.r, 4096):
+                pass
+        except OSError as e:
+            if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                raise e
+
+    def close(self):
+        os.close(self.r)
+        os.close(self.w)
+
+    def __repr__(self):
+        return "{cls}({r}, {w})".format(cls=type(self).__name__,
+                                        r=self.r,
+                                        w=self.w)
+
+
+class KeyMatcher(object):
+    """
+    Streaming matcher for a key sequence typed on stdin.
+
+    Data is fed through the matcher in arbitrary chunks. Bytes which could be
+    the start of the sequence are held back until a later chunk decides whether
+    they complete it, so a sequence split across two reads is still found.
+    """
+
+    def __init__(self, sequence):
+        """
+        Initialize a KeyMatcher looking for the bytes `sequence`.
+        """
+
+        self.sequence = sequence
+        self.held = b''
+        self.matched = False
+
+    def feed(self, data):
+        """
+        Feed `data` through the matcher and return the bytes safe to forward.
+
+        Once the sequence is seen `matched` is set to True and the sequence,
+        along with anything following it, is discarded.
+        """
+
+        if self.held:
+            data = self.held + data
+            self.held = b''
+
+        index = data.find(self.sequence)
+        if index >= 0:
+            self.matched = True
+            return data[:index]
+
+        # hold back the longest tail of data that is a prefix of the sequence
+        for keep in range(min(len(self.sequence) - 1, len(data)), 0, -1):
+            if data.endswith(self.sequence[:keep]):
+                self.held = data[-keep:]
+                return data[:-keep]
+
+        return data
+
+    def flush(self):
+        """
+        Return any held back bytes, e.g. at EOF.
+        """
+
+        held, self.held = self.held, b''
+        return held
+
+    def __repr__(self):
+        return "{cls}({sequence!r})".format(cls=type(self).__name__,
+                                            sequence=self.sequence)
+
+
 class Stream(object):
     """
     Generic Stream class.
 
     This is a file-like abstraction on top of os.read() and os.write(), which
     add consistency to the reading of sockets and files alike.
+
+    Constructing a Stream returns a SocketStream when `fd` is a socket, or a
+    socket.SocketIO wrapping one (an SSLSocketStream for ssl sockets), and a
+    FileStream otherwise.
+    Each binds the calls it reads and writes with once, at construction,
+    rather than choosing on every read and write. Other subclasses of Stream
+    choose on each call, as Stream always used to.
     """
 
     """
@@ -84,6 +362,17 @@ class Stream(object):
         errno.EWOULDBLOCK,
     ]
 
+    def __new__(cls, fd, *args, **kwargs):
+        if cls is Stream:
+            sock = socket_of(fd)
+            if sock is None:
+                cls = FileStream
+            elif is_ssl_socket(sock):
+                cls = SSLSocketStream
+            else:
+                cls = SocketStream
+        return object.__new__(cls)
+
     def __init__(self, fd):
         """
         Initialize the Stream for the file descriptor `fd`.
@@ -94,6 +383,7 @@ class Stream(object):
         self.buffer = b''
         self.close_requested = False
         self.closed = False
+        self.shutdown_requested = False
 
     def fileno(self):
         """
@@ -103,11 +393,7 @@ class Stream(object):
         return self.fd.fileno()
 
     def set_blocking(self, value):
-        if hasattr(self.fd, 'setblocking'):
-            self.fd.setblocking(value)
-            return True
-        else:
-            return set_blocking(self.fd, value)
+        return set_blocking(self.fd, value)
 
     def read(self, n=4096):
         """
@@ -116,14 +402,11 @@ class Stream(object):
 
         while True:
             try:
-                if hasattr(self.fd, 'recv'):
-                    return self.fd.recv(n)
-                return os.read(self.fd.fileno(), n)
+                return self._read(n)
             except EnvironmentError as e:
                 if e.errno not in Stream.ERRNO_RECOVERABLE:
                     raise e
 
-
     def write(self, data):
         """
         Write `data` to the Stream. Not all data may be written right away.
@@ -142,24 +425,46 @@ class Stream(object):
     def do_write(self):
         """
         Flushes as much pending data from the internal write buffer as possible.
+
+        Returns the number of bytes written, which is zero if the fd would
+        block.
         """
         while True:
             try:
-                written = 0
-
-                if hasattr(self.fd, 'send'):
-                    written = self.fd.send(self.buffer)
-                else:
-                    written = os.write(self.fd.fileno(), self.buffer)
+                written = self._write(self.buffer)
 
                 self.buffer = self.buffer[written:]
 
                 # try to close after writes if a close was requested
-                if self.close_requested and len(self.buffer) == 0:
-                    self.close()
+                if len(self.buffer) == 0:
+                    if self.close_requested:
+                        self.close()
+                    elif self.shutdown_requested:
+                        self.shutdown_write()
 
                 return written
             except EnvironmentError as e:
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    # the rest is written once select() finds the fd writable
+                    return 0
+                if e.errno not in Stream.ERRNO_RECOVERABLE:
+                    raise e
+
+    def write_some(self, data):
+        """
+        Write as much of `data` as the fd will take right now, bypassing the
+        internal write buffer.
+
+        Returns the number of bytes written, which is zero if the fd would
+        block.
+        """
+
+        while True:
+            try:
+                return self._write(data)
+            except EnvironmentError as e:
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return 0
                 if e.errno not in Stream.ERRNO_RECOVERABLE:
                     raise e
 
@@ -176,13 +481,274 @@ class Stream(object):
         # to write.
         if not self.closed and len(self.buffer) == 0:
             self.closed = True
-            if hasattr(self.fd, 'close'):
-                self.fd.close()
-            else:
-                os.close(self.fd.fileno())
+            self._close()
+
+    def abort(self):
+        """
+        Close the fd now, discarding any data pending to write.
+        """
+
+        self.buffer = b''
+        self.close_requested = True
+        if not self.closed:
+            self.closed = True
+            self._close()
+
+    def shutdown_write(self):
+        """
+        Signal EOF to the other end once pending data is written, while leaving
+        the Stream open for reading.
+
+        Sockets are shut down for writing. Other descriptors cannot be half
+        closed, so they are closed.
+        """
+
+        self.shutdown_requested = True
+
+        if not self.closed and len(self.buffer) == 0:
+            self._shutdown_write()
+
+    def _shutdown_write(self):
+        self.close()
+
+    def _read(self, n):
+        sock = socket_of(self.fd)
+        if sock is not None:
+            return sock.recv(n)
+        return os.read(self.fd.fileno(), n)
+
+    def _write(self, data):
+        sock = socket_of(self.fd)
+        if sock is not None:
+            return sock.send(data)
+        return os.write(self.fd.fileno(), data)
+
+    def _close(self):
+        if hasattr(self.fd, 'close'):
+            self.fd.close()
+        else:
+            os.close(self.fd.fileno())
+
+    def __repr__(self):
+        # subclasses are an implementation detail of Stream()
+        return "Stream({fd})".format(fd=self.fd)
+
+
+class SocketStream(Stream):
+    """
+    Stream over a socket, using recv() and send().
+
+    `fd` may be a socket.SocketIO, as docker-py returns for unix sockets on
+    Python 3, in which case the socket under it is used.
+    """
+
+    __slots__ = ('sock',)
+
+    def __init__(self, fd):
+        super(SocketStream, self).__init__(fd)
+        self.sock = socket_of(fd)
+        self._read = self.sock.recv
+        self._write = getattr(self.sock, 'send', None)
+
+    def set_blocking(self, value):
+        self.sock.setblocking(value)
+        return True
+
+    def _shutdown_write(self):
+        try:
+            self.sock.shutdown(socket.SHUT_WR)
+        except EnvironmentError as e:
+            # the peer may have gone already
+            if e.errno != errno.ENOTCONN:
+                raise e
+
+    def _close(self):
+        self.fd.close()
+        if self.sock is not self.fd:
+            self.sock.close()
+
+
+class SSLSocketStream(SocketStream):
+    """
+    Stream over an ssl.SSLSocket.
+
+    TLS records are decrypted whole, so the SSL object may hold data which
+    has already left the socket, where select() cannot see it. `buffered()`
+    reports it, so that the loop reads it without waiting for the socket.
+
+    A non-blocking read may need the socket to be writable (e.g. during
+    renegotiation). The read then raises EAGAIN and `wants_write()` returns
+    True, so the loop watches the socket for writing and retries the read once
+    it is writable. Writes which cannot complete keep their data buffered.
+
+    The ssl module cannot shut down only the writing side of a TLS
+    connection, so `shutdown_write()` closes it.
+    """
+
+    __slots__ = ('read_wants_write', 'retry_read')
+
+    def __init__(self, fd):
+        super(SSLSocketStream, self).__init__(fd)
+        self.read_wants_write = False
+        self.retry_read = False
+
+    def read(self, n=4096):
+        ssl = sys.modules['ssl']
+        self.retry_read = False
+
+        try:
+            return super(SSLSocketStream, self).read(n)
+        except ssl.SSLWantReadError:
+            raise OSError(errno.EAGAIN, "SSL read needs more data")
+        except ssl.SSLWantWriteError:
+            self.read_wants_write = True
+            raise OSError(errno.EAGAIN, "SSL read needs the socket to be writable")
+        except ssl.SSLZeroReturnError:
+            return b''
+
+    def _shutdown_write(self):
+        self.close()
+
+    def buffered(self):
+        """
+        Returns the number of decrypted bytes waiting in the SSL object, or
+        True if a read must be retried.
+        """
+
+        return self.sock.pending() or self.retry_read
+
+    def wants_write(self):
+        return self.read_wants_write
+
+    def needs_write(self):
+        return len(self.buffer) > 0 or self.read_wants_write
+
+    def do_write(self):
+        if self.read_wants_write:
+            self.read_wants_write = False
+            self.retry_read = True
+
+        if not self.buffer:
+            return 0
+
+        ssl = sys.modules['ssl']
+        try:
+            return super(SSLSocketStream, self).do_write()
+        except (ssl.SSLWantReadError, ssl.SSLWantWriteError):
+            return 0
+
+    def write_some(self, data):
+        ssl = sys.modules['ssl']
+        try:
+            return super(SSLSocketStream, self).write_some(data)
+        except (ssl.SSLWantReadError, ssl.SSLWantWriteError):
+            return 0
+
+
+class FileStream(Stream):
+    """
+    Stream over a file descriptor, using os.read() and os.write().
+    """
+
+    __slots__ = ()
+
+    def __init__(self, fd):
+        super(FileStream, self).__init__(fd)
+        try:
+            fileno = fd.fileno()
+        except (AttributeError, ValueError, EnvironmentError):
+            # not backed by a descriptor (e.g. StringIO); fail on use instead
+            self._read = lambda n: os.read(fd.fileno(), n)
+            self._write = lambda data: os.write(fd.fileno(), data)
+        else:
+            self._read = functools.partial(os.read, fileno)
+            self._write = functools.partial(os.write, fileno)
+
+
+def is_ssl_socket(fd):
+    """
+    Returns True if `fd` is an ssl.SSLSocket.
+
+    ssl is not imported here: if nothing else has imported it, `fd` cannot
+    be an SSLSocket.
+    """
+
+    ssl = sys.modules.get('ssl')
+    return ssl is not None and isinstance(fd, ssl.SSLSocket)
+
+
+def socket_of(fd):
+    """
+    Returns the socket `fd` is, or wraps as a socket.SocketIO, or None.
+    """
+
+    if hasattr(fd, 'recv'):
+        return fd
+
+    sock = getattr(fd, '_sock', None)
+    if sock is not None and hasattr(sock, 'recv'):
+        return sock
+
+    return None
+
+
+def as_stream(fd):
+    """
+    Returns `fd` wrapped in a Stream, unless it is already stream-like (i.e. it
+    has the `needs_write()` method of the Stream write interface).
+    """
+
+    if hasattr(fd, 'needs_write'):
+        return fd
+
+    return Stream(fd)
+
+
+class QueueStream(object):
+    """
+    The writing end of a Stream which puts each chunk written on a queue.
+
+    Used to hand output from an I/O thread to consumers on other threads. The
+    queue does its own locking; nothing is ever left pending here.
+    """
+
+    def __init__(self, queue):
+        """
+        Initialize a QueueStream putting chunks on `queue`.
+        """
+
+        self.queue = queue
+        self.closed = False
+
+    def isatty(self):
+        return False
+
+    def write(self, data):
+        """
+        Put `data` on the queue, returning its length.
+        """
+
+        if not data:
+            return None
+
+        self.queue.put(transform.as_bytes(data))
+        return len(data)
+
+    def needs_write(self):
+        return False
+
+    def do_write(self):
+        return 0
+
+    def close(self):
+        self.closed = True
 
     def __repr__(self):
-        return "{cls}({fd})".format(cls=type(self).__name__, fd=self.fd)
+        return "{cls}({queue})".format(cls=type(self).__name__,
+                                       queue=self.queue)
+
+
+HEADER = frames.HEADER
 
 
 class Demuxer(object):
@@ -199,6 +765,10 @@ class Demuxer(object):
     The next 4 bytes indicate the length of the following chunk of data as an
     integer in big endian format. This much data must be consumed before the
     next 8-byte header is read.
+
+    Frames are decoded by a frames.Decoder, so however the data is split
+    between reads, each read of the stream decodes every frame it completes.
+    Payload decoded but not yet read is reported by `buffered()`.
     """
 
     def __init__(self, stream):
@@ -207,7 +777,8 @@ class Demuxer(object):
         """
 
         self.stream = stream
-        self.remain = 0
+        self.decoder = frames.Decoder(views=False)
+        self.pieces = deque()
 
     def fileno(self):
         """
@@ -228,23 +799,53 @@ class Demuxer(object):
         Less than `n` bytes of data may be returned depending on the available
         payload, but the number of bytes returned will never exceed `n`.
 
-        Because demuxing involves scanning 8-byte headers, the actual amount of
-        data read from the underlying stream may be greater than `n`.
+        If the read brings no payload, only part of a header, EAGAIN is
+        raised rather than reading again, which could block.
         """
 
-        size = self._next_packet_size(n)
+        pieces = self.pieces
 
-        if size <= 0:
-            return
-        else:
-            data = six.binary_type()
-            while len(data) < size:
-                nxt = self.stream.read(size - len(data))
-                if not nxt:
-                    # the stream has closed, return what data we got
-                    return data
-                data = data + nxt
-            return data
+        if not pieces:
+            data = self.stream.read(n + HEADER.size)
+            if not data:
+                return None
+            decoded = self.decoder.feed(data)
+            if not decoded:
+                raise OSError(errno.EAGAIN, "Waiting for the rest of a frame header")
+
+            if len(decoded) == 1 and len(decoded[0][1]) <= n:
+                # the common case: one frame per read
+                return decoded[0][1]
+
+            pieces.extend(decoded)
+
+        stream, piece = pieces[0]
+        if len(piece) > n:
+            pieces[0] = (stream, piece[n:])
+            return piece[:n]
+
+        pieces.popleft()
+        return piece
+
+    def buffered(self):
+        """
+        Returns True if decoded payload is waiting to be read, or if the
+        underlying Stream has data buffered.
+        """
+
+        if self.pieces:
+            return True
+
+        buffered = getattr(self.stream, 'buffered', None)
+        return buffered is not None and buffered()
+
+    def wants_write(self):
+        """
+        Delegates to the underlying Stream.
+        """
+
+        wants_write = getattr(self.stream, 'wants_write', None)
+        return wants_write is not None and wants_write()
 
     def write(self, data):
         """
@@ -280,29 +881,209 @@ class Demuxer(object):
 
         return self.stream.close()
 
-    def _next_packet_size(self, n=0):
-        size = 0
+    def shutdown_write(self):
+        """
+        Delegates to underlying Stream.
+        """
 
-        if self.remain > 0:
-            size = min(n, self.remain)
-            self.remain -= size
-        else:
-            data = six.binary_type()
-            while len(data) < 8:
-                nxt = self.stream.read(8 - len(data))
-                if not nxt:
-                    # The stream has closed, there's nothing more to read
-                    return 0
-                data = data + nxt
+        return self.stream.shutdown_write()
 
-            if data is None:
-                return 0
-            if len(data) == 8:
-                __, actual = struct.unpack('>BxxxL', data)
-                size = min(n, actual)
-                self.remain = actual - size
+    def __repr__(self):
+        return "{cls}({stream})".format(cls=type(self).__name__,
+                                        stream=self.stream)
+
+
+class RingBuffer(object):
+    """
+    Fixed-size buffer retaining the last `size` bytes written to it.
+
+    The storage is allocated once, up front. Writes are copied into it in
+    place, overwriting the oldest data, so appending never reallocates and
+    costs the same however much has been written before.
+
+    This is useful for keeping the recent output of a container so that it can
+    be replayed to a late subscriber, without asking docker for the logs.
+    """
+
+    def __init__(self, size):
+        """
+        Initialize an empty RingBuffer holding at most `size` bytes.
+        """
+
+        if size <= 0:
+            raise ValueError("RingBuffer size must be positive")
+
+        self.size = size
+        self.buffer = bytearray(size)
+        self.view = memoryview(self.buffer)
+        self.end = 0
+        self.length = 0
+
+    def write(self, data):
+        """
+        Append `data`, discarding the oldest bytes beyond `size`.
+
+        Returns the number of bytes written, which is always `len(data)`.
+        """
+
+        data = memoryview(data)
+        n = len(data)
+
+        if n >= self.size:
+            self.view[:] = data[n - self.size:]
+            self.end = 0
+            self.length = self.size
+            return n
+
+        first = min(n, self.size - self.end)
+        self.view[self.end:self.end + first] = data[:first]
+        if first < n:
+            self.view[:n - first] = data[first:]
+
+        self.end = (self.end + n) % self.size
+        self.length = min(self.length + n, self.size)
+
+        return n
+
+    def chunks(self):
+        """
+        Returns the retained data, oldest first, as at most two memoryviews.
+
+        The views reference the buffer itself and are only valid until the
+        next `write()`.
+        """
+
+        start = (self.end - self.length) % self.size
+
+        if start + self.length <= self.size:
+            return [self.view[start:start + self.length]]
+
+        return [self.view[start:], self.view[:self.end]]
+
+    def getvalue(self):
+        """
+        Returns a copy of the retained data.
+        """
+
+        return b''.join(c.tobytes() for c in self.chunks())
+
+    def replay(self, stream):
+        """
+        Write the retained data to `stream`, oldest first.
+        """
+
+        for chunk in self.chunks():
+            if len(chunk):
+                stream.write(chunk.tobytes())
+
+    def clear(self):
+        """
+        Discard all retained data. The storage is kept.
+        """
+
+        self.end = 0
+        self.length = 0
+
+    def __len__(self):
+        return self.length
+
+    def __repr__(self):
+        return "{cls}({size})".format(cls=type(self).__name__, size=self.size)
+
+
+class Tap(object):
+    """
+    Wraps a Stream to record a copy of everything read from it.
+
+    Every chunk returned by `read()` is also written to `recorder`, which need
+    only provide a `write()` method. Used to keep scrollback of a container's
+    output.
+    """
+
+    def __init__(self, stream, recorder):
+        """
+        Initialize a new Tap reading from `stream` into `recorder`.
+        """
+
+        self.stream = stream
+        self.recorder = recorder
+
+    def fileno(self):
+        """
+        Returns the fileno() of the underlying Stream.
+        """
+
+        return self.stream.fileno()
+
+    def set_blocking(self, value):
+        return self.stream.set_blocking(value)
+
+    def read(self, n=4096):
+        """
+        Read up to `n` bytes from the Stream, recording them.
+        """
+
+        data = self.stream.read(n)
+        if data:
+            self.recorder.write(data)
+        return data
+
+    def buffered(self):
+        """
+        Delegates to the underlying Stream.
+        """
+
+        buffered = getattr(self.stream, 'buffered', None)
+        return buffered is not None and buffered()
+
+    def wants_write(self):
+        """
+        Delegates to the underlying Stream.
+        """
+
+        wants_write = getattr(self.stream, 'wants_write', None)
+        return wants_write is not None and wants_write()
+
+    def write(self, data):
+        """
+        Delegates to the underlying Stream.
+        """
+
+        return self.stream.write(data)
+
+    def needs_write(self):
+        """
+        Delegates to underlying Stream.
+        """
+
+        if hasattr(self.stream, 'needs_write'):
+            return self.stream.needs_write()
+
+        return False
+
+    def do_write(self):
+        """
+        Delegates to underlying Stream.
+        """
+
+        if hasattr(self.stream, 'do_write'):
+            return self.stream.do_write()
+
+        return False
+
+    def close(self):
+        """
+        Delegates to underlying Stream.
+        """
+
+        return self.stream.close()
+
+    def shutdown_write(self):
+        """
+        Delegates to underlying Stream.
+        """
 
-        return size
+        return self.stream.shutdown_write()
 
     def __repr__(self):
         return "{cls}({stream})".format(cls=type(self).__name__,
@@ -327,19 +1108,41 @@ class Pump(object):
                  from_stream,
                  to_stream,
                  wait_for_output=True,
-                 propagate_close=True):
+                 propagate_close=True,
+                 detach_keys=None,
+                 limits=None,
+                 transforms=None,
+                 half_close=False):
         """
         Initialize a Pump with a Stream to read from and another to write to.
 
         `wait_for_output` is a flag that says that we need to wait for EOF
         on the from_stream in order to consider this pump as "done".
+
+        `detach_keys` is an optional byte sequence which, when read from the
+        from_stream, stops the pump without closing the to_stream. The sequence
+        itself is never forwarded.
+
+        `limits` is an optional list of TokenBuckets, all of which must have
+        tokens for data to be read.
+
+        `transforms` is an optional list of transform.Transform stages which
+        each chunk passes through, in order, before it is written.
+
+        `half_close` makes EOF only shut down the writing side of the
+        to_stream, for sockets which carry output back as well.
         """
 
         self.from_stream = from_stream
         self.to_stream = to_stream
         self.eof = False
+        self.detached = False
         self.wait_for_output = wait_for_output
         self.propagate_close = propagate_close
+        self.matcher = KeyMatcher(detach_keys) if detach_keys else None
+        self.limits = limits or []
+        self.transforms = transforms or []
+        self.half_close = half_close
 
     def fileno(self):
         """
@@ -358,25 +1161,130 @@ class Pump(object):
         Flush `n` bytes of data from the reader Stream to the writer Stream.
 
         Returns the number of bytes that were actually flushed. A return value
-        of zero is not an error.
+        of zero is not an error; readers with nothing to return yet (e.g. only
+        part of a frame has arrived) may raise an EAGAIN OSError to say so.
 
-        If EOF has been reached, `None` is returned.
+        If EOF has been reached, or the detach keys were read, `None` is
+        returned.
         """
 
+        allowed = self._allow(n)
+        if allowed == 0:
+            return 0
+
         try:
-            read = self.from_stream.read(n)
+            read = self.from_stream.read(allowed)
 
             if read is None or len(read) == 0:
                 self.eof = True
+                self._write_final()
                 if self.propagate_close:
-                    self.to_stream.close()
+                    if self.half_close:
+                        self.to_stream.shutdown_write()
+                    else:
+                        self.to_stream.close()
                 return None
 
+            self._consume(len(read), allowed < n and len(read) == allowed)
+
+            if self.matcher is not None:
+                read = self.matcher.feed(read)
+                if self.matcher.matched:
+                    self.eof = True
+                    self.detached = True
+                    if self.transforms:
+                        read = transform.apply(self.transforms, read)
+                    self.to_stream.write(read)
+                    return None
+
+            if self.transforms:
+                read = transform.apply(self.transforms, read)
+                if not read:
+                    return 0
+
             return self.to_stream.write(read)
         except OSError as e:
+            if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                # the reader had nothing for us after all
+                return 0
             if e.errno != errno.EPIPE:
                 raise e
 
+    def readable(self):
+        """
+        Returns True if the pump wants to be flushed when its reader is ready.
+
+        A pump is not readable while rate limited, or while its writer reports
+        that it is `full()`, so that a slow writer applies backpressure.
+        """
+
+        if self.eof:
+            return False
+
+        if hasattr(self.to_stream, 'full') and self.to_stream.full():
+            return False
+
+        return all(b.available() >= 1 for b in self.limits)
+
+    def buffered(self):
+        """
+        Returns True if the reader already holds data for a readable pump.
+
+        Such data cannot wake select(), so the loop flushes the pump without
+        waiting for its file descriptor.
+        """
+
+        buffered = getattr(self.from_stream, 'buffered', None)
+        return buffered is not None and bool(buffered()) and self.readable()
+
+    def deadline(self):
+        """
+        Returns the clock() time at which a rate limited pump may read again,
+        or a transform wants what it holds released, or None if neither.
+        """
+
+        if self.eof:
+            return None
+
+        deadlines = []
+        empty = [b for b in self.limits if b.available() < 1]
+        if empty:
+            deadlines.append(max(b.deadline() for b in empty))
+        if self.transforms:
+            held = transform.deadline(self.transforms)
+            if held is not None:
+                deadlines.append(held)
+
+        return min(deadlines) if deadlines else None
+
+    def release_held(self):
+        """
+        Write out what transforms have held back past their deadlines.
+        """
+
+        if self.eof or not self.transforms:
+            return
+
+        data = transform.release(self.transforms, clock())
+        if data:
+            self.to_stream.write(data)
+
+    def write_streams(self):
+        """
+        Returns the streams this pump writes to which have data pending, and
+        the stream it reads from if a read is waiting for it to be writable.
+        """
+
+        streams = []
+        if self.to_stream.needs_write():
+            streams.append(self.to_stream)
+
+        wants_write = getattr(self.from_stream, 'wants_write', None)
+        if wants_write is not None and wants_write():
+            streams.append(self.from_stream)
+
+        return streams
+
     def is_done(self):
         """
         Returns True if the read stream is done (either it's returned EOF or
@@ -387,8 +1295,313 @@ class Pump(object):
         return (not self.wait_for_output or self.eof) and \
                 not (hasattr(self.to_stream, 'needs_write') and self.to_stream.needs_write())
 
+    def _write_final(self):
+        """
+        Write out whatever the detach matcher and transforms held back.
+        """
+
+        data = b''
+        if self.matcher is not None:
+            data = self.matcher.flush()
+        if self.transforms:
+            data = b''.join((transform.apply(self.transforms, data),
+                             transform.finish(self.transforms)))
+        if data:
+            self.to_stream.write(data)
+
+    def _allow(self, n):
+        for bucket in self.limits:
+            n = bucket.allow(n)
+        return n
+
+    def _consume(self, n, held_back=False):
+        """
+        Take `n` bytes read from the limits. `held_back` says the limits cut
+        the read short and the reader filled what was left, so more data was
+        waiting; the buckets it emptied count it as throttled.
+        """
+
+        for bucket in self.limits:
+            bucket.consume(n)
+            if held_back and bucket.tokens < 1:
+                bucket.throttle()
+
     def __repr__(self):
         return "{cls}(from={from_stream}, to={to_stream})".format(
             cls=type(self).__name__,
             from_stream=self.from_stream,
             to_stream=self.to_stream)
+
+
+class Sink(object):
+    """
+    One destination of a BroadcastPump.
+
+    A Sink does not hold a copy of the data it has yet to write. Instead it
+    keeps a cursor into the pump's shared buffer, and the pump only discards
+    data once every Sink has written it.
+
+    `policy` decides what happens when more than `limit` bytes are pending:
+
+      - BLOCK stops the pump reading until the Sink catches up.
+      - DROP discards the oldest pending bytes, counting them in `dropped`.
+      - DISCONNECT closes the Sink and removes it from the pump.
+
+    Only BLOCK can stall the other Sinks. The stream should be non-blocking,
+    otherwise a slow consumer stalls the pump whatever the policy.
+    """
+
+    BLOCK = 'block'
+    DROP = 'drop'
+    DISCONNECT = 'disconnect'
+
+    def __init__(self, stream, policy=BLOCK, limit=65536):
+        """
+        Initialize a Sink writing to `stream`.
+
+        If `stream` has a `write_some()` method (i.e. it is a Stream) data is
+        written to it as its fd allows. Otherwise `write()` is expected to
+        accept all of the data immediately, as files in memory do.
+        """
+
+        if policy not in (Sink.BLOCK, Sink.DROP, Sink.DISCONNECT):
+            raise ValueError("Unknown sink policy: {0!r}".format(policy))
+
+        self.stream = stream
+        self.policy = policy
+        self.limit = limit
+        self.pump = None
+        self.cursor = 0
+        self.dropped = 0
+        self.disconnected = False
+        self.close_requested = False
+
+    def fileno(self):
+        """
+        Returns the fileno() of the Stream, so that Sinks are selectable.
+        """
+
+        return self.stream.fileno()
+
+    def pending(self):
+        """
+        Returns the number of bytes the Sink has yet to write.
+        """
+
+        if self.pump is None or self.disconnected:
+            return 0
+
+        return self.pump.head - self.cursor
+
+    def needs_write(self):
+        """
+        Returns True if the Sink has data waiting to be written.
+        """
+
+        return self.pending() > 0
+
+    def do_write(self):
+        """
+        Write as much pending data as possible and returns the amount written.
+        """
+
+        if not self.needs_write():
+            return 0
+
+        pump = self.pump
+        data = memoryview(pump.buffer)[self.cursor - pump.base:]
+
+        try:
+            if hasattr(self.stream, 'write_some'):
+                written = self.stream.write_some(data)
+            else:
+                self.stream.write(data.tobytes())
+                written = len(data)
+        except EnvironmentError as e:
+            if e.errno != errno.EPIPE:
+                raise e
+            self.disconnect()
+            return 0
+        finally:
+            data.release()
+
+        self.cursor += written
+
+        if self.close_requested and not self.needs_write():
+            self.close()
+
+        return written
+
+    def enforce(self):
+        """
+        Apply the Sink's policy if it has fallen more than `limit` behind.
+
+        Returns True if the Sink is blocking the pump.
+        """
+
+        over = self.pending() - self.limit
+        if over <= 0:
+            return False
+
+        if self.policy == Sink.DROP:
+            self.cursor += over
+            self.dropped += over
+        elif self.policy == Sink.DISCONNECT:
+            self.disconnect()
+        else:
+            return True
+
+        return False
+
+    def disconnect(self):
+        """
+        Close the Sink and stop it receiving data.
+        """
+
+        self.disconnected = True
+        self.close()
+
+    def close(self):
+        """
+        Close the stream once all pending data is written.
+        """
+
+        self.close_requested = True
+        if not self.needs_write() and hasattr(self.stream, 'close'):
+            self.stream.close()
+
+    def __repr__(self):
+        return "{cls}({stream}, policy={policy})".format(
+            cls=type(self).__name__,
+            stream=self.stream,
+            policy=self.policy)
+
+
+class BroadcastPump(Pump):
+    """
+    A Pump which writes everything it reads to several Sinks.
+
+    Each chunk read is appended once to a buffer shared by all the Sinks, each
+    of which writes from its own position in it. Data is discarded once the
+    slowest Sink has written it, so one slow Sink (with a DROP or DISCONNECT
+    policy) does not hold up the others.
+
+    Example:
+
+        pump = BroadcastPump(pty_stdout, [
+            Sink(Stream(sys.stdout)),
+            Sink(Stream(recorder), policy=Sink.DROP),
+            Sink(Stream(shipper), policy=Sink.DISCONNECT),
+        ])
+    """
+
+    def __init__(self,
+                 from_stream,
+                 sinks,
+                 wait_for_output=True,
+                 propagate_close=True,
+                 limits=None):
+        """
+        Initialize a BroadcastPump reading from `from_stream` into `sinks`.
+        """
+
+        super(BroadcastPump, self).__init__(from_stream,
+                                            None,
+                                            wait_for_output=wait_for_output,
+                                            propagate_close=propagate_close,
+                                            limits=limits)
+        self.buffer = bytearray()
+        self.base = 0
+        self.head = 0
+        self.sinks = []
+
+        for sink in sinks:
+            self.add_sink(sink)
+
+    def add_sink(self, sink):
+        """
+        Start writing to `sink`, beginning with the next chunk read.
+        """
+
+        sink.pump = self
+        sink.cursor = self.head
+        self.sinks.append(sink)
+
+    def flush(self, n=4096):
+        """
+        Read `n` bytes of data and write them to every Sink.
+
+        Returns the number of bytes read, or `None` at EOF.
+        """
+
+        allowed = self._allow(n)
+        if allowed == 0:
+            return 0
+
+        try:
+            read = self.from_stream.read(allowed)
+        except OSError as e:
+            if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return 0
+            raise e
+
+        if read is None or len(read) == 0:
+            self.eof = True
+            if self.propagate_close:
+                for sink in self.sinks:
+                    sink.close()
+            return None
+
+        self._consume(len(read), allowed < n and len(read) == allowed)
+        self.buffer += read
+        self.head += len(read)
+
+        for sink in self.sinks:
+            sink.do_write()
+            sink.enforce()
+
+        self.sinks = [s for s in self.sinks if not s.disconnected]
+        self._compact()
+
+        return len(read)
+
+    def readable(self):
+        """
+        Returns False at EOF, while rate limited, or while a BLOCK Sink is over
+        its limit.
+        """
+
+        return super(BroadcastPump, self).readable() and \
+                not any(s.enforce() for s in self.sinks)
+
+    def write_streams(self):
+        """
+        Returns the Sinks which have data pending.
+        """
+
+        self._compact()
+        return [s for s in self.sinks if s.needs_write()]
+
+    def is_done(self):
+        """
+        Returns True if the pump is done reading and every Sink is drained.
+        """
+
+        return (not self.wait_for_output or self.eof) and \
+                not any(s.needs_write() for s in self.sinks)
+
+    def _compact(self):
+        """
+        Discard data which every Sink has written.
+        """
+
+        low = min([s.cursor for s in self.sinks] or [self.head])
+        if low - self.base > len(self.buffer) // 2:
+            del self.buffer[:low - self.base]
+            self.base = low
+
+    def __repr__(self):
+        return "{cls}(from={from_stream}, to={sinks})".format(
+            cls=type(self).__name__,
+            from_stream=self.from_stream,
+            sinks=self.sinks)
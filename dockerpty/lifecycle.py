@@ -0,0 +1,185 @@
+# dockerpty: lifecycle.py
+#
+# Copyright 2014 Chris Corbyn <chris@w3style.co.uk>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Owning the resources of a session, so that they are released however it ends.
+"""
+
+import threading
+
+
+class Counters(object):
+    """
+    Counts of the streams adopted and released by Lifecycles.
+
+    In a service running session after session, `open` should stay level; if
+    it grows, streams are leaking.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.adopted = 0
+        self.released = 0
+        self.errors = 0
+
+    @property
+    def open(self):
+        """
+        Returns the number of streams adopted and not yet released.
+        """
+
+        return self.adopted - self.released
+
+    def __repr__(self):
+        return "{cls}(open={open}, adopted={adopted})".format(cls=type(self).__name__,
+                                                              open=self.open,
+                                                              adopted=self.adopted)
+
+
+# shared by every Lifecycle not given its own
+counters = Counters()
+
+
+class CancelToken(object):
+    """
+    Cancels the sessions it is given to, from any thread.
+
+    A cancelled session stops pumping and releases its resources, as if its
+    PTY had closed. A token may be shared by several sessions, and cancelling
+    a token before a session starts makes it return straight away.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.cancelled = False
+        self.callbacks = []
+
+    def cancel(self):
+        """
+        Cancel every session using the token. Safe to call from any thread.
+        """
+
+        with self.lock:
+            if self.cancelled:
+                return
+            self.cancelled = True
+            callbacks, self.callbacks = self.callbacks, []
+
+        for callback in callbacks:
+            callback()
+
+    def add_callback(self, callback):
+        """
+        Call `callback()` on cancellation, or now if already cancelled.
+        """
+
+        with self.lock:
+            if not self.cancelled:
+                self.callbacks.append(callback)
+                return
+
+        callback()
+
+    def remove_callback(self, callback):
+        with self.lock:
+            if callback in self.callbacks:
+                self.callbacks.remove(callback)
+
+    def __repr__(self):
+        return "{cls}(cancelled={cancelled})".format(cls=type(self).__name__,
+                                                     cancelled=self.cancelled)
+
+
+class Lifecycle(object):
+    """
+    Context manager owning the streams of one session.
+
+    Streams adopted are closed when the block exits, in the reverse order of
+    adoption, whether it returns or raises. Output still buffered for a
+    stream is discarded, since nothing will be left to write it. A stream
+    which fails to close does not stop the others being closed; failures are
+    counted in `counters.errors`.
+
+    Example:
+
+        with Lifecycle() as lifecycle:
+            sockets = lifecycle.adopt(operation.sockets())
+            ...
+    """
+
+    def __init__(self, counters=counters):
+        """
+        Initialize a Lifecycle owning nothing yet.
+        """
+
+        self.counters = counters
+        self.streams = []
+
+    def adopt(self, streams):
+        """
+        Take ownership of `streams`, a stream or a sequence of streams and
+        Nones, which is returned.
+        """
+
+        if hasattr(streams, 'close'):
+            adopted = [streams]
+        else:
+            streams = tuple(streams)
+            adopted = [s for s in streams if s is not None]
+
+        with self.counters.lock:
+            self.counters.adopted += len(adopted)
+        self.streams.extend(adopted)
+        return streams
+
+    def close(self):
+        """
+        Close every stream adopted.
+        """
+
+        streams, self.streams = self.streams, []
+        for stream in reversed(streams):
+            try:
+                stream.close()
+                abort(stream)
+            except Exception:
+                with self.counters.lock:
+                    self.counters.errors += 1
+            with self.counters.lock:
+                self.counters.released += 1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def __repr__(self):
+        return "{cls}(streams={streams})".format(cls=type(self).__name__,
+                                                 streams=len(self.streams))
+
+
+def abort(stream):
+    """
+    Close the Stream under any wrappers now, even with writes pending.
+    """
+
+    while not hasattr(stream, 'abort') and hasattr(stream, 'stream'):
+        stream = stream.stream
+
+    abort = getattr(stream, 'abort', None)
+    if abort is not None:
+        abort()
@@ -0,0 +1,402 @@
+# dockerpty: logs.py
+#
+# Copyright 2014 Chris Corbyn <chris@w3style.co.uk>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Resuming a container's output from where a terminal left off.
+
+Attaching with `logs=1` replays the container's whole log every time. A
+Cursor instead remembers how far each stream has been read, and a Resume
+replays only the output logged since then before handing over to the live
+attach stream.
+"""
+
+import calendar
+import errno
+import re
+import time
+
+import dockerpty.transform as transform
+
+
+_TIMESTAMP = re.compile(r'(\d{4})-(\d\d)-(\d\d)T(\d\d):(\d\d):(\d\d)(?:\.(\d{1,9}))?'
+                        r'(Z|[+-]\d\d:\d\d)$')
+
+
+def parse_timestamp(value):
+    """
+    Returns the nanoseconds since the epoch of docker's RFC 3339 `value`.
+    """
+
+    if isinstance(value, bytes):
+        value = value.decode('ascii')
+
+    match = _TIMESTAMP.match(value)
+    if match is None:
+        raise ValueError("Invalid timestamp {0!r}".format(value))
+
+    year, month, day, hour, minute, second, fraction, zone = match.groups()
+    seconds = calendar.timegm((int(year), int(month), int(day),
+                               int(hour), int(minute), int(second), 0, 0, 0))
+    if zone != 'Z':
+        offset = int(zone[1:3]) * 3600 + int(zone[4:6]) * 60
+        seconds -= offset if zone[0] == '+' else -offset
+
+    return seconds * 10**9 + int((fraction or '0').ljust(9, '0'))
+
+
+def format_timestamp(ns):
+    """
+    Returns `ns` nanoseconds since the epoch as docker formats log timestamps.
+    """
+
+    seconds, nanos = divmod(int(ns), 10**9)
+    return '{0}.{1:09d}Z'.format(time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(seconds)),
+                                 nanos)
+
+
+def split_entries(data):
+    """
+    Split the output of `logs(timestamps=True)` into (ns, payload) entries.
+
+    Each payload keeps its trailing newline. Lines which do not start with a
+    timestamp are joined to the entry before them.
+    """
+
+    entries = []
+    pos = 0
+    end = len(data)
+
+    while pos < end:
+        eol = data.find(b'\n', pos)
+        eol = end if eol < 0 else eol + 1
+        space = data.find(b' ', pos, eol)
+
+        try:
+            ns = parse_timestamp(data[pos:space]) if space > 0 else None
+        except ValueError:
+            ns = None
+
+        if ns is not None:
+            entries.append((ns, data[space + 1:eol]))
+        elif entries:
+            entries[-1] = (entries[-1][0], entries[-1][1] + data[pos:eol])
+
+        pos = eol
+
+    return entries
+
+
+class Position(object):
+    """
+    How far a stream has been read: the daemon's time of the newest output
+    read, in nanoseconds, and the last bytes of it.
+    """
+
+    __slots__ = ('since', 'seen')
+
+    def __init__(self, since=None, seen=b''):
+        self.since = since
+        self.seen = seen
+
+    def __repr__(self):
+        return "{cls}(since={since})".format(cls=type(self).__name__, since=self.since)
+
+
+class Cursor(object):
+    """
+    Tracks how far a terminal has read a container's output, across attaches.
+
+    The first attach replays output logged since `since` (seconds since the
+    epoch), or the last `tail` lines, or everything. Later attaches replay
+    only what was logged after the output already read.
+
+    Docker's `since` filter has a granularity of seconds and live output
+    carries no timestamps, so a resumed attach fetches from `margin` seconds
+    before the position, and drops what it has already delivered by matching
+    the last `keep` bytes read. This assumes the clocks of the daemon and
+    this process agree to within `margin`.
+
+    Example:
+
+        cursor = Cursor(tail=100)
+        operation = RunOperation(client, container, resume=cursor)
+        PseudoTerminal(client, operation).start()   # the last 100 lines
+        ...
+        operation = RunOperation(client, container, resume=cursor)
+        PseudoTerminal(client, operation).start()   # only what was missed
+    """
+
+    def __init__(self, since=None, tail=None, keep=4096, margin=1.0, clock=time.time):
+        """
+        Initialize a Cursor which has read nothing yet.
+        """
+
+        self.since = since
+        self.tail = tail
+        self.keep = keep
+        self.margin = margin
+        self.clock = clock
+        self.positions = {}
+
+    def params(self, key):
+        """
+        Returns the keyword arguments to client.logs() for the `key` stream.
+        """
+
+        params = {
+            'stdout': key == 'stdout',
+            'stderr': key == 'stderr',
+            'timestamps': True,
+            'stream': False,
+            'tail': 'all',
+        }
+
+        position = self.positions.get(key)
+        if position is None:
+            since = self.since
+            if self.tail is not None:
+                params['tail'] = self.tail
+        else:
+            since = position.since / 1e9 - self.margin
+
+        if since is not None and int(since) > 0:
+            params['since'] = int(since)
+
+        return params
+
+    def attach(self, client, container, key, stream, attached):
+        """
+        Returns a Resume of `stream`, the `key` stream attached at `attached`.
+        """
+
+        logged = client.logs(container, **self.params(key))
+        return Resume(stream, self, key, self.unread(key, split_entries(logged)),
+                      attached)
+
+    def unread(self, key, entries):
+        """
+        Returns the (ns, payload) entries not yet read from the `key` stream.
+        """
+
+        position = self.positions.get(key)
+        if position is None:
+            if self.since is None:
+                return entries
+            since = int(self.since * 1e9)
+            return [e for e in entries if e[0] >= since]
+
+        if not position.seen:
+            return entries
+
+        # find where the output already read ends, and skip past it
+        data = b''.join(p for _, p in entries)
+        found = data.rfind(position.seen)
+        if found < 0:
+            return entries
+
+        skip = found + len(position.seen)
+        unread = []
+        for ns, payload in entries:
+            if skip >= len(payload):
+                skip -= len(payload)
+                continue
+            unread.append((ns, payload[skip:]))
+            skip = 0
+
+        return unread
+
+    def advance(self, key, data, ns=None):
+        """
+        Record `data` as read from the `key` stream, at daemon time `ns`.
+        """
+
+        if ns is None:
+            ns = int(self.clock() * 1e9)
+
+        position = self.positions.get(key)
+        if position is None:
+            position = self.positions[key] = Position()
+
+        position.since = ns if position.since is None else max(position.since, ns)
+        position.seen = (position.seen + transform.as_bytes(data))[-self.keep:]
+
+    def __repr__(self):
+        return "{cls}({positions})".format(cls=type(self).__name__,
+                                           positions=self.positions)
+
+
+class Resume(object):
+    """
+    Wraps a live attach stream to read logged output before it.
+
+    The `entries` logged are read first. Output logged after the stream was
+    attached arrives on the stream as well, so the live output is held back
+    until it is known how much of it repeats the end of the log, and that
+    much is dropped. Everything read advances the Cursor.
+
+    Docker logs a line once it is complete. A line which the container had
+    begun before the stream was attached, but had not finished when the log
+    was fetched, is in neither, so its beginning is missed.
+    """
+
+    def __init__(self, stream, cursor, key, entries, attached):
+        """
+        Initialize a Resume of `stream`, attached at `attached` (seconds).
+        """
+
+        self.stream = stream
+        self.cursor = cursor
+        self.key = key
+        self.entries = list(entries)
+        self.pending = b''
+        self.ready = b''
+        self.eof = False
+
+        # only entries logged once the stream was attached can be repeated
+        since = int((attached - cursor.margin) * 1e9)
+        self.overlap = b''.join(p for ns, p in self.entries if ns >= since)
+        self.matching = bool(self.overlap)
+
+    def fileno(self):
+        """
+        Returns the fileno() of the underlying Stream.
+        """
+
+        return self.stream.fileno()
+
+    def set_blocking(self, value):
+        return self.stream.set_blocking(value)
+
+    def read(self, n=4096):
+        """
+        Read up to `n` bytes of logged output, then of live output.
+        """
+
+        if self.entries:
+            return self._replay(n)
+
+        if not self.ready and self.matching:
+            self._match(n)
+
+        if self.ready:
+            data, self.ready = self.ready[:n], self.ready[n:]
+        elif self.eof:
+            return None
+        else:
+            data = self.stream.read(n)
+
+        if data:
+            self.cursor.advance(self.key, data)
+        return data
+
+    def buffered(self):
+        """
+        Returns True if logged or released output is waiting to be read, or if
+        the underlying Stream has data buffered.
+        """
+
+        if self.entries or self.ready:
+            return True
+
+        buffered = getattr(self.stream, 'buffered', None)
+        return buffered is not None and buffered()
+
+    def wants_write(self):
+        """
+        Delegates to the underlying Stream.
+        """
+
+        wants_write = getattr(self.stream, 'wants_write', None)
+        return wants_write is not None and wants_write()
+
+    def write(self, data):
+        """
+        Delegates to the underlying Stream.
+        """
+
+        return self.stream.write(data)
+
+    def needs_write(self):
+        """
+        Delegates to underlying Stream.
+        """
+
+        if hasattr(self.stream, 'needs_write'):
+            return self.stream.needs_write()
+
+        return False
+
+    def do_write(self):
+        """
+        Delegates to underlying Stream.
+        """
+
+        if hasattr(self.stream, 'do_write'):
+            return self.stream.do_write()
+
+        return False
+
+    def close(self):
+        """
+        Delegates to underlying Stream.
+        """
+
+        return self.stream.close()
+
+    def _replay(self, n):
+        ns, payload = self.entries[0]
+        if len(payload) > n:
+            self.entries[0] = (ns, payload[n:])
+            payload = payload[:n]
+        else:
+            self.entries.pop(0)
+
+        self.cursor.advance(self.key, payload, ns)
+        return payload
+
+    def _match(self, n):
+        """
+        Read live output until it is known how much repeats the log.
+        """
+
+        data = self.stream.read(n)
+        if data:
+            self.pending += data
+        else:
+            self.eof = True
+
+        # the live output may begin part way through a line, so any suffix of
+        # the log is a candidate, unless it is just a line ending
+        pending = self.pending
+        overlap = self.overlap
+        skip = 0
+        start = overlap.find(pending[:1])
+        while 0 <= start:
+            length = len(overlap) - start
+            if len(pending) >= length:
+                if overlap[start:].strip(b'\r\n') and pending.startswith(overlap[start:]):
+                    skip = length
+                    break
+            elif overlap.startswith(pending, start) and not self.eof:
+                # the live output may still turn out to repeat all of this
+                raise OSError(errno.EAGAIN, "Waiting for output to match the log")
+            start = overlap.find(pending[:1], start + 1)
+
+        self.matching = False
+        self.ready, self.pending, self.overlap = pending[skip:], b'', b''
+
+    def __repr__(self):
+        return "{cls}({stream})".format(cls=type(self).__name__, stream=self.stream)
@@ -0,0 +1,394 @@
+# dockerpty: loop.py
+#
+# Copyright 2014 Chris Corbyn <chris@w3style.co.uk>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import heapq
+import itertools
+import sys
+from collections import deque
+
+import dockerpty.io as io
+
+
+def incomplete_ssl_operation(error):
+    """
+    Returns True if `error` is an SSLError for a non-blocking operation which
+    could not complete yet.
+
+    Streams over ssl sockets already turn these into EAGAIN; this catches any
+    raised by other stream-like objects wrapping ssl sockets.
+
+    ssl is not imported here: if the docker client has not imported it, no
+    socket can be raising SSLErrors.
+    """
+
+    ssl = sys.modules.get('ssl')
+    return ssl is not None and \
+        isinstance(error, (ssl.SSLWantReadError, ssl.SSLWantWriteError))
+
+
+class Timeout(Exception):
+    """
+    Raised when a session runs past its deadline, or is idle for too long.
+    """
+
+
+class Timer(object):
+    """
+    A call scheduled on a Loop, which may be cancelled until it is made.
+    """
+
+    __slots__ = ('when', 'fn', 'args', 'cancelled')
+
+    def __init__(self, when, fn, args):
+        self.when = when
+        self.fn = fn
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+    def __repr__(self):
+        return "{cls}({when}, {fn})".format(cls=type(self).__name__,
+                                            when=self.when,
+                                            fn=self.fn)
+
+
+class Group(object):
+    """
+    The pumps of one session, which finish together.
+
+    A Group is done when all of its pumps are done, when one of them reads the
+    detach keys (`detached` is then True), or when one of them raises (the
+    exception is kept in `error`). Errors in one Group do not affect the
+    others in the Loop.
+
+    `active` is the clock() time at which the Group last pumped any data.
+    """
+
+    def __init__(self, pumps, on_done=None, idle_timeout=None, keepalive=None,
+                 on_keepalive=None):
+        """
+        Initialize a Group of `pumps`, calling `on_done(group)` when done.
+        """
+
+        self.pumps = pumps
+        self.on_done = on_done
+        self.idle_timeout = idle_timeout
+        self.keepalive = keepalive
+        self.on_keepalive = on_keepalive
+        self.done = False
+        self.detached = False
+        self.cancelled = False
+        self.error = None
+        self.active = io.clock()
+        self.timers = {}
+
+    def cancel(self):
+        """
+        Remove the Group from the Loop, even though its pumps are not done.
+        """
+
+        self.cancelled = True
+
+    def finished(self):
+        """
+        Returns True if the Group should be removed from the Loop.
+        """
+
+        if self.error is not None or self.cancelled:
+            return True
+
+        if any(p.detached for p in self.pumps):
+            self.detached = True
+            return True
+
+        return all(p.is_done() for p in self.pumps)
+
+    def __repr__(self):
+        return "{cls}({pumps})".format(cls=type(self).__name__,
+                                       pumps=self.pumps)
+
+
+class Loop(object):
+    """
+    A select() loop pumping data for any number of sessions.
+
+    Each session's pumps are added as a Group. Objects which are not pumps,
+    such as a listening socket, may be watched with `add_reader()`. Other
+    threads hand work to the loop with `call_soon_threadsafe()`, which wakes
+    it through a self-pipe.
+
+    Calls may be scheduled with `call_at()` and `call_later()`. Timers are
+    kept in a heap, and select() waits no longer than the soonest of them, so
+    a Loop of idle sessions with timeouts does no work until one is due.
+    Groups use them for idle timeouts, deadlines and keepalives; a Group
+    which times out finishes with a Timeout as its `error`.
+
+    Example:
+
+        loop = Loop()
+        loop.add(operation.start(), on_done=cleanup)
+        loop.run()
+    """
+
+    def __init__(self):
+        """
+        Initialize an empty Loop.
+        """
+
+        self.groups = []
+        self.readers = {}
+        self.waker = io.Waker()
+        self.pending = deque()
+        self.timers = []
+        self.sequence = itertools.count()
+        self.stopping = False
+
+    def add(self, pumps, on_done=None, idle_timeout=None, timeout=None, keepalive=None,
+            on_keepalive=None):
+        """
+        Start pumping `pumps` as a new Group, which is returned.
+
+        The Group times out after `idle_timeout` seconds without data pumped
+        either way, or `timeout` seconds after starting. Every `keepalive`
+        seconds without data pumped, `on_keepalive(group)` is called, e.g. to
+        send a ping.
+        """
+
+        group = Group(pumps, on_done, idle_timeout=idle_timeout, keepalive=keepalive,
+                      on_keepalive=on_keepalive)
+
+        if timeout is not None:
+            group.timers['timeout'] = self.call_later(
+                timeout, self._expire, group, "Session ran for over {0}s".format(timeout))
+        if idle_timeout is not None:
+            group.timers['idle'] = self.call_later(idle_timeout, self._check_idle, group)
+        if keepalive is not None and on_keepalive is not None:
+            group.timers['keepalive'] = self.call_later(keepalive, self._keepalive, group)
+
+        self.groups.append(group)
+        return group
+
+    def add_reader(self, obj, callback):
+        """
+        Call `callback()` whenever the selectable `obj` is ready for reading.
+        """
+
+        self.readers[obj] = callback
+
+    def remove_reader(self, obj):
+        self.readers.pop(obj, None)
+
+    def call_soon_threadsafe(self, fn, *args):
+        """
+        Call `fn(*args)` on the loop's thread. Safe to call from any thread.
+        """
+
+        self.pending.append((fn, args))
+        self.waker.wake()
+
+    def call_at(self, when, fn, *args):
+        """
+        Call `fn(*args)` at the clock() time `when`. Returns a Timer.
+
+        Unlike `call_soon_threadsafe()`, this must be called on the loop's
+        thread.
+        """
+
+        timer = Timer(when, fn, args)
+        heapq.heappush(self.timers, (when, next(self.sequence), timer))
+        return timer
+
+    def call_later(self, delay, fn, *args):
+        """
+        Call `fn(*args)` in `delay` seconds. Returns a Timer.
+        """
+
+        return self.call_at(io.clock() + delay, fn, *args)
+
+    def wake(self):
+        """
+        Interrupt a select() in progress. Safe to call from any thread.
+        """
+
+        self.waker.wake()
+
+    def stop(self):
+        """
+        Make `run()` return. Safe to call from any thread.
+        """
+
+        self.stopping = True
+        self.waker.wake()
+
+    def run(self):
+        """
+        Run until `stop()` is called, or nothing is left to pump or watch.
+        """
+
+        self.stopping = False
+        while not self.stopping and (self.groups or self.readers or self.pending):
+            self.run_once()
+
+    def run_once(self, timeout=60):
+        """
+        Wait up to `timeout` seconds for I/O and handle whatever is ready.
+        """
+
+        owners = {}
+        read_ready = [self.waker] + list(self.readers)
+        write_streams = []
+        buffered = []
+
+        for group in self.groups:
+            for pump in group.pumps:
+                if pump.readable():
+                    read_ready.append(pump)
+                    owners[id(pump)] = group
+                    if pump.buffered():
+                        buffered.append(pump)
+                for stream in pump.write_streams():
+                    if id(stream) not in owners:
+                        write_streams.append(stream)
+                        owners[id(stream)] = group
+
+        if buffered:
+            timeout = 0
+
+        read_ready, write_ready = io.select(read_ready, write_streams,
+                                            timeout=self._timeout(timeout))
+        read_ready = read_ready + [p for p in buffered if p not in read_ready]
+        now = io.clock()
+
+        for stream in write_ready:
+            self._guard(owners[id(stream)], stream.do_write)
+
+        for obj in read_ready:
+            if obj is self.waker:
+                self.waker.clear()
+            elif id(obj) in owners:
+                group = owners[id(obj)]
+                if self._guard(group, obj.flush):
+                    group.active = now
+            elif obj in self.readers:
+                self.readers[obj]()
+
+        for group in self.groups:
+            for pump in group.pumps:
+                self._guard(group, pump.release_held)
+
+        self._run_timers()
+        self._run_pending()
+        self._reap()
+
+    def close(self):
+        """
+        Release the loop's own resources. Pumps are left untouched.
+        """
+
+        self.waker.close()
+
+    def _guard(self, group, fn):
+        if group.error is not None:
+            return
+
+        try:
+            return fn()
+        except Exception as e:
+            if not incomplete_ssl_operation(e):
+                group.error = e
+
+    def _run_pending(self):
+        while self.pending:
+            fn, args = self.pending.popleft()
+            fn(*args)
+
+    def _run_timers(self):
+        timers = self.timers
+        now = io.clock()
+        while timers and timers[0][0] <= now:
+            timer = heapq.heappop(timers)[2]
+            if not timer.cancelled:
+                timer.fn(*timer.args)
+
+    def _next_timer(self):
+        """
+        Returns the clock() time of the soonest timer, or None.
+        """
+
+        timers = self.timers
+        while timers and timers[0][2].cancelled:
+            heapq.heappop(timers)
+
+        return timers[0][0] if timers else None
+
+    def _expire(self, group, message):
+        if group.error is None and not group.done:
+            group.error = Timeout(message)
+
+    def _check_idle(self, group):
+        idle = io.clock() - group.active
+        if idle >= group.idle_timeout:
+            self._expire(group, "Session idle for over {0}s".format(group.idle_timeout))
+        else:
+            # data was pumped since this was scheduled, so look again later
+            group.timers['idle'] = self.call_at(group.active + group.idle_timeout,
+                                                self._check_idle, group)
+
+    def _keepalive(self, group):
+        now = io.clock()
+        if now - group.active >= group.keepalive:
+            self._guard(group, lambda: group.on_keepalive(group))
+            when = now + group.keepalive
+        else:
+            when = group.active + group.keepalive
+
+        group.timers['keepalive'] = self.call_at(when, self._keepalive, group)
+
+    def _reap(self):
+        for group in [g for g in self.groups if g.finished()]:
+            self.groups.remove(group)
+            group.done = True
+            for timer in group.timers.values():
+                timer.cancel()
+            if group.on_done is not None:
+                group.on_done(group)
+
+    def _timeout(self, timeout):
+        """
+        Returns how long to select() for: until the soonest timer is due, a
+        rate limited pump may read again or a pump's transforms want held data
+        released, or `timeout`.
+        """
+
+        if self.pending:
+            return 0
+
+        deadlines = [d for g in self.groups for d in (p.deadline() for p in g.pumps)
+                     if d is not None]
+        timer = self._next_timer()
+        if timer is not None:
+            deadlines.append(timer)
+
+        if not deadlines:
+            return timeout
+
+        return min(timeout, max(0, min(deadlines) - io.clock()))
+
+    def __repr__(self):
+        return "{cls}(groups={groups})".format(cls=type(self).__name__,
+                                               groups=len(self.groups))
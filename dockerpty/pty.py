@@ -17,10 +17,12 @@
 import sys
 import signal
 import warnings
-from ssl import SSLError
 
 import dockerpty.io as io
+import dockerpty.records as records
 import dockerpty.tty as tty
+from dockerpty.lifecycle import Lifecycle
+from dockerpty.loop import Loop
 
 
 class WINCHHandler(object):
@@ -59,12 +61,20 @@ class WINCHHandler(object):
         Start trapping WINCH signals and resizing the PTY.
 
         This method saves the previous WINCH handler so it can be restored on
-        `stop()`.
+        `stop()`. The size of the terminal is cached by its tty.State, which
+        the handler invalidates, so that the size is read once per signal.
+
+        The handler takes no locks, since it may interrupt a thread holding
+        them. It only asks the PTY's loop to resize.
         """
 
+        # looked up now, as the handler must not wait on the states' lock
+        terminal = tty.state(self.pty.operation.stdout)
+
         def handle(signum, frame):
             if signum == signal.SIGWINCH:
-                self.pty.resize()
+                terminal.invalidate()
+                self.pty.request_resize()
 
         self.original_handler = signal.signal(signal.SIGWINCH, handle)
 
@@ -101,18 +111,72 @@ class Operation(object):
         """Return sockets for streams."""
         raise NotImplementedError()
 
+    def exit_code(self):
+        """
+        Return the exit code of the process, waiting for it to exit.
+        """
+        raise NotImplementedError()
+
+    def limits(self, name):
+        """
+        Returns the io.TokenBuckets limiting the `name` pump.
+
+        `name` is one of 'stdin', 'stdout' or 'stderr'. A bucket given as
+        'session' in `rate_limits` applies to all of them.
+        """
+
+        rate_limits = getattr(self, 'rate_limits', None) or {}
+        return [b for b in (rate_limits.get(name), rate_limits.get('session')) if b is not None]
+
+    def stages(self, name):
+        """
+        Returns the list of transform.Transforms for the `name` pump.
+        """
+
+        transforms = getattr(self, 'transforms', None) or {}
+        return transforms.get(name)
+
 
 class RunOperation(Operation):
     """
     class for handling `docker run`-like command
     """
 
-    def __init__(self, client, container, interactive=True, stdout=None, stderr=None, stdin=None, logs=None):
+    def __init__(self, client, container, interactive=True, stdout=None, stderr=None, stdin=None, logs=None,
+                 detach_keys=None, rate_limits=None, transforms=None, resume=None,
+                 local_pty=False, merged=None):
         """
         Initialize the PTY using the docker.Client instance and container dict.
+
+        `detach_keys` is an optional key sequence (e.g. 'ctrl-p,ctrl-q') which
+        detaches from the PTY while leaving the attach sockets open.
+
+        `rate_limits` optionally maps 'stdin', 'stdout', 'stderr' and
+        'session' to io.TokenBuckets limiting the bytes pumped.
+
+        `transforms` optionally maps 'stdin', 'stdout' and 'stderr' to lists of
+        transform.Transform stages applied to that stream.
+
+        `resume` is an optional logs.Cursor. Instead of replaying all of the
+        container's logs or none, the output logged since the cursor is
+        replayed, and the cursor advances as output is read, so the next
+        operation given it resumes where this one left off.
+
+        With `local_pty` set, a container without a tty is given a terminal
+        all the same, in the form of a tty.LocalPTY. Its stdout and stderr
+        are then attached together, so they are written to `stdout` in the
+        order the container wrote them.
+
+        `merged` is an optional file to which the output of a container
+        without a tty is written, instead of to `stdout` and `stderr`, as
+        records.Recorder records. Both streams are attached together, so the
+        records are in the order the container wrote them.
         """
 
-        if logs is None:
+        if [resume is not None, bool(local_pty), merged is not None].count(True) > 1:
+            raise ValueError("Only one of resume, local_pty and merged may be given")
+
+        if logs is None and resume is None:
             warnings.warn("The default behaviour of dockerpty is changing. Please add logs=1 to your dockerpty.start call to maintain existing behaviour. See https://github.com/d11wtq/dockerpty/issues/51 for details.", DeprecationWarning)
             logs = 1
 
@@ -124,6 +188,13 @@ class RunOperation(Operation):
         self.stderr = stderr or sys.stderr
         self.stdin = stdin or sys.stdin
         self.logs = logs
+        self.detach_keys = io.parse_keys(detach_keys) if detach_keys else None
+        self.rate_limits = rate_limits
+        self.transforms = transforms
+        self.resume = resume
+        self.local_pty = local_pty
+        self.merged = merged
+        self.local = None
 
     def start(self, sockets=None, **kwargs):
         """
@@ -133,20 +204,54 @@ class RunOperation(Operation):
         is closed.
         """
 
-        pty_stdin, pty_stdout, pty_stderr = sockets or self.sockets()
+        sockets = sockets or self.sockets()
+        if isinstance(sockets, tty.LocalPTY):
+            pumps = self._local_pumps(sockets)
+        else:
+            pumps = self._pumps(*sockets)
+
+        if not self._container_info()['State']['Running']:
+            self.client.start(self.container, **kwargs)
+
+        return pumps
+
+    def _pumps(self, pty_stdin, pty_stdout, pty_stderr):
         pumps = []
 
         if pty_stdin and self.interactive:
-            pumps.append(io.Pump(io.Stream(self.stdin), pty_stdin, wait_for_output=False))
-
-        if pty_stdout:
-            pumps.append(io.Pump(pty_stdout, io.Stream(self.stdout), propagate_close=False))
+            pumps.append(io.Pump(io.as_stream(self.stdin), pty_stdin, wait_for_output=False,
+                                 detach_keys=self.detach_keys, limits=self.limits('stdin'),
+                                 transforms=self.stages('stdin')))
+
+        if isinstance(pty_stdout, records.Recorder):
+            # the records are binary, so stdout's transforms do not apply
+            pumps.append(io.Pump(pty_stdout, io.as_stream(self.merged), propagate_close=False,
+                                 limits=self.limits('stdout')))
+        elif pty_stdout:
+            pumps.append(io.Pump(pty_stdout, io.as_stream(self.stdout), propagate_close=False,
+                                 limits=self.limits('stdout'), transforms=self.stages('stdout')))
 
         if pty_stderr:
-            pumps.append(io.Pump(pty_stderr, io.Stream(self.stderr), propagate_close=False))
+            pumps.append(io.Pump(pty_stderr, io.as_stream(self.stderr), propagate_close=False,
+                                 limits=self.limits('stderr'), transforms=self.stages('stderr')))
 
-        if not self._container_info()['State']['Running']:
-            self.client.start(self.container, **kwargs)
+        return pumps
+
+    def _local_pumps(self, local):
+        pumps = []
+
+        if self.interactive and self._container_info()['Config']['AttachStdin']:
+            # keystrokes reach the container through the line discipline
+            local.slave.reading = True
+            pumps.append(io.Pump(io.as_stream(self.stdin), local.master, wait_for_output=False,
+                                 propagate_close=False, detach_keys=self.detach_keys,
+                                 limits=self.limits('stdin'), transforms=self.stages('stdin')))
+            pumps.append(io.Pump(local.slave, local.stream, wait_for_output=False,
+                                 half_close=True))
+
+        pumps.append(io.Pump(local.stream, local.slave))
+        pumps.append(io.Pump(local.master, io.as_stream(self.stdout), propagate_close=False,
+                             limits=self.limits('stdout'), transforms=self.stages('stdout')))
 
         return pumps
 
@@ -159,7 +264,7 @@ class RunOperation(Operation):
 
         if self.raw is None:
             info = self._container_info()
-            self.raw = self.stdout.isatty() and info['Config']['Tty']
+            self.raw = self.stdout.isatty() and (info['Config']['Tty'] or self.local_pty)
 
         return self.raw
 
@@ -168,33 +273,97 @@ class RunOperation(Operation):
         Returns a tuple of sockets connected to the pty (stdin,stdout,stderr).
 
         If any of the sockets are not attached in the container, `None` is
-        returned in the tuple.
+        returned in the tuple. With `local_pty`, a container without a tty is
+        instead attached by one socket, which is returned in a tty.LocalPTY.
         """
 
         info = self._container_info()
 
+        if self.local_pty and not info['Config']['Tty']:
+            return self._local_socket(info)
+
         def attach_socket(key):
             if info['Config']['Attach{0}'.format(key.capitalize())]:
+                resume = self.resume if key != 'stdin' else None
+                if resume is not None:
+                    attached = resume.clock()
+
                 socket = self.client.attach_socket(
                     self.container,
-                    {key: 1, 'stream': 1, 'logs': self.logs},
+                    {key: 1, 'stream': 1, 'logs': 0 if resume is not None else self.logs},
                 )
                 stream = io.Stream(socket)
 
-                if info['Config']['Tty']:
-                    return stream
-                else:
-                    return io.Demuxer(stream)
+                if not info['Config']['Tty']:
+                    stream = io.Demuxer(stream)
+
+                if resume is not None:
+                    # the live stream is open, so nothing logged from now is missed
+                    stream = resume.attach(self.client, self.container, key, stream, attached)
+
+                return stream
             else:
                 return None
 
-        return map(attach_socket, ('stdin', 'stdout', 'stderr'))
+        sockets = []
+        try:
+            sockets.append(attach_socket('stdin'))
+            if self.merged is not None and not info['Config']['Tty']:
+                # one socket for both, so their frames arrive in the order written
+                sockets.extend([self._merged_socket(info), None])
+            else:
+                sockets.extend([attach_socket('stdout'), attach_socket('stderr')])
+        except Exception:
+            # don't leak the sockets already attached
+            for socket in sockets:
+                if socket is not None:
+                    socket.close()
+            raise
+
+        return tuple(sockets)
+
+    def _merged_socket(self, info):
+        params = self._attach_params(info, ('stdout', 'stderr'))
+        return records.Recorder(io.Stream(self.client.attach_socket(self.container, params)))
+
+    def _local_socket(self, info):
+        params = self._attach_params(info, ('stdin', 'stdout', 'stderr'))
+
+        size = tty.state(self.stdout).size()
+        stream = io.Demuxer(io.Stream(self.client.attach_socket(self.container, params)))
+        try:
+            self.local = tty.LocalPTY(stream, size=size)
+        except Exception:
+            stream.close()
+            raise
+
+        return self.local
+
+    def _attach_params(self, info, keys):
+        config = info['Config']
+        params = dict((key, 1) for key in keys if config['Attach{0}'.format(key.capitalize())])
+        params.update(stream=1, logs=self.logs)
+        return params
 
     def resize(self, height, width, **kwargs):
         """
-        resize pty within container
+        resize pty within container, or the local pty standing in for it
+        """
+        if self.local is not None:
+            self.local.resize(height, width)
+        else:
+            self.client.resize(self.container, height=height, width=width)
+
+    def exit_code(self):
         """
-        self.client.resize(self.container, height=height, width=width)
+        Waits for the container to exit and returns its exit code.
+        """
+
+        status = self.client.wait(self.container)
+        if isinstance(status, dict):
+            # docker-py >= 3.0 returns the API response
+            return status['StatusCode']
+        return status
 
     def _container_info(self):
         """
@@ -214,7 +383,8 @@ class ExecOperation(Operation):
     class for handling `docker exec`-like command
     """
 
-    def __init__(self, client, exec_id, interactive=True, stdout=None, stderr=None, stdin=None):
+    def __init__(self, client, exec_id, interactive=True, stdout=None, stderr=None, stdin=None,
+                 detach_keys=None, rate_limits=None, transforms=None):
         self.exec_id = exec_id
         self.client = client
         self.raw = None
@@ -222,6 +392,9 @@ class ExecOperation(Operation):
         self.stdout = stdout or sys.stdout
         self.stderr = stderr or sys.stderr
         self.stdin = stdin or sys.stdin
+        self.detach_keys = io.parse_keys(detach_keys) if detach_keys else None
+        self.rate_limits = rate_limits
+        self.transforms = transforms
         self._info = None
 
     def start(self, sockets=None, **kwargs):
@@ -232,9 +405,14 @@ class ExecOperation(Operation):
         pumps = []
 
         if self.interactive:
-            pumps.append(io.Pump(io.Stream(self.stdin), stream, wait_for_output=False))
-
-        pumps.append(io.Pump(stream, io.Stream(self.stdout), propagate_close=False))
+            # stdin and stdout share the socket, so EOF on stdin must leave it
+            # open for the rest of the output
+            pumps.append(io.Pump(io.as_stream(self.stdin), stream, wait_for_output=False,
+                                 detach_keys=self.detach_keys, limits=self.limits('stdin'),
+                                 transforms=self.stages('stdin'), half_close=True))
+
+        pumps.append(io.Pump(stream, io.as_stream(self.stdout), propagate_close=False,
+                             limits=self.limits('stdout'), transforms=self.stages('stdout')))
         # FIXME: since exec_start returns a single socket, how do we
         #        distinguish between stdout and stderr?
         # pumps.append(io.Pump(stream, io.Stream(self.stderr), propagate_close=False))
@@ -270,6 +448,15 @@ class ExecOperation(Operation):
         """
         self.client.exec_resize(self.exec_id, height=height, width=width)
 
+    def exit_code(self):
+        """
+        Returns the exit code of the execed process.
+
+        The exec is inspected afresh, since the cached info predates its exit.
+        """
+
+        return self.client.exec_inspect(self.exec_id)['ExitCode']
+
     def is_process_tty(self):
         """
         does execed process have allocated tty?
@@ -311,6 +498,12 @@ class PseudoTerminal(object):
     example, you can attach to a running container from within a Python REPL
     and when the container exits, the user will be returned to the Python REPL
     without adverse effects.
+
+    If the operation was given `detach_keys`, typing them (or calling
+    `detach()` from another thread) returns from `start()` early, and
+    `detached` is then True. Only sockets passed to `start()` (as a Session
+    does) are left open; those `start()` opened itself are closed, even after
+    a detach.
     """
 
     def __init__(self, client, operation):
@@ -320,22 +513,105 @@ class PseudoTerminal(object):
 
         self.client = client
         self.operation = operation
+        self.detached = False
+        self.detach_requested = False
+        self.resize_requested = False
+        self.cancelled = False
+        self.loop = None
+        self.executor = None
 
     def sockets(self):
         return self.operation.sockets()
 
-    def start(self, sockets=None):
-        pumps = self.operation.start(sockets=sockets)
+    def start(self, sockets=None, handle_winch=True, idle_timeout=None, timeout=None,
+              cancel=None):
+        """
+        Present the container's PTY until it is closed or detached from.
 
-        flags = [p.set_blocking(False) for p in pumps]
+        `handle_winch` may be set to False to leave the WINCH signal handler
+        alone, which is required when not running on the main thread.
 
-        try:
-            with WINCHHandler(self):
-                self._hijack_tty(pumps)
-        finally:
-            if flags:
+        Unless `sockets` are given, they are opened with the operation's
+        `sockets()`, and closed again when this returns or raises. Sockets
+        given are left open, so that they may be attached to again.
+
+        If no data passes either way for `idle_timeout` seconds, or the PTY
+        is still open after `timeout` seconds, loop.Timeout is raised.
+
+        `cancel` is an optional lifecycle.CancelToken. Cancelling it makes
+        this return early, with `cancelled` set.
+        """
+
+        # not imported with the module, as concurrent.futures is a backport on
+        # Python 2
+        from dockerpty.control import Executor
+
+        self.detached = False
+        self.cancelled = False
+
+        with Lifecycle() as lifecycle:
+            if sockets is None:
+                sockets = lifecycle.adopt(self.operation.sockets())
+
+            pumps = self.operation.start(sockets=sockets)
+            flags = [p.set_blocking(False) for p in pumps]
+
+            self.loop = Loop()
+            self.executor = Executor(self.loop, workers=1)
+            if cancel is not None:
+                cancel.add_callback(self._cancel)
+
+            try:
+                if handle_winch:
+                    with WINCHHandler(self):
+                        self._hijack_tty(pumps, idle_timeout, timeout, cancel)
+                else:
+                    self._hijack_tty(pumps, idle_timeout, timeout, cancel)
+            finally:
+                if cancel is not None:
+                    cancel.remove_callback(self._cancel)
+                executor, self.executor = self.executor, None
+                executor.close()
+                loop, self.loop = self.loop, None
+                loop.close()
                 for (pump, flag) in zip(pumps, flags):
-                    io.set_blocking(pump, flag)
+                    _restore_blocking(pump, flag)
+
+    def start_background(self):
+        """
+        Present the container's PTY from a dedicated I/O thread.
+
+        Returns a started worker.Worker, which takes over the operation's
+        stdin, stdout and stderr.
+        """
+
+        from dockerpty.worker import Worker
+
+        return Worker(self).start()
+
+    def detach(self):
+        """
+        Stop pumping data and return from `start()` without closing sockets.
+
+        This is safe to call from a thread other than the one in `start()`.
+        """
+
+        self.detach_requested = True
+        loop = self.loop
+        if loop is not None:
+            loop.wake()
+
+    def request_resize(self):
+        """
+        Resize the container's PTY to the terminal's size, from the loop.
+
+        This is safe to call from a signal handler or another thread.
+        """
+
+        self.resize_requested = True
+        loop = self.loop
+        if loop is not None:
+            loop.wake()
 
     def resize(self, size=None):
         """
@@ -343,38 +619,67 @@ class PseudoTerminal(object):
 
         If `size` is not None, it must be a tuple of (height,width), otherwise
         it will be determined by the size of the current TTY.
+
+        While the PTY is started, the call to the daemon is made on the
+        executor, so that a slow daemon does not hold up the output.
         """
 
         if not self.operation.israw():
             return
 
-        size = size or tty.size(self.operation.stdout)
+        size = size or tty.state(self.operation.stdout).size()
 
         if size is not None:
             rows, cols = size
-            try:
-                self.operation.resize(height=rows, width=cols)
-            except IOError:  # Container already exited
-                pass
+            executor = self.executor
+            if executor is not None:
+                executor.submit_latest('resize', None, self._resize, rows, cols)
+            else:
+                self._resize(rows, cols)
+
+    def _resize(self, rows, cols):
+        try:
+            self.operation.resize(height=rows, width=cols)
+        except IOError:  # Container already exited
+            pass
+
+    def _cancel(self):
+        loop = self.loop
+        if loop is not None:
+            loop.wake()
 
-    def _hijack_tty(self, pumps):
+    def _hijack_tty(self, pumps, idle_timeout=None, timeout=None, cancel=None):
         with tty.Terminal(self.operation.stdin, raw=self.operation.israw()):
             self.resize()
-            while True:
-                read_pumps = [p for p in pumps if not p.eof]
-                write_streams = [p.to_stream for p in pumps if p.to_stream.needs_write()]
+            group = self.loop.add(pumps, idle_timeout=idle_timeout, timeout=timeout)
+            while not group.done:
+                if self.resize_requested:
+                    self.resize_requested = False
+                    self.resize()
 
-                read_ready, write_ready = io.select(read_pumps, write_streams, timeout=60)
-                try:
-                    for write_stream in write_ready:
-                        write_stream.do_write()
+                if self.detach_requested:
+                    self.detach_requested = False
+                    self.detached = True
+                    break
 
-                    for pump in read_ready:
-                        pump.flush()
+                if cancel is not None and cancel.cancelled:
+                    self.cancelled = True
+                    break
 
-                    if all([p.is_done() for p in pumps]):
-                        break
+                self.loop.run_once()
+
+            if group.error is not None:
+                raise group.error
+
+            self.detached = self.detached or group.detached
+
+
+def _restore_blocking(pump, flag):
+    """
+    Put the pump's reader back in blocking mode `flag`, unless it is closed.
+    """
 
-                except SSLError as e:
-                    if 'The operation did not complete' not in e.strerror:
-                        raise e
+    try:
+        pump.set_blocking(flag)
+    except (EnvironmentError, ValueError):
+        pass
@@ -0,0 +1,144 @@
+# dockerpty: records.py
+#
+# Copyright 2014 Chris Corbyn <chris@w3style.co.uk>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+A container's stdout and stderr merged into one log of timestamped records.
+
+Each record is a 13-byte header, holding the arrival time in nanoseconds
+since the epoch (8 bytes), the stream (1 byte, as in docker's frames) and the
+payload length (4 bytes), all big endian, followed by the payload.
+"""
+
+import errno
+import struct
+import time
+
+import dockerpty.frames as frames
+
+
+HEADER = struct.Struct('>QBL')
+
+
+def encode(ns, stream, data):
+    """
+    Returns `data`, from `stream` at `ns`, as a record.
+    """
+
+    return HEADER.pack(ns, stream, len(data)) + data
+
+
+def parse(buffer, offset=0):
+    """
+    Parse the complete records in `buffer` from `offset`.
+
+    Returns a list of (ns, stream, payload) tuples, whose payloads are
+    memoryviews into `buffer`, and the offset of the first byte not consumed.
+    """
+
+    view = memoryview(buffer)
+    unpack_from = HEADER.unpack_from
+    size = HEADER.size
+    end = len(view)
+    records = []
+    append = records.append
+
+    while end - offset >= size:
+        ns, stream, length = unpack_from(view, offset)
+        start = offset + size
+        if end - start < length:
+            break
+        offset = start + length
+        append((ns, stream, view[start:offset]))
+
+    return records, offset
+
+
+def iterate(f, size=65536):
+    """
+    Yield the (ns, stream, payload) records read from the file `f`.
+    """
+
+    buffer = b''
+    while True:
+        data = f.read(size)
+        if not data:
+            return
+        buffer += data
+        records, offset = parse(buffer)
+        for ns, stream, payload in records:
+            yield ns, stream, payload.tobytes()
+        buffer = buffer[offset:]
+
+
+class Recorder(object):
+    """
+    Wraps a multiplexed Stream to read its frames as records.
+
+    Frames are recorded in the order they arrive, stamped with the time of the
+    read which completed them, so stdout and stderr keep their interleaving.
+    As with the Demuxer, a large frame is recorded in pieces as it arrives.
+    """
+
+    def __init__(self, stream, clock=time.time):
+        """
+        Initialize a Recorder reading from `stream`.
+        """
+
+        self.stream = stream
+        self.clock = clock
+        self.decoder = frames.Decoder(views=False)
+
+    def fileno(self):
+        return self.stream.fileno()
+
+    def set_blocking(self, value):
+        return self.stream.set_blocking(value)
+
+    def read(self, n=4096):
+        """
+        Read up to `n` bytes from the Stream and return them as records.
+        """
+
+        data = self.stream.read(n)
+        if not data:
+            return data
+
+        pieces = self.decoder.feed(data)
+        if not pieces:
+            raise OSError(errno.EAGAIN, "Waiting for the rest of a frame")
+
+        ns = int(self.clock() * 1e9)
+        pack = HEADER.pack
+        parts = []
+        for stream, payload in pieces:
+            parts.append(pack(ns, stream, len(payload)))
+            parts.append(payload)
+
+        return b''.join(parts)
+
+    def buffered(self):
+        """
+        Delegates to the underlying Stream.
+        """
+
+        buffered = getattr(self.stream, 'buffered', None)
+        return buffered is not None and buffered()
+
+    def close(self):
+        return self.stream.close()
+
+    def __repr__(self):
+        return "{cls}({stream})".format(cls=type(self).__name__, stream=self.stream)
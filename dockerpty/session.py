@@ -0,0 +1,147 @@
+# dockerpty: session.py
+#
+# Copyright 2014 Chris Corbyn <chris@w3style.co.uk>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+
+import dockerpty.io as io
+import dockerpty.tty as tty
+from dockerpty.lifecycle import Lifecycle
+from dockerpty.pty import PseudoTerminal
+
+
+class Session(object):
+    """
+    A container PTY session which can be detached from and re-attached to.
+
+    The attach sockets are opened on the first `attach()` and parked when the
+    user detaches (with the operation's `detach_keys`, or by calling
+    `detach()` from another thread). A later `attach()`, possibly with
+    different terminal streams, resumes on the same sockets without going back
+    to the docker daemon. The last `scrollback` bytes of output are kept in an
+    io.RingBuffer and replayed to the re-attaching terminal before live output
+    resumes, so the operation can usually be created with `logs=0`.
+
+    The sockets are closed once the container's PTY closes, or an attach
+    fails, but not on detaching.
+
+    Example:
+
+        operation = RunOperation(client, container, detach_keys='ctrl-p,ctrl-q')
+        session = Session(client, operation)
+
+        session.attach()    # returns when the user types C-p C-q
+        ...
+        session.attach(stdin=other_tty, stdout=other_tty)
+    """
+
+    def __init__(self, client, operation, scrollback=65536):
+        """
+        Initialize a Session for `operation`, keeping `scrollback` bytes.
+
+        Initializing a Session has no immediate side effects.
+        """
+
+        self.client = client
+        self.operation = operation
+        self.scrollback = io.RingBuffer(scrollback)
+        self.lock = threading.Lock()
+        self.sockets = None
+        self.lifecycle = Lifecycle()
+        self.pty = None
+        self.finished = False
+
+    def attach(self, stdin=None, stdout=None, stderr=None):
+        """
+        Present the container's PTY on the given streams until detached.
+
+        Streams which are not given keep their previous values. Returns True
+        if the session was detached and may be attached again, or False if the
+        container's PTY has closed.
+        """
+
+        with self.lock:
+            if self.pty is not None:
+                raise RuntimeError("{0!r} is already attached".format(self))
+            if self.finished:
+                raise RuntimeError("{0!r} has finished".format(self))
+
+            if stdin is not None:
+                self.operation.stdin = stdin
+            if stdout is not None:
+                self.operation.stdout = stdout
+            if stderr is not None:
+                self.operation.stderr = stderr
+
+            if self.sockets is None:
+                self.sockets = self.lifecycle.adopt(self._park(self.operation.sockets()))
+
+            pty = self.pty = PseudoTerminal(self.client, self.operation)
+
+        detached = False
+        try:
+            self._replay()
+            pty.start(sockets=self.sockets)
+            detached = pty.detached
+        finally:
+            with self.lock:
+                self.pty = None
+                self.finished = not detached
+                if self.finished:
+                    self.lifecycle.close()
+
+        return detached
+
+    def detach(self):
+        """
+        Detach the currently attached terminal, if any.
+
+        This is safe to call from any thread.
+        """
+
+        with self.lock:
+            if self.pty is not None:
+                self.pty.detach()
+
+    def _park(self, sockets):
+        """
+        Wrap the output sockets so that everything read is kept in scrollback.
+        """
+
+        if isinstance(sockets, tty.LocalPTY):
+            # the master reads what the terminal displays
+            sockets.master = io.Tap(sockets.master, self.scrollback)
+            return sockets
+
+        if hasattr(sockets, 'close'):
+            return io.Tap(sockets, self.scrollback)
+
+        stdin, stdout, stderr = sockets
+        return (
+            stdin,
+            stdout and io.Tap(stdout, self.scrollback),
+            stderr and io.Tap(stderr, self.scrollback),
+        )
+
+    def _replay(self):
+        """
+        Write the scrollback to the operation's stdout.
+        """
+
+        self.scrollback.replay(io.as_stream(self.operation.stdout))
+
+    def __repr__(self):
+        return "{cls}({operation})".format(cls=type(self).__name__,
+                                           operation=self.operation)
@@ -0,0 +1,158 @@
+# dockerpty: spool.py
+#
+# Copyright 2014 Chris Corbyn <chris@w3style.co.uk>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import mmap
+import sys
+import tempfile
+
+
+class Spool(object):
+    """
+    Captures a stream to a memory-mapped file, for outputs too big to keep in
+    memory.
+
+    Writes are copied straight into the mapping, so capturing costs no system
+    call per chunk. The file grows in `extent` sized steps (at least doubling)
+    to keep remapping rare. Once closed, the file is cut down to the data and
+    `getbuffer()` gives consumers a zero-copy view of it.
+
+    The mapping is replaced rather than resized, as `mmap.resize()` is not
+    supported everywhere (macOS has no mremap).
+
+    A Spool can be given as an operation's stdout, or used as a Pump's
+    to_stream. Without a `path`, an anonymous temporary file is used.
+
+    Example:
+
+        with Spool() as spool:
+            dockerpty.exec_command(client, container, ['pg_dump', 'db'],
+                                   interactive=False, stdout=spool)
+            upload(spool.getbuffer())
+    """
+
+    def __init__(self, path=None, extent=64 << 20):
+        """
+        Initialize a Spool writing to `path`, or a temporary file.
+        """
+
+        if extent < mmap.ALLOCATIONGRANULARITY:
+            extent = mmap.ALLOCATIONGRANULARITY
+
+        self.path = path
+        self.extent = extent
+        self.size = 0
+        self.closed = False
+
+        if path is None:
+            self.file = tempfile.TemporaryFile()
+        else:
+            self.file = open(path, 'w+b')
+
+        self.file.truncate(extent)
+        self.map = mmap.mmap(self.file.fileno(), extent)
+
+    def isatty(self):
+        return False
+
+    def write(self, data):
+        """
+        Append `data` to the spool.
+        """
+
+        if self.closed:
+            raise ValueError("write to a closed Spool")
+
+        n = len(data)
+        if not n:
+            return None
+
+        end = self.size + n
+        if end > len(self.map):
+            self._grow(end)
+
+        self.map[self.size:end] = data
+        self.size = end
+        return n
+
+    def needs_write(self):
+        return False
+
+    def do_write(self):
+        return 0
+
+    def close(self):
+        """
+        Finish the capture, shrinking the file to the data written.
+
+        The mapping stays open for `getbuffer()` until `release()`.
+        """
+
+        if self.closed:
+            return
+
+        self.closed = True
+        self._remap(self.size)
+
+    def getbuffer(self):
+        """
+        Returns a memoryview of the data captured, without copying it.
+
+        On Python 2, mmap has no memoryview support, so the data is copied.
+        """
+
+        if self.map is None:
+            return memoryview(b'')
+
+        if sys.version_info[0] < 3:
+            return memoryview(self.map[:self.size])
+
+        return memoryview(self.map)[:self.size]
+
+    def release(self):
+        """
+        Unmap and close the file. Views from `getbuffer()` must have been
+        released first.
+        """
+
+        self.close()
+        if self.map is not None:
+            self.map.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.release()
+
+    def _grow(self, end):
+        capacity = len(self.map)
+        while capacity < end:
+            capacity = max(capacity * 2, capacity + self.extent)
+
+        self._remap(capacity)
+
+    def _remap(self, length):
+        self.map.close()
+        self.map = None
+        self.file.truncate(length)
+        if length:
+            self.map = mmap.mmap(self.file.fileno(), length)
+
+    def __repr__(self):
+        return "{cls}({path}, size={size})".format(cls=type(self).__name__,
+                                                   path=self.path or self.file.name,
+                                                   size=self.size)
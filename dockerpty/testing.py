@@ -0,0 +1,665 @@
+# dockerpty: testing.py
+#
+# Copyright 2014 Chris Corbyn <chris@w3style.co.uk>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+An in-process stand-in for the docker daemon, for tests and benchmarks.
+"""
+
+import errno
+import fcntl
+import itertools
+import os
+import socket
+import struct
+import subprocess
+import termios
+import threading
+import time
+
+import dockerpty.frames as frames
+import dockerpty.io as io
+import dockerpty.logs as logs
+
+
+STDIN = 0
+STDOUT = 1
+STDERR = 2
+
+
+class Channel(object):
+    """
+    The daemon's end of an attach or exec socket.
+
+    Output for the streams the channel was attached to is buffered and sent
+    as the socket allows, framed as docker does for non-tty processes when
+    `mux` is set. Data read from the socket is the process' stdin.
+    """
+
+    def __init__(self, sock, stdin=False, stdout=False, stderr=False, mux=False):
+        self.sock = sock
+        self.sock.setblocking(False)
+        self.stdin = stdin
+        self.streams = set(s for s, on in ((STDOUT, stdout), (STDERR, stderr)) if on)
+        self.mux = mux
+        self.buffer = bytearray()
+        self.closing = False
+        self.closed = False
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def send(self, stream, data):
+        """
+        Queue `data` written by the process to `stream`.
+        """
+
+        if stream not in self.streams or self.closed:
+            return
+
+        if self.mux:
+            self.buffer += frames.HEADER.pack(stream, len(data))
+        self.buffer += data
+
+    def flush(self):
+        """
+        Send as much of the buffer as the socket accepts.
+        """
+
+        try:
+            n = self.sock.send(self.buffer)
+            del self.buffer[:n]
+        except socket.error as e:
+            if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                # the client went away
+                del self.buffer[:]
+                self.close()
+                return
+
+        if self.closing and not self.buffer:
+            self.close()
+
+    def finish(self):
+        """
+        Close the socket once everything queued has been sent.
+        """
+
+        self.closing = True
+        if not self.buffer:
+            self.close()
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.sock.close()
+
+    def __repr__(self):
+        return "{cls}({sock})".format(cls=type(self).__name__, sock=self.sock)
+
+
+class Process(object):
+    """
+    A fake container's or exec instance's main process.
+
+    With a `command`, a real local process is run, on a PTY if `tty` is set
+    or on pipes otherwise. Without one, the process is scripted: it writes
+    `output` to stdout and `errors` to stderr, `chunk` bytes at a time and at
+    up to `rate` bytes per second, then exits with `exit_code`. A scripted
+    process with `echo` set also writes its stdin back to stdout, and only
+    exits once its stdin is closed.
+
+    Scripted output is held back while any attached client is more than
+    `high_water` bytes behind, as a real process blocks on a full PTY.
+    """
+
+    def __init__(self, command=None, output=b'', errors=b'', tty=False,
+                 stdin_open=False, rate=None, chunk=4096, echo=False,
+                 exit_code=0, high_water=1 << 20):
+        self.command = command
+        self.script = [(s, bytes(d)) for s, d in ((STDOUT, output), (STDERR, errors)) if d]
+        self.tty = tty
+        self.stdin_open = stdin_open
+        self.bucket = io.TokenBucket(rate, burst=max(chunk, 1)) if rate else None
+        self.chunk = chunk
+        self.echo = echo
+        self.status = exit_code
+        self.high_water = high_water
+        self.channels = []
+        self.history = []
+        self.size = None
+        self.running = False
+        self.exit_code = None
+        self.popen = None
+        self.outputs = {}
+        self.input_fd = None
+        self.input = bytearray()
+        self.stdin_closed = False
+
+    def spawn(self):
+        """
+        Start running the process.
+        """
+
+        self.running = True
+
+        if self.command is None:
+            return
+
+        command = self.command
+        if not isinstance(command, (list, tuple)):
+            command = ['/bin/sh', '-c', command]
+
+        if self.tty:
+            master, slave = os.openpty()
+            if self.size is not None:
+                self._set_size(master)
+            self.popen = subprocess.Popen(command, stdin=slave, stdout=slave, stderr=slave,
+                                          close_fds=True, preexec_fn=os.setsid)
+            os.close(slave)
+            self.outputs = {master: STDOUT}
+            self.input_fd = master
+        else:
+            self.popen = subprocess.Popen(command, stdin=subprocess.PIPE,
+                                          stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                          close_fds=True)
+            self.outputs = {
+                self.popen.stdout.fileno(): STDOUT,
+                self.popen.stderr.fileno(): STDERR,
+            }
+            self.input_fd = self.popen.stdin.fileno()
+
+        for fd in list(self.outputs) + [self.input_fd]:
+            io.set_blocking(fd, False)
+
+        if not self.stdin_open:
+            self.close_stdin()
+
+    def emit(self, stream, data):
+        """
+        Send `data`, written to `stream`, to every attached client.
+        """
+
+        if self.tty:
+            stream = STDOUT
+
+        self.history.append((stream, data, time.time()))
+        for channel in self.channels:
+            channel.send(stream, data)
+
+    def feed(self, data):
+        """
+        Handle `data` received on stdin.
+        """
+
+        if not self.running or self.stdin_closed:
+            return
+
+        if self.echo:
+            self.emit(STDOUT, data)
+        elif self.input_fd is not None:
+            self.input += data
+
+    def close_stdin(self):
+        self.stdin_closed = True
+        if self.popen is not None and not self.tty and not self.input:
+            self._close_input()
+
+    def write_input(self):
+        """
+        Write pending stdin to the local process.
+        """
+
+        try:
+            n = os.write(self.input_fd, self.input)
+            del self.input[:n]
+        except OSError as e:
+            if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                del self.input[:]
+
+        if self.stdin_closed and not self.input and not self.tty:
+            self._close_input()
+
+    def read_output(self, fd):
+        """
+        Read what the local process wrote to `fd`.
+        """
+
+        try:
+            data = os.read(fd, 65536)
+        except OSError as e:
+            if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                return
+            # a PTY master reports EIO once the slave is closed
+            data = b''
+
+        if data:
+            self.emit(self.outputs[fd], data)
+            return
+
+        stream = self.outputs.pop(fd)
+        if fd == self.input_fd:
+            self.input_fd = None
+            os.close(fd)
+        elif stream == STDOUT:
+            self.popen.stdout.close()
+        else:
+            self.popen.stderr.close()
+
+        if not self.outputs:
+            self._close_input()
+            self.exited(self.popen.wait())
+
+    def step(self):
+        """
+        Emit the next chunk of scripted output.
+
+        Returns the clock() time at which to call again, or None when there is
+        nothing to do until something else happens.
+        """
+
+        if not self.running or self.command is not None:
+            return None
+
+        if not self.script:
+            if not self.echo or self.stdin_closed:
+                self.exited(self.status)
+            return None
+
+        if any(len(c.buffer) > self.high_water for c in self.channels):
+            return None
+
+        n = self.chunk
+        if self.bucket is not None:
+            n = self.bucket.allow(n)
+            if n < 1:
+                return self.bucket.deadline()
+            self.bucket.consume(n)
+
+        stream, data = self.script[0]
+        self.emit(stream, data[:n])
+        if len(data) > n:
+            self.script[0] = (stream, data[n:])
+        else:
+            self.script.pop(0)
+
+        return io.clock()
+
+    def exited(self, code):
+        """
+        Record the exit and hang up on every attached client.
+        """
+
+        self.running = False
+        self.exit_code = code
+        for channel in self.channels:
+            channel.finish()
+
+    def resize(self, height, width):
+        self.size = (height, width)
+        if self.tty and self.input_fd is not None:
+            self._set_size(self.input_fd)
+
+    def kill(self):
+        if self.popen is not None and self.popen.poll() is None:
+            self.popen.kill()
+
+    def _set_size(self, fd):
+        height, width = self.size
+        fcntl.ioctl(fd, termios.TIOCSWINSZ, struct.pack('HHHH', height, width, 0, 0))
+
+    def _close_input(self):
+        if self.tty or self.popen is None or self.popen.stdin.closed:
+            return
+        self.input_fd = None
+        self.popen.stdin.close()
+
+    def __repr__(self):
+        return "{cls}({command!r}, tty={tty})".format(cls=type(self).__name__,
+                                                      command=self.command,
+                                                      tty=self.tty)
+
+
+class FakeDocker(object):
+    """
+    Just enough of docker.Client to run dockerpty without a docker daemon.
+
+    Attach and exec sockets are socketpairs, whose daemon ends are served by a
+    single background thread, so thousands of sessions are cheap. Containers
+    either run a real local command (see Process) or replay scripted output
+    at a configurable rate, framed as docker frames it when not a tty.
+
+    `on_exec(container, cmd)` may return keyword arguments for the Process
+    of an exec instance; by default `cmd` is run locally.
+
+    Example:
+
+        client = FakeDocker()
+        container = client.create_container(output=b'hello\\n' * 1000,
+                                            tty=False, rate=65536)
+        dockerpty.start(client, container, logs=0)
+    """
+
+    def __init__(self, on_exec=None):
+        """
+        Initialize a FakeDocker. The daemon thread starts on first use.
+        """
+
+        self.on_exec = on_exec
+        self.containers = {}
+        self.execs = {}
+        self.ids = itertools.count(1)
+        self.lock = threading.RLock()
+        self.exited = threading.Condition(self.lock)
+        self.waker = io.Waker()
+        self.thread = None
+        self.stopping = False
+
+    def create_container(self, image=None, command=None, tty=False, stdin_open=False, **kwargs):
+        """
+        Create a container. Arguments not known to docker are passed to Process.
+        """
+
+        options = dict((k, kwargs[k]) for k in
+                       ('output', 'errors', 'rate', 'chunk', 'echo', 'exit_code', 'high_water')
+                       if k in kwargs)
+        process = Process(command=command, tty=tty, stdin_open=stdin_open, **options)
+
+        with self.lock:
+            container_id = '{0:012x}'.format(next(self.ids))
+            self.containers[container_id] = process
+
+        return {'Id': container_id, 'Warnings': None}
+
+    def inspect_container(self, container):
+        process = self._container(container)
+        return {
+            'Id': self._id(container),
+            'State': {
+                'Running': process.running,
+                'ExitCode': process.exit_code or 0,
+            },
+            'Config': {
+                'Tty': process.tty,
+                'OpenStdin': process.stdin_open,
+                'AttachStdin': process.stdin_open,
+                'AttachStdout': True,
+                'AttachStderr': True,
+            },
+        }
+
+    def start(self, container, **kwargs):
+        process = self._container(container)
+        with self.lock:
+            if not process.running and process.exit_code is None:
+                process.spawn()
+        self._wake()
+
+    def attach_socket(self, container, params=None, ws=False):
+        params = params or {}
+        process = self._container(container)
+        return self._attach(
+            process,
+            stdin=bool(params.get('stdin')) and process.stdin_open,
+            stdout=bool(params.get('stdout')),
+            stderr=bool(params.get('stderr')),
+            logs=bool(params.get('logs')),
+        )
+
+    def logs(self, container, stdout=True, stderr=True, stream=False, timestamps=False,
+             tail='all', since=None, **kwargs):
+        """
+        Returns the container's output so far, a log entry per line.
+        """
+
+        process = self._container(container)
+        wanted = set(s for s, w in ((STDOUT, stdout), (STDERR, stderr)) if w)
+
+        with self.lock:
+            history = list(process.history)
+            exited = process.exit_code is not None
+
+        # like docker, log a line once it is complete, or the process exits
+        entries = []
+        partial = {}
+        for s, data, when in history:
+            if s not in wanted:
+                continue
+            lines = (partial.pop(s, b'') + data).split(b'\n')
+            entries.extend((when, line + b'\n') for line in lines[:-1])
+            if lines[-1]:
+                partial[s] = lines[-1]
+        if exited:
+            entries.extend((history[-1][2], line) for line in partial.values())
+
+        if since is not None:
+            entries = [e for e in entries if e[0] >= since]
+
+        if tail != 'all':
+            entries = entries[-int(tail):] if int(tail) else []
+
+        if timestamps:
+            return b''.join(logs.format_timestamp(when * 1e9).encode('ascii') + b' ' + line
+                            for when, line in entries)
+
+        return b''.join(line for _, line in entries)
+
+    def resize(self, container, height, width):
+        process = self._container(container)
+        with self.lock:
+            process.resize(height, width)
+
+    def wait(self, container, timeout=None):
+        process = self._container(container)
+        with self.lock:
+            while process.exit_code is None:
+                if not self.exited.wait(timeout) and timeout is not None:
+                    raise RuntimeError("Timed out waiting for {0}".format(self._id(container)))
+            return {'StatusCode': process.exit_code}
+
+    def exec_create(self, container, cmd, stdout=True, stderr=True, stdin=False, tty=False, **kwargs):
+        self._container(container)
+        options = {'command': cmd}
+        if self.on_exec is not None:
+            options = self.on_exec(self._id(container), cmd)
+        process = Process(tty=tty, stdin_open=stdin, **options)
+
+        with self.lock:
+            exec_id = 'exec{0:08x}'.format(next(self.ids))
+            self.execs[exec_id] = process
+
+        return {'Id': exec_id}
+
+    def exec_start(self, exec_id, detach=False, tty=False, stream=False, socket=False, **kwargs):
+        process = self._exec(exec_id)
+        sock = self._attach(process, stdin=process.stdin_open, stdout=True, stderr=True)
+        with self.lock:
+            process.spawn()
+        self._wake()
+        return sock
+
+    def exec_inspect(self, exec_id):
+        process = self._exec(exec_id)
+        return {
+            'ID': self._id(exec_id),
+            'Running': process.running,
+            'ExitCode': process.exit_code,
+            'OpenStdin': process.stdin_open,
+            'ProcessConfig': {'tty': process.tty},
+        }
+
+    def exec_resize(self, exec_id, height=None, width=None):
+        process = self._exec(exec_id)
+        with self.lock:
+            process.resize(height, width)
+
+    def close(self):
+        """
+        Stop the daemon thread and kill any local processes.
+        """
+
+        with self.lock:
+            self.stopping = True
+            processes = list(self.containers.values()) + list(self.execs.values())
+        self._wake()
+
+        if self.thread is not None:
+            self.thread.join()
+
+        for process in processes:
+            process.kill()
+            for channel in process.channels:
+                channel.close()
+        self.waker.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def _attach(self, process, stdin, stdout, stderr, logs=False):
+        ours, theirs = socket.socketpair()
+        channel = Channel(theirs, stdin=stdin, stdout=stdout, stderr=stderr, mux=not process.tty)
+
+        with self.lock:
+            if logs:
+                for stream, data, _ in process.history:
+                    channel.send(STDOUT if process.tty else stream, data)
+            if process.exit_code is not None:
+                channel.finish()
+            process.channels.append(channel)
+
+        self._wake()
+        return ours
+
+    def _wake(self):
+        with self.lock:
+            if self.thread is None and not self.stopping:
+                self.thread = threading.Thread(target=self._run, name='FakeDocker')
+                self.thread.daemon = True
+                self.thread.start()
+        self.waker.wake()
+
+    def _run(self):
+        while True:
+            with self.lock:
+                if self.stopping:
+                    return
+                readers, writers, timeout = self._poll()
+
+            read_ready, write_ready = io.select(readers, writers, timeout=timeout)
+
+            with self.lock:
+                self._handle(read_ready, write_ready)
+
+    def _poll(self):
+        """
+        Step scripted processes, returning what to select() on and for how long.
+        """
+
+        readers = [self.waker]
+        writers = []
+        deadlines = []
+
+        for process in self._processes():
+            deadline = process.step()
+            if deadline is not None:
+                deadlines.append(deadline)
+
+            for channel in process.channels:
+                if channel.closed:
+                    continue
+                if channel.stdin and not process.stdin_closed:
+                    readers.append(channel)
+                if channel.buffer:
+                    writers.append(channel)
+
+            readers.extend(process.outputs)
+            if process.input and process.input_fd is not None:
+                writers.append(process.input_fd)
+
+        self.exited.notify_all()
+
+        if not deadlines:
+            return readers, writers, None
+
+        return readers, writers, max(0, min(deadlines) - io.clock())
+
+    def _handle(self, read_ready, write_ready):
+        owners = {}
+        for process in self._processes():
+            for fd in process.outputs:
+                owners[fd] = process
+            if process.input_fd is not None:
+                owners[process.input_fd] = process
+            process.channels = [c for c in process.channels if not c.closed]
+
+        for obj in write_ready:
+            if isinstance(obj, Channel):
+                obj.flush()
+            elif obj in owners:
+                owners[obj].write_input()
+
+        for obj in read_ready:
+            if obj is self.waker:
+                self.waker.clear()
+            elif isinstance(obj, Channel):
+                self._receive(obj)
+            elif obj in owners and obj in owners[obj].outputs:
+                owners[obj].read_output(obj)
+
+        self.exited.notify_all()
+
+    def _receive(self, channel):
+        process = [p for p in self._processes() if channel in p.channels][0]
+
+        try:
+            data = channel.sock.recv(65536)
+        except socket.error as e:
+            if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                return
+            data = b''
+
+        if data:
+            process.feed(data)
+            return
+
+        process.close_stdin()
+        if not channel.streams:
+            channel.close()
+
+    def _processes(self):
+        return list(self.containers.values()) + list(self.execs.values())
+
+    def _id(self, obj):
+        if isinstance(obj, dict):
+            return obj.get('Id') or obj.get('ID')
+        return obj
+
+    def _container(self, container):
+        try:
+            return self.containers[self._id(container)]
+        except KeyError:
+            raise ValueError("No such container: {0}".format(self._id(container)))
+
+    def _exec(self, exec_id):
+        try:
+            return self.execs[self._id(exec_id)]
+        except KeyError:
+            raise ValueError("No such exec instance: {0}".format(self._id(exec_id)))
+
+    def __repr__(self):
+        return "{cls}(containers={containers})".format(cls=type(self).__name__,
+                                                       containers=len(self.containers))
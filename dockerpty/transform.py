@@ -0,0 +1,398 @@
+# dockerpty: transform.py
+#
+# Copyright 2014 Chris Corbyn <chris@w3style.co.uk>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import sys
+import time
+import zlib
+
+
+# the same clock as dockerpty.io, which imports this module
+clock = getattr(time, 'monotonic', time.time)
+
+if sys.version_info[0] < 3:
+    # memoryviews are not accepted where str is, so slice the str instead
+    _view = bytes
+else:
+    _view = memoryview
+
+
+def as_bytes(data):
+    """
+    Returns `data`, bytes or a buffer such as a memoryview, as bytes.
+
+    On Python 2, bytes() of a memoryview is its repr rather than its data.
+    """
+
+    if isinstance(data, bytes):
+        return data
+    if isinstance(data, memoryview):
+        return data.tobytes()
+    return bytes(data)
+
+
+class Transform(object):
+    """
+    A streaming stage applied by a Pump between reading and writing.
+
+    `feed()` is called with each chunk read and returns the bytes to pass on,
+    which may be empty. `flush()` is called once at EOF and returns anything
+    the stage was holding back.
+
+    A stage which holds data back until more arrives can give a clock() time
+    from `deadline()`, after which the Pump calls `release()` to pass on what
+    is held rather than wait for more indefinitely.
+
+    Stages keep state between chunks, so each Pump needs its own instances.
+    This base class passes data through unchanged.
+    """
+
+    def feed(self, data):
+        return data
+
+    def flush(self):
+        return b''
+
+    def deadline(self):
+        return None
+
+    def release(self):
+        return b''
+
+    def __repr__(self):
+        return "{cls}()".format(cls=type(self).__name__)
+
+
+class Lines(Transform):
+    """
+    Passes on only whole lines, holding back a trailing partial line.
+
+    Only newly fed data is searched for line endings; the held partial line is
+    never rescanned. Useful before writing several streams into one sink so
+    that their lines do not interleave mid-line. With `terminate` set, a final
+    partial line is given a newline at EOF for the same reason.
+    """
+
+    def __init__(self, terminate=False):
+        self.partial = bytearray()
+        self.terminate = terminate
+
+    def feed(self, data):
+        data = as_bytes(data)
+
+        end = data.rfind(b'\n') + 1
+
+        if end == 0:
+            self.partial += data
+            return b''
+
+        if self.partial:
+            lines = bytes(self.partial) + data[:end]
+            del self.partial[:]
+        elif end == len(data):
+            return data
+        else:
+            lines = _view(data)[:end]
+
+        self.partial += _view(data)[end:]
+        return lines
+
+    def flush(self):
+        partial = bytes(self.partial)
+        del self.partial[:]
+        if partial and self.terminate:
+            partial += b'\n'
+        return partial
+
+
+class Prefix(Transform):
+    """
+    Inserts `prefix` at the start of every line.
+
+    Partial lines are passed on immediately; the stage only remembers whether
+    the next byte starts a new line.
+
+    Example:
+
+        Pump(pty_stdout, Stream(sys.stdout),
+             transforms=[Lines(), Prefix(b'web_1 | ')])
+    """
+
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.at_line_start = True
+
+    def feed(self, data):
+        if not data:
+            return b''
+
+        data = as_bytes(data)
+
+        body = data[:-1].replace(b'\n', b'\n' + self.prefix) + data[-1:]
+
+        if self.at_line_start:
+            body = self.prefix + body
+
+        self.at_line_start = data.endswith(b'\n')
+        return body
+
+    def __repr__(self):
+        return "{cls}({prefix!r})".format(cls=type(self).__name__,
+                                          prefix=self.prefix)
+
+
+class Compress(Transform):
+    """
+    Compresses the stream with zlib.
+
+    With `sync` set, each chunk is flushed with Z_SYNC_FLUSH so the receiver
+    can decompress everything sent so far without waiting for more input; this
+    suits interactive network sinks at some cost in ratio.
+    """
+
+    def __init__(self, level=6, sync=True):
+        self.level = level
+        self.sync = sync
+        self.compressor = zlib.compressobj(level)
+
+    def feed(self, data):
+        compressed = self.compressor.compress(data)
+        if self.sync:
+            compressed += self.compressor.flush(zlib.Z_SYNC_FLUSH)
+        return compressed
+
+    def flush(self):
+        return self.compressor.flush(zlib.Z_FINISH)
+
+    def __repr__(self):
+        return "{cls}(level={level})".format(cls=type(self).__name__,
+                                             level=self.level)
+
+
+PASTE_START = b'\x1b[200~'
+PASTE_END = b'\x1b[201~'
+
+
+class Intercept(Transform):
+    """
+    Intercepts key sequences typed on stdin.
+
+    `handlers` maps byte sequences to callables. When a sequence is typed,
+    its handler is called with it, and what the handler returns (bytes, or
+    None for nothing) is forwarded in its place.
+
+    Each chunk is scanned with bytes.find() once per sequence, and the spans
+    between matches are passed on as slices of the data read, so a large
+    paste costs no Python work per byte. Bytes at the end of a chunk which
+    could begin a sequence are held back until the next chunk shows whether
+    they do, or for at most `timeout` seconds, so that a lone ESC typed on
+    its own still gets through.
+
+    With `bracketed_paste` set, text which the terminal marks as pasted is
+    passed on without being searched, so pasting cannot set off a handler.
+    The terminal must have bracketed paste mode enabled for this.
+
+    Example:
+
+        Pump(stdin, pty_stdin, transforms=[Intercept({b'\\x1b[21~': menu})])
+    """
+
+    def __init__(self, handlers, bracketed_paste=False, timeout=0.05, clock=clock):
+        self.handlers = dict(handlers)
+        self.bracketed_paste = bracketed_paste
+        self.timeout = timeout
+        self.clock = clock
+
+        if not all(self.handlers) or not (self.handlers or bracketed_paste):
+            raise ValueError("Nothing to intercept")
+
+        # longest first, so that of two sequences found at once it wins
+        self.sequences = sorted(self.handlers, key=len, reverse=True)
+        if bracketed_paste and PASTE_START not in self.handlers:
+            self.sequences.append(PASTE_START)
+
+        self.prefixes = _prefixes(self.sequences)
+        self.end_prefixes = _prefixes([PASTE_END])
+        self.held = b''
+        self.held_at = None
+        self.pasting = False
+
+    def feed(self, data):
+        if self.held:
+            data = self.held + as_bytes(data)
+            self.held = b''
+        else:
+            data = as_bytes(data)
+
+        view = _view(data)
+        end = len(data)
+        pos = 0
+        out = []
+        found = {}
+
+        while pos < end:
+            if self.pasting:
+                index = data.find(PASTE_END, pos)
+                if index < 0:
+                    stop = end - _held(data, pos, self.end_prefixes)
+                    out.append(view[pos:stop])
+                    self._hold(data[stop:])
+                    break
+                stop = index + len(PASTE_END)
+                out.append(view[pos:stop])
+                pos = stop
+                self.pasting = False
+                continue
+
+            start, sequence = self._search(data, pos, found)
+            if sequence is None:
+                stop = end - _held(data, pos, self.prefixes)
+                if pos == 0 and stop == end:
+                    # the common case: nothing to intercept
+                    return data
+                out.append(view[pos:stop])
+                self._hold(data[stop:])
+                break
+
+            out.append(view[pos:start])
+            if sequence in self.handlers:
+                out.append(self.handlers[sequence](sequence) or b'')
+            else:
+                out.append(sequence)
+                self.pasting = True
+            pos = start + len(sequence)
+
+        out = [o for o in out if len(o)]
+        if len(out) == 1:
+            return out[0]
+        return b''.join(out)
+
+    def flush(self):
+        self.pasting = False
+        return self.release()
+
+    def deadline(self):
+        if not self.held or self.timeout is None:
+            return None
+        return self.held_at + self.timeout
+
+    def release(self):
+        """
+        Returns the bytes held back, giving up on them beginning a sequence.
+        """
+
+        held, self.held = self.held, b''
+        return held
+
+    def _hold(self, held):
+        self.held = held
+        if held:
+            self.held_at = self.clock()
+
+    def _search(self, data, pos, found):
+        """
+        Returns the index and sequence of the first sequence in `data` from
+        `pos`, or (-1, None). `found` keeps the indexes of earlier searches.
+        """
+
+        first, match = -1, None
+        for sequence in self.sequences:
+            index = found.get(sequence)
+            if index is None or 0 <= index < pos:
+                index = found[sequence] = data.find(sequence, pos)
+            if 0 <= index and (match is None or index < first):
+                first, match = index, sequence
+        return first, match
+
+    def __repr__(self):
+        return "{cls}({sequences!r})".format(cls=type(self).__name__,
+                                             sequences=sorted(self.handlers))
+
+
+def _prefixes(sequences):
+    """
+    Returns the proper prefixes of `sequences`, by length.
+    """
+
+    prefixes = {}
+    for sequence in sequences:
+        for n in range(1, len(sequence)):
+            prefixes.setdefault(n, set()).add(sequence[:n])
+    return prefixes
+
+
+def _held(data, start, prefixes):
+    """
+    Returns the length of the longest tail of `data[start:]` in `prefixes`.
+    """
+
+    for n in sorted(prefixes, reverse=True):
+        if n <= len(data) - start and data[-n:] in prefixes[n]:
+            return n
+    return 0
+
+
+def apply(transforms, data):
+    """
+    Feed `data` through each of `transforms` in turn.
+    """
+
+    for t in transforms:
+        if not data:
+            return b''
+        data = t.feed(data)
+
+    return data
+
+
+def deadline(transforms):
+    """
+    Returns the soonest of the `deadline()`s of `transforms`, or None.
+    """
+
+    deadlines = [d for d in (t.deadline() for t in transforms) if d is not None]
+    return min(deadlines) if deadlines else None
+
+
+def release(transforms, now):
+    """
+    Release what each of `transforms` past its deadline at `now` holds,
+    feeding the output through those after it.
+    """
+
+    data = b''
+
+    for t in transforms:
+        fed = t.feed(data) if data else b''
+        due = t.deadline()
+        if due is not None and due <= now:
+            fed = b''.join((fed, t.release()))
+        data = fed
+
+    return data
+
+
+def finish(transforms):
+    """
+    Flush each of `transforms`, feeding the output through those after it.
+    """
+
+    data = b''
+
+    for t in transforms:
+        fed = t.feed(data) if data else b''
+        data = b''.join((fed, t.flush()))
+
+    return data
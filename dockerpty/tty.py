@@ -16,11 +16,16 @@
 
 from __future__ import absolute_import
 
+import errno
 import os
 import termios
 import tty
 import fcntl
 import struct
+import threading
+
+import dockerpty.io as io
+import dockerpty.lifecycle as lifecycle
 
 
 def size(fd):
@@ -35,15 +40,162 @@ def size(fd):
     if not os.isatty(fd.fileno()):
         return None
 
+    return _size(fd)
+
+
+def _size(fd):
     try:
-        dims = struct.unpack('hh', fcntl.ioctl(fd, termios.TIOCGWINSZ, 'hhhh'))
-    except:
+        return struct.unpack('hh', fcntl.ioctl(fd, termios.TIOCGWINSZ, 'hhhh'))
+    except EnvironmentError:
         try:
-            dims = (os.environ['LINES'], os.environ['COLUMNS'])
-        except:
+            return (int(os.environ['LINES']), int(os.environ['COLUMNS']))
+        except (KeyError, ValueError):
             return None
 
-    return dims
+
+def _raw(attributes):
+    """
+    Returns a copy of the termios `attributes` made raw, as tty.setraw() does.
+    """
+
+    mode = list(attributes)
+    mode[tty.CC] = list(mode[tty.CC])
+    mode[tty.IFLAG] &= ~(termios.BRKINT | termios.ICRNL | termios.INPCK |
+                         termios.ISTRIP | termios.IXON)
+    mode[tty.OFLAG] &= ~termios.OPOST
+    mode[tty.CFLAG] &= ~(termios.CSIZE | termios.PARENB)
+    mode[tty.CFLAG] |= termios.CS8
+    mode[tty.LFLAG] &= ~(termios.ECHO | termios.ICANON | termios.IEXTEN | termios.ISIG)
+    mode[tty.CC][termios.VMIN] = 1
+    mode[tty.CC][termios.VTIME] = 0
+    return mode
+
+
+class State(object):
+    """
+    The size and attributes of one terminal, shared by every session using it.
+
+    The size is read once and kept until `invalidate()` is called, which the
+    SIGWINCH handler does. Raw mode is counted: the first session to ask for
+    it saves the terminal's attributes and makes it raw, later ones find it
+    raw already, and the last to release it restores the attributes.
+    """
+
+    def __init__(self, fd):
+        """
+        Initialize the State of the terminal `fd`.
+        """
+
+        self.fd = fd
+        self.lock = threading.RLock()
+        self.rows_cols = None
+        self.stale = True
+        self.original = None
+        self.users = 0
+        self.isatty = _isatty(fd)
+
+    def size(self):
+        """
+        Returns the terminal's (rows, cols) as ints, or None if unknown.
+        """
+
+        if not self.isatty:
+            return None
+
+        with self.lock:
+            if self.stale:
+                self.rows_cols = _size(self.fd)
+                self.stale = False
+            return self.rows_cols
+
+    def invalidate(self):
+        """
+        Forget the size, so that it is read again when next asked for.
+        """
+
+        self.stale = True
+
+    def rebind(self, fd):
+        """
+        Use `fd`, another file for the same descriptor number.
+
+        While the terminal is raw, the file which made it raw is kept, so that
+        the same one restores it. The size is read again either way, in case
+        the number now refers to another terminal.
+        """
+
+        with self.lock:
+            if self.users == 0:
+                self.fd = fd
+                self.isatty = _isatty(fd)
+            self.stale = True
+
+    def acquire_raw(self):
+        """
+        Make the terminal raw, unless another session already has.
+        """
+
+        if not self.isatty:
+            return
+
+        with self.lock:
+            if self.users == 0:
+                self.original = termios.tcgetattr(self.fd)
+                termios.tcsetattr(self.fd, termios.TCSAFLUSH, _raw(self.original))
+            self.users += 1
+
+    def release_raw(self):
+        """
+        Restore the terminal's attributes, once no session wants it raw.
+        """
+
+        with self.lock:
+            if self.users == 0:
+                return
+            self.users -= 1
+            if self.users == 0:
+                termios.tcsetattr(self.fd, termios.TCSADRAIN, self.original)
+                self.original = None
+
+    def __repr__(self):
+        return "{cls}({fd}, users={users})".format(cls=type(self).__name__,
+                                                   fd=self.fd,
+                                                   users=self.users)
+
+
+_states = {}
+_states_lock = threading.Lock()
+
+
+def state(fd):
+    """
+    Returns the State shared by users of the terminal `fd`.
+
+    States are kept by descriptor number, so sessions share one whichever
+    file object they were given for the terminal (e.g. sys.stdout and
+    os.fdopen(1)).
+    """
+
+    try:
+        fileno = fd.fileno()
+    except (AttributeError, ValueError, EnvironmentError):
+        return State(fd)
+
+    with _states_lock:
+        shared = _states.get(fileno)
+        if shared is None:
+            shared = _states[fileno] = State(fd)
+        elif shared.fd is not fd:
+            shared.rebind(fd)
+        return shared
+
+
+def _isatty(fd):
+    try:
+        return os.isatty(fd.fileno())
+    except (AttributeError, ValueError, EnvironmentError):
+        # not backed by a descriptor (e.g. BytesIO)
+        return False
 
 
 class Terminal(object):
@@ -69,7 +221,7 @@ class Terminal(object):
 
         self.fd = fd
         self.raw = raw
-        self.original_attributes = None
+        self.state = None
 
 
     def __enter__(self):
@@ -101,30 +253,172 @@ class Terminal(object):
         """
         Saves the current terminal attributes and makes the tty raw.
 
-        This method returns None immediately.
+        Sessions sharing the terminal share its State, so only the first of
+        them changes the attributes. This method returns None immediately.
         """
 
-        if os.isatty(self.fd.fileno()) and self.israw():
-            self.original_attributes = termios.tcgetattr(self.fd)
-            tty.setraw(self.fd)
+        if self.israw() and self.state is None:
+            self.state = state(self.fd)
+            self.state.acquire_raw()
 
 
     def stop(self):
         """
         Restores the terminal attributes back to before setting raw mode.
 
-        If the raw terminal was not started, does nothing.
+        If the raw terminal was not started, or other sessions still have it
+        raw, does nothing.
         """
 
-        if self.original_attributes is not None:
-            termios.tcsetattr(
-                self.fd,
-                termios.TCSADRAIN,
-                self.original_attributes,
-            )
+        if self.state is not None:
+            self.state.release_raw()
+            self.state = None
 
     def __repr__(self):
         return "{cls}({fd}, raw={raw})".format(
             cls=type(self).__name__,
             fd=self.fd,
             raw=self.raw)
+
+
+class Master(io.FileStream):
+    """
+    The master side of a local PTY, which reads EOF once the slave is closed.
+    """
+
+    __slots__ = ()
+
+    def read(self, n=4096):
+        try:
+            return super(Master, self).read(n)
+        except EnvironmentError as e:
+            # Linux reports a closed slave as EIO, after any output left
+            if e.errno != errno.EIO:
+                raise e
+            return None
+
+
+class Slave(object):
+    """
+    The slave side of a local PTY, written the container's output and read
+    for its input.
+
+    Closing the slave when the output ends makes the master read EOF, but
+    while a pump is reading the slave it is only closed on the pump's next
+    read, so that select() is never given a closed descriptor.
+    """
+
+    def __init__(self, fd):
+        self.stream = io.Stream(fd)
+        self.reading = False
+        self.finished = False
+
+    def fileno(self):
+        return self.stream.fileno()
+
+    def set_blocking(self, value):
+        return self.stream.set_blocking(value)
+
+    def read(self, n=4096):
+        """
+        Read the input, as edited by the line discipline.
+        """
+
+        if self.finished and not self.stream.needs_write():
+            self.stream.close()
+            return None
+
+        data = self.stream.read(n)
+        if not data:
+            # EOF typed in canonical mode; nothing will read the slave again
+            self.reading = False
+        return data
+
+    def buffered(self):
+        """
+        Returns True once the output has ended, so that the reading pump is
+        flushed, and sees EOF, without waiting for input.
+        """
+
+        return self.finished and not (self.stream.closed or self.stream.needs_write())
+
+    def write(self, data):
+        return self.stream.write(data)
+
+    def needs_write(self):
+        return self.stream.needs_write()
+
+    def do_write(self):
+        written = self.stream.do_write()
+        if self.finished and not self.reading:
+            self.stream.close()
+        return written
+
+    def close(self):
+        """
+        End the output, closing the slave once it is written.
+        """
+
+        self.finished = True
+        if not self.reading:
+            self.stream.close()
+
+    def __repr__(self):
+        return "{cls}({stream})".format(cls=type(self).__name__, stream=self.stream)
+
+
+class LocalPTY(object):
+    """
+    A local pseudo-terminal for a container attached without one.
+
+    The container's output, demultiplexed in the order its frames arrive, is
+    written to the slave, and the terminal displays what the master reads.
+    Keystrokes are written to the master, and the container is sent what the
+    slave reads. The line discipline in between gives the session echo, line
+    editing and newline translation, as a tty in the container would, and
+    typing the EOF character (^D) closes the container's stdin.
+
+    Example:
+
+        pty = LocalPTY(io.Demuxer(io.Stream(socket)), size=(24, 80))
+        pumps = [
+            io.Pump(io.Stream(sys.stdin), pty.master, propagate_close=False),
+            io.Pump(pty.slave, pty.stream, wait_for_output=False, half_close=True),
+            io.Pump(pty.stream, pty.slave),
+            io.Pump(pty.master, io.Stream(sys.stdout), propagate_close=False),
+        ]
+    """
+
+    def __init__(self, stream, size=None):
+        """
+        Initialize a LocalPTY between the user and the container's `stream`.
+        """
+
+        master, slave = os.openpty()
+        self.stream = stream
+        self.master = Master(os.fdopen(master, 'r+b', 0))
+        self.slave = Slave(os.fdopen(slave, 'r+b', 0))
+
+        if size is not None:
+            self.resize(*size)
+
+    def resize(self, rows, cols):
+        """
+        Set the size of the local PTY.
+        """
+
+        if not self.slave.stream.closed:
+            fcntl.ioctl(self.slave.fileno(), termios.TIOCSWINSZ,
+                        struct.pack('HHHH', int(rows), int(cols), 0, 0))
+
+    def close(self):
+        """
+        Close the local PTY and the container's stream.
+        """
+
+        lifecycle.abort(self.master)
+        self.slave.stream.abort()
+        self.stream.close()
+
+    def __repr__(self):
+        return "{cls}({stream})".format(cls=type(self).__name__, stream=self.stream)
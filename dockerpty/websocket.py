@@ -0,0 +1,635 @@
+# dockerpty: websocket.py
+#
+# Copyright 2014 Chris Corbyn <chris@w3style.co.uk>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import base64
+import binascii
+import errno
+import hashlib
+import json
+import socket
+import struct
+
+import dockerpty.io as io
+import dockerpty.transform as transform
+from dockerpty.control import Executor
+from dockerpty.lifecycle import Lifecycle
+from dockerpty.loop import Loop
+from dockerpty.pty import RunOperation, ExecOperation
+
+
+GUID = b'258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+OP_CONTINUATION = 0x0
+OP_TEXT = 0x1
+OP_BINARY = 0x2
+OP_CLOSE = 0x8
+OP_PING = 0x9
+OP_PONG = 0xa
+
+
+class ProtocolError(Exception):
+    """
+    Raised when a peer breaks the WebSocket protocol.
+    """
+
+
+def accept_key(key):
+    """
+    Returns the Sec-WebSocket-Accept value for the client's Sec-WebSocket-Key.
+    """
+
+    digest = hashlib.sha1(key.strip().encode('ascii') + GUID).digest()
+    return base64.b64encode(digest).decode('ascii')
+
+
+if hasattr(int, 'from_bytes'):
+    def _to_int(data):
+        return int.from_bytes(data, 'big')
+
+    def _from_int(value, n):
+        return value.to_bytes(n, 'big')
+else:
+    # Python 2 and pypy
+    def _to_int(data):
+        return int(binascii.hexlify(data), 16)
+
+    def _from_int(value, n):
+        return binascii.unhexlify('%0*x' % (2 * n, value))
+
+
+def unmask(payload, mask):
+    """
+    XOR `payload` with the 4 byte `mask`, as a single big integer operation.
+    """
+
+    n = len(payload)
+    if n == 0:
+        return b''
+
+    key = (bytes(mask) * (n // 4 + 1))[:n]
+    return _from_int(_to_int(payload) ^ _to_int(key), n)
+
+
+def encode_frame(opcode, payload=b'', mask=None):
+    """
+    Returns a single final frame carrying `payload`.
+
+    Servers send frames unmasked. Clients must pass a 4 byte `mask`.
+    """
+
+    n = len(payload)
+    mask_bit = 0x80 if mask is not None else 0
+
+    if n < 126:
+        header = struct.pack('>BB', 0x80 | opcode, mask_bit | n)
+    elif n < 0x10000:
+        header = struct.pack('>BBH', 0x80 | opcode, mask_bit | 126, n)
+    else:
+        header = struct.pack('>BBQ', 0x80 | opcode, mask_bit | 127, n)
+
+    if mask is not None:
+        return header + bytes(mask) + unmask(payload, mask)
+
+    return header + transform.as_bytes(payload)
+
+
+class FrameParser(object):
+    """
+    Incremental WebSocket frame parser.
+
+    Bytes are fed in as they arrive; complete frames are returned as
+    (fin, opcode, payload) tuples and partial frames are kept for later.
+    """
+
+    def __init__(self, max_size=1 << 20):
+        """
+        Initialize a FrameParser rejecting frames over `max_size` bytes.
+        """
+
+        self.buffer = bytearray()
+        self.max_size = max_size
+
+    def feed(self, data):
+        """
+        Add `data` and return the list of frames it completes.
+        """
+
+        self.buffer += data
+        frames = []
+        buf = self.buffer
+        pos = 0
+
+        while len(buf) - pos >= 2:
+            b0, b1 = buf[pos], buf[pos + 1]
+            length = b1 & 0x7f
+            offset = pos + 2
+
+            if length == 126:
+                if len(buf) - offset < 2:
+                    break
+                length, = struct.unpack_from('>H', buf, offset)
+                offset += 2
+            elif length == 127:
+                if len(buf) - offset < 8:
+                    break
+                length, = struct.unpack_from('>Q', buf, offset)
+                offset += 8
+
+            if length > self.max_size:
+                raise ProtocolError("Frame of {0} bytes is too large".format(length))
+
+            mask = None
+            if b1 & 0x80:
+                if len(buf) - offset < 4:
+                    break
+                mask = bytes(buf[offset:offset + 4])
+                offset += 4
+
+            if len(buf) - offset < length:
+                break
+
+            payload = bytes(buf[offset:offset + length])
+            if mask is not None:
+                payload = unmask(payload, mask)
+
+            frames.append((bool(b0 & 0x80), b0 & 0x0f, payload))
+            pos = offset + length
+
+        if pos:
+            del buf[:pos]
+
+        return frames
+
+
+class WebSocketStream(object):
+    """
+    Presents a WebSocket connection as a Stream.
+
+    Reading returns the payload of binary frames sent by the browser, which is
+    treated as the container's stdin. Writing sends binary frames, so output
+    is never base64 encoded. Text frames carry JSON control messages, which are
+    passed to `on_message`; pings are answered.
+
+    Once more than `high_water` bytes are waiting to be sent the stream reports
+    that it is `full()`, which stops the pumps feeding it until the browser
+    catches up.
+    """
+
+    def __init__(self, sock, on_message=None, on_close=None, high_water=1 << 20):
+        """
+        Initialize a WebSocketStream over the connected socket `sock`.
+        """
+
+        self.sock = sock
+        self.stream = io.Stream(sock)
+        self.parser = FrameParser()
+        self.on_message = on_message
+        self.on_close = on_close
+        self.high_water = high_water
+        self.pending = bytearray()
+        self.message = None
+        self.peer_closed = False
+        self.closed = False
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def set_blocking(self, value):
+        return self.stream.set_blocking(value)
+
+    def isatty(self):
+        return False
+
+    def read(self, n=4096):
+        """
+        Returns up to `n` bytes of binary payload, b'' once the peer has closed
+        the connection, or raises EAGAIN if only control frames were read.
+        """
+
+        if not self.pending and not self.peer_closed:
+            data = self.stream.read(65536)
+            if not data:
+                self._peer_closed()
+            else:
+                for fin, opcode, payload in self.parser.feed(data):
+                    self._handle(fin, opcode, payload)
+
+        if self.pending:
+            data = bytes(self.pending[:n])
+            del self.pending[:n]
+            return data
+
+        if self.peer_closed:
+            return b''
+
+        raise OSError(errno.EAGAIN, "No WebSocket payload available")
+
+    def buffered(self):
+        """
+        Returns the number of payload bytes already received but not read.
+        """
+
+        return len(self.pending)
+
+    def write(self, data):
+        """
+        Send `data` as a binary frame.
+        """
+
+        if not data:
+            return None
+
+        if self.closed:
+            # the browser has gone; drop output rather than buffer it forever
+            return len(data)
+
+        self.stream.write(encode_frame(OP_BINARY, data))
+        return len(data)
+
+    def ping(self, payload=b''):
+        """
+        Send a ping frame, to keep the connection through idle proxies.
+        """
+
+        if not self.closed:
+            self.stream.write(encode_frame(OP_PING, payload))
+
+    def needs_write(self):
+        return self.stream.needs_write()
+
+    def do_write(self):
+        return self.stream.do_write()
+
+    def full(self):
+        return len(self.stream.buffer) > self.high_water
+
+    def close(self, code=1000):
+        """
+        Send a close frame and close the socket once it has been written.
+        """
+
+        if self.closed:
+            return
+
+        self.closed = True
+        try:
+            self.stream.write(encode_frame(OP_CLOSE, struct.pack('>H', code)))
+        except EnvironmentError:
+            pass
+        self.stream.close()
+
+    def abort(self):
+        """
+        Close the socket now, discarding anything not yet sent.
+        """
+
+        self.closed = True
+        self.stream.abort()
+
+    def _handle(self, fin, opcode, payload):
+        if opcode == OP_PING:
+            self.stream.write(encode_frame(OP_PONG, payload))
+        elif opcode == OP_CLOSE:
+            self._peer_closed()
+        elif opcode == OP_BINARY:
+            self._data(fin, payload)
+        elif opcode == OP_TEXT:
+            self.message = bytearray(payload)
+            if fin:
+                self._message()
+        elif opcode == OP_CONTINUATION:
+            if self.message is not None:
+                self.message += payload
+                if fin:
+                    self._message()
+            else:
+                self._data(fin, payload)
+        elif opcode != OP_PONG:
+            raise ProtocolError("Unknown opcode {0}".format(opcode))
+
+    def _data(self, fin, payload):
+        self.pending += payload
+
+    def _message(self):
+        message, self.message = self.message, None
+        if self.on_message is not None:
+            self.on_message(json.loads(message.decode('utf-8')))
+
+    def _peer_closed(self):
+        if not self.peer_closed:
+            self.peer_closed = True
+            if self.on_close is not None:
+                self.on_close()
+
+    def __repr__(self):
+        return "{cls}({sock})".format(cls=type(self).__name__, sock=self.sock)
+
+
+def allowed_origin(headers, origins=()):
+    """
+    Returns True if the request `headers` may open a session.
+
+    Browsers send the page's Origin, which must be one of `origins` or the
+    server's own (matching the Host header), so that other sites cannot drive
+    the container. Requests without an Origin are not from browsers, and are
+    allowed.
+    """
+
+    origin = headers.get('origin')
+    if origin is None or origin in origins:
+        return True
+
+    host = headers.get('host')
+    return host is not None and origin.split('://', 1)[-1].lower() == host.lower()
+
+
+def default_resolve(client, path, stream, headers):
+    """
+    Returns the Operation for a request `path`.
+
+    `/containers/<id>/attach` attaches to a running container and
+    `/exec/<id>/start` starts an exec instance created with tty=True.
+    """
+
+    parts = path.split('?')[0].strip('/').split('/')
+
+    if len(parts) == 3 and parts[0] == 'containers' and parts[2] == 'attach':
+        return RunOperation(client, parts[1], stdin=stream, stdout=stream, stderr=stream, logs=0)
+
+    if len(parts) == 3 and parts[0] == 'exec' and parts[2] == 'start':
+        return ExecOperation(client, parts[1], stdin=stream, stdout=stream, stderr=stream)
+
+    return None
+
+
+class Connection(object):
+    """
+    One browser connection: the HTTP upgrade, then a bridged session.
+    """
+
+    MAX_REQUEST = 8192
+
+    def __init__(self, server, sock):
+        self.server = server
+        self.sock = sock
+        self.request = b''
+        self.stream = None
+        self.operation = None
+        self.lifecycle = Lifecycle()
+        self.group = None
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def handshake(self):
+        """
+        Read the upgrade request and, once complete, start the session.
+        """
+
+        try:
+            data = self.sock.recv(4096)
+        except EnvironmentError as e:
+            if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                return
+            data = b''
+
+        self.request += data
+        if b'\r\n\r\n' not in self.request:
+            if not data or len(self.request) > Connection.MAX_REQUEST:
+                self._reject()
+            return
+
+        self.server.loop.remove_reader(self)
+
+        path, headers = self._parse(self.request)
+        key = headers.get('sec-websocket-key')
+        if path is None or key is None or headers.get('upgrade', '').lower() != 'websocket':
+            return self._reject()
+        if not allowed_origin(headers, self.server.origins):
+            return self._reject(b'403 Forbidden')
+
+        self.stream = WebSocketStream(self.sock,
+                                      on_message=self._message,
+                                      on_close=self._browser_closed)
+        self.operation = self.server.resolve(self.server.client, path, self.stream,
+                                             headers)
+        if self.operation is None:
+            return self._reject(b'404 Not Found')
+
+        self.stream.stream.write((
+            'HTTP/1.1 101 Switching Protocols\r\n'
+            'Upgrade: websocket\r\n'
+            'Connection: Upgrade\r\n'
+            'Sec-WebSocket-Accept: {0}\r\n\r\n'.format(accept_key(key))
+        ).encode('ascii'))
+
+        self.server.connections.add(self)
+        self.server.executor.submit(self._opened, self._open)
+
+    def _open(self):
+        """
+        Attach to the container. Runs on the server's executor.
+        """
+
+        sockets = self.lifecycle.adopt(self.operation.sockets())
+        return self.operation.start(sockets=sockets)
+
+    def _opened(self, future):
+        try:
+            pumps = future.result()
+        except Exception:
+            self.server.connections.discard(self)
+            self._close_stream(1011)
+            self.lifecycle.close()
+            return
+
+        for pump in pumps:
+            pump.set_blocking(False)
+
+        self.group = self.server.loop.add(pumps, on_done=self._done,
+                                          idle_timeout=self.server.idle_timeout,
+                                          keepalive=self.server.keepalive,
+                                          on_keepalive=self._ping)
+
+    def _parse(self, request):
+        head = request.split(b'\r\n\r\n', 1)[0].decode('latin-1')
+        lines = head.split('\r\n')
+        parts = lines[0].split(' ')
+        if len(parts) != 3 or parts[0] != 'GET':
+            return None, {}
+
+        headers = {}
+        for line in lines[1:]:
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        return parts[1], headers
+
+    def _reject(self, status=b'400 Bad Request'):
+        self.server.loop.remove_reader(self)
+        try:
+            self.sock.send(b'HTTP/1.1 ' + status + b'\r\nContent-Length: 0\r\n\r\n')
+        except EnvironmentError:
+            pass
+        self.sock.close()
+
+    def _message(self, message):
+        if message.get('type') == 'resize':
+            self.server.executor.submit_latest((self, 'resize'), None, self._resize,
+                                               int(message['rows']), int(message['cols']))
+
+    def _resize(self, rows, cols):
+        try:
+            self.operation.resize(height=rows, width=cols)
+        except IOError:  # Container already exited
+            pass
+
+    def _ping(self, group):
+        self.stream.ping()
+
+    def _browser_closed(self):
+        if self.group is not None:
+            self.group.cancel()
+
+    def _done(self, group):
+        self.server.connections.discard(self)
+        self._close_stream()
+        self.lifecycle.close()
+
+    def _close_stream(self, code=1000):
+        self.stream.close(code)
+        if self.stream.needs_write():
+            # the browser is not reading, and nothing will write the rest once
+            # the session has left the loop
+            self.stream.abort()
+
+    def __repr__(self):
+        return "{cls}({sock})".format(cls=type(self).__name__, sock=self.sock)
+
+
+class Server(object):
+    """
+    Serves container PTYs to browsers (e.g. xterm.js) over WebSockets.
+
+    Every connection is bridged to an Operation's sockets with the usual
+    pumps, and all of them share one Loop. Browsers send keystrokes as binary
+    frames and resize the PTY with text frames such as:
+
+        {"type": "resize", "rows": 24, "cols": 80}
+
+    Attaching and resizing call the daemon, so these calls are made on an
+    Executor of `workers` threads, leaving the loop free to pump.
+
+    `resolve(client, path, stream, headers)` returns the Operation for a
+    request path, using `stream` for its stdin, stdout and stderr, or None to
+    refuse it. `headers` maps the request's lower-cased header names to their
+    values, e.g. for checking a token. `default_resolve` serves
+    `/containers/<id>/attach` and `/exec/<id>/start`.
+
+    Browsers may only connect from pages served by this server, or from the
+    `origins` given (e.g. `['https://console.example.com']`).
+
+    Sessions idle for `idle_timeout` seconds are closed, and a ping is sent
+    on connections idle for `keepalive` seconds.
+
+    Example:
+
+        server = Server(docker.Client())
+        server.listen('127.0.0.1', 8022)
+        server.serve_forever()
+    """
+
+    def __init__(self, client, resolve=default_resolve, loop=None, workers=4,
+                 idle_timeout=None, keepalive=None, origins=()):
+        """
+        Initialize a Server. Nothing is listened on until `listen()`.
+        """
+
+        self.client = client
+        self.resolve = resolve
+        self.origins = frozenset(origins)
+        self.idle_timeout = idle_timeout
+        self.keepalive = keepalive
+        self.loop = loop or Loop()
+        self.executor = Executor(self.loop, workers=workers)
+        self.listener = None
+        self.connections = set()
+
+    def listen(self, host='127.0.0.1', port=0, backlog=128):
+        """
+        Listen for connections on (`host`, `port`) and return the address.
+        """
+
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind((host, port))
+        self.listener.listen(backlog)
+        self.listener.setblocking(False)
+        self.loop.add_reader(self.listener, self._accept)
+        return self.listener.getsockname()
+
+    def add_connection(self, sock):
+        """
+        Serve the already connected socket `sock`.
+        """
+
+        sock.setblocking(False)
+        connection = Connection(self, sock)
+        self.loop.add_reader(connection, connection.handshake)
+        return connection
+
+    def serve_forever(self):
+        """
+        Run the loop until `stop()` is called.
+        """
+
+        self.loop.run()
+
+    def stop(self):
+        """
+        Stop serving. Safe to call from any thread.
+        """
+
+        self.loop.stop()
+
+    def close(self):
+        """
+        Stop listening. Sessions in progress are left to finish.
+        """
+
+        if self.listener is not None:
+            self.loop.remove_reader(self.listener)
+            self.listener.close()
+            self.listener = None
+
+    def _accept(self):
+        try:
+            sock, _ = self.listener.accept()
+        except EnvironmentError as e:
+            if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                return
+            raise e
+
+        if io.SELECT_LIMIT is not None and sock.fileno() >= io.SELECT_LIMIT:
+            # select() would fail for every session on the loop
+            sock.close()
+            return
+
+        self.add_connection(sock)
+
+    def __repr__(self):
+        return "{cls}({client})".format(cls=type(self).__name__,
+                                        client=self.client)
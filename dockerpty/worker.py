@@ -0,0 +1,158 @@
+# dockerpty: worker.py
+#
+# Copyright 2014 Chris Corbyn <chris@w3style.co.uk>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import threading
+from concurrent.futures import Future, CancelledError
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+import dockerpty.io as io
+from dockerpty.lifecycle import Lifecycle
+
+
+class Worker(object):
+    """
+    Runs a PseudoTerminal's pump loop on a dedicated I/O thread.
+
+    The caller's thread stays free. Input is handed to the I/O thread through
+    a pipe with `send()`, and output comes back as chunks of bytes on the
+    `output` queue, followed by None once the PTY is closed. `exit_code` is a
+    Future for the process' exit code.
+
+    Example:
+
+        worker = PseudoTerminal(client, operation).start_background()
+        worker.send(b'ls\\n')
+        chunk = worker.output.get()
+        ...
+        code = worker.wait()
+
+    The worker takes over the operation's stdin, stdout and stderr. No WINCH
+    handler is installed, since signals can only be trapped on the main
+    thread; call `resize()` on the PseudoTerminal instead.
+    """
+
+    def __init__(self, pty):
+        """
+        Initialize a Worker for the PseudoTerminal `pty`.
+
+        Initializing a Worker has no immediate side effects. The `start()`
+        method must be invoked to start the thread.
+        """
+
+        self.pty = pty
+        self.output = queue.Queue()
+        self.exit_code = Future()
+        self.thread = None
+        self.stdin = None
+        self.sockets = None
+        self.stopped = False
+        self.lock = threading.Lock()
+
+    def start(self):
+        """
+        Start the I/O thread and return self.
+        """
+
+        operation = self.pty.operation
+        r, w = os.pipe()
+        self.stdin = w
+        operation.stdin = os.fdopen(r, 'rb', 0)
+        operation.stdout = operation.stderr = io.QueueStream(self.output)
+
+        self.thread = threading.Thread(target=self._run, name=repr(self))
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def send(self, data):
+        """
+        Send `data` to the process' stdin. Safe to call from any thread.
+
+        This blocks if the pipe to the I/O thread is full.
+        """
+
+        view = memoryview(data)
+        with self.lock:
+            if self.stdin is None:
+                raise ValueError("{0!r} stdin is closed".format(self))
+            while len(view):
+                view = view[os.write(self.stdin, view):]
+
+    def close_stdin(self):
+        """
+        Close the process' stdin once everything sent has been written.
+        """
+
+        with self.lock:
+            if self.stdin is not None:
+                os.close(self.stdin)
+                self.stdin = None
+
+    def stop(self, timeout=None):
+        """
+        Stop pumping, close the container's sockets and wait for the thread.
+
+        `exit_code` is cancelled, since the process may still be running.
+        """
+
+        self.stopped = True
+        self.pty.detach()
+        if self.thread is not None:
+            self.thread.join(timeout)
+
+    def wait(self, timeout=None):
+        """
+        Wait for the PTY to close and return the exit code.
+
+        Returns None if the worker was stopped. Re-raises any exception which
+        stopped the I/O thread.
+        """
+
+        try:
+            return self.exit_code.result(timeout)
+        except CancelledError:
+            return None
+
+    def _run(self):
+        operation = self.pty.operation
+        try:
+            with Lifecycle() as lifecycle:
+                self.sockets = lifecycle.adopt(operation.sockets())
+                self.pty.start(sockets=self.sockets, handle_winch=False)
+
+                if self.stopped:
+                    self.exit_code.cancel()
+                else:
+                    self.exit_code.set_result(operation.exit_code())
+        except BaseException as e:
+            self.exit_code.set_exception(e)
+        finally:
+            try:
+                self._close()
+            finally:
+                self.output.put(None)
+
+    def _close(self):
+        self.close_stdin()
+        self.pty.operation.stdin.close()
+
+    def __repr__(self):
+        return "{cls}({pty})".format(cls=type(self).__name__, pty=self.pty)
@@ -33,7 +33,7 @@ setup(
     url='https://github.com/d11wtq/dockerpty',
     author='Chris Corbyn',
     author_email='chris@w3style.co.uk',
-    install_requires=['six >= 1.3.0'],
+    install_requires=['six >= 1.3.0', 'futures >= 3.0; python_version < "3"'],
     license='Apache 2.0',
     keywords='docker, tty, pty, terminal',
     packages=['dockerpty'],
@@ -0,0 +1,117 @@
+# dockerpty: test_batch.py.
+#
+# Copyright 2014 Chris Corbyn <chris@w3style.co.uk>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from expects import expect, equal, be_a, be_none, be_above_or_equal
+import dockerpty
+from dockerpty.batch import Batch, container_name
+from dockerpty.loop import Loop
+from dockerpty.testing import FakeDocker
+
+import tempfile
+
+
+def contents(f):
+    f.seek(0)
+    return f.read()
+
+
+class CountingBatch(Batch):
+
+    peak = 0
+
+    def _schedule(self):
+        super(CountingBatch, self)._schedule()
+        self.peak = max(self.peak, self.inflight)
+
+
+class TestBatch(object):
+
+    def setup_method(self, method):
+        self.client = FakeDocker(
+            on_exec=lambda container, cmd: {'output': container.encode('ascii') + b'\nend', 'exit_code': 2}
+        )
+        self.containers = [self.client.create_container(command='sleep 10') for _ in range(5)]
+        for container in self.containers:
+            self.client.start(container)
+
+    def teardown_method(self, method):
+        self.client.close()
+
+    def test_prefixed_output(self):
+        stdout = tempfile.TemporaryFile()
+        dockerpty.exec_many(self.client, self.containers[:2], ['true'], stdout=stdout)
+        lines = sorted(contents(stdout).splitlines())
+        expect(lines).to(equal([
+            b'000000000001 | 000000000001',
+            b'000000000001 | end',
+            b'000000000002 | 000000000002',
+            b'000000000002 | end',
+        ]))
+
+    def test_results_are_in_order(self):
+        results = dockerpty.exec_many(self.client, self.containers, ['true'],
+                                      stdout=tempfile.TemporaryFile())
+        expect([r.container for r in results]).to(equal(self.containers))
+        expect([r.exit_code for r in results]).to(equal([2] * 5))
+        for result in results:
+            expect(result.error).to(be_none)
+            expect(result.elapsed).to(be_above_or_equal(0))
+
+    def test_concurrency_is_bounded(self):
+        batch = CountingBatch(self.client, self.containers, ['true'], concurrency=2,
+                              stdout=tempfile.TemporaryFile())
+        results = batch.run()
+        expect(batch.peak).to(equal(2))
+        expect(len(results)).to(equal(5))
+
+    def test_own_loop_is_closed_after_the_run(self):
+        closed = []
+        batch = Batch(self.client, self.containers[:1], ['true'], stdout=tempfile.TemporaryFile())
+        batch.run()
+        expect(batch.loop).to(be_none)
+
+        loop = Loop()
+        loop.close = lambda: closed.append(loop)
+        Batch(self.client, self.containers[:1], ['true'], stdout=tempfile.TemporaryFile(),
+              loop=loop).run()
+        expect(closed).to(equal([]))
+        del loop.close
+        loop.close()
+
+    def test_errors_are_recorded(self):
+        results = dockerpty.exec_many(self.client, ['nope'], ['true'],
+                                      stdout=tempfile.TemporaryFile())
+        expect(results[0].error).to(be_a(ValueError))
+        expect(results[0].exit_code).to(be_none)
+
+    def test_local_commands(self):
+        client = FakeDocker()
+        container = client.create_container(command='sleep 10')
+        client.start(container)
+        stdout = tempfile.TemporaryFile()
+        try:
+            results = dockerpty.exec_many(client, [container], 'echo hi; exit 3',
+                                          stdout=stdout, prefix=False)
+        finally:
+            client.close()
+        expect(contents(stdout)).to(equal(b'hi\n'))
+        expect(results[0].exit_code).to(equal(3))
+
+
+def test_container_name():
+    expect(container_name({'Id': 'a' * 64})).to(equal('a' * 12))
+    expect(container_name({'Name': '/web_1', 'Id': 'abc'})).to(equal('web_1'))
+    expect(container_name('abc')).to(equal('abc'))
@@ -0,0 +1,188 @@
+# dockerpty: test_broker.py.
+#
+# Copyright 2014 Chris Corbyn <chris@w3style.co.uk>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from expects import expect, equal, contain, raise_error
+import dockerpty.frames as frames
+from dockerpty.transform import as_bytes
+from dockerpty.broker import Broker, BrokerOperation, Reframer, connect
+from dockerpty.testing import FakeDocker
+
+import json
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+
+
+class Chunks(object):
+
+    def __init__(self, *chunks):
+        self.chunks = list(chunks)
+
+    def read(self, n=4096):
+        return self.chunks.pop(0) if self.chunks else None
+
+
+def read_until(sock, expected):
+    sock.settimeout(2)
+    data = b''
+    while expected not in data:
+        chunk = sock.recv(4096)
+        if not chunk:
+            break
+        data += chunk
+    return data
+
+
+def read_all(sock):
+    sock.settimeout(2)
+    data = b''
+    while True:
+        chunk = sock.recv(4096)
+        if not chunk:
+            return data
+        data += chunk
+
+
+def test_reframer_returns_whole_frames():
+    frame = frames.encode(1, b'hello')
+    reframer = Reframer(Chunks(frame[:3], frame[3:] + frame[:9], frame[9:]))
+    expect(lambda: reframer.read()).to(raise_error(OSError))
+
+    payloads = b''
+    for data in (reframer.read(), reframer.read()):
+        parsed, end = frames.parse(data)
+        expect(end).to(equal(len(data)))
+        payloads += b''.join(as_bytes(p) for _, p in parsed)
+    expect(payloads).to(equal(b'hellohello'))
+
+
+def wait_for(condition, limit=2):
+    deadline = time.time() + limit
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+
+
+class BrokerTest(object):
+
+    def setup_method(self, method):
+        self.client = FakeDocker()
+        self.attaches = []
+        attach_socket = self.client.attach_socket
+
+        def counted(container, params=None, ws=False):
+            self.attaches.append(container)
+            return attach_socket(container, params, ws)
+
+        self.client.attach_socket = counted
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'broker.sock')
+        self.broker = Broker(self.client, self.path)
+        self.broker.listen()
+        self.thread = threading.Thread(target=self.broker.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def teardown_method(self, method):
+        self.broker.stop()
+        self.thread.join(2)
+        self.broker.close()
+        self.broker.loop.close()
+        self.client.close()
+        shutil.rmtree(self.dir)
+
+
+class TestBroker(BrokerTest):
+
+    def test_viewers_share_one_attach(self):
+        container = self.client.create_container(tty=True, stdin_open=True, echo=True)
+        self.client.start(container)
+
+        first, response = connect(self.path, container['Id'], write=True)
+        expect(response).to(equal({'tty': True, 'writer': True}))
+        second, response = connect(self.path, container['Id'], write=True)
+        expect(response).to(equal({'tty': True, 'writer': False}))
+
+        second.sendall(b'ignored\n')
+        first.sendall(b'hello\n')
+        expect(read_until(first, b'hello')).to(contain(b'hello'))
+        expect(read_until(second, b'hello')).not_to(contain(b'ignored'))
+        expect(self.attaches).to(equal([container['Id']]))
+
+        first.close()
+        second.close()
+
+    def test_writer_role_is_freed_when_the_writer_leaves(self):
+        container = self.client.create_container(tty=True, stdin_open=True, echo=True)
+        self.client.start(container)
+
+        first, response = connect(self.path, container['Id'], write=True)
+        watcher, response = connect(self.path, container['Id'])
+        first.close()
+
+        attachment = self.broker.attachments[container['Id']]
+        wait_for(lambda: attachment.writer is None)
+        second, response = connect(self.path, container['Id'], write=True)
+        expect(response['writer']).to(equal(True))
+
+        second.close()
+        watcher.close()
+
+    def test_non_tty_output_is_framed_until_exit(self):
+        container = self.client.create_container(output=b'hello\n', errors=b'oops\n')
+        viewer, response = connect(self.path, container['Id'])
+        expect(response['tty']).to(equal(False))
+
+        self.client.start(container)
+        pieces = frames.Decoder().feed(read_all(viewer))
+        expect(sorted((s, as_bytes(p)) for s, p in pieces)).to(equal([
+            (1, b'hello\n'),
+            (2, b'oops\n'),
+        ]))
+        viewer.close()
+
+    def test_invalid_requests_are_refused(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(self.path)
+        sock.sendall(b'nonsense\n')
+        expect(json.loads(read_all(sock).decode('utf-8'))).to(equal({'error': 'Invalid request'}))
+        sock.close()
+
+    def test_unknown_containers_are_refused(self):
+        expect(lambda: connect(self.path, 'missing')).to(raise_error(IOError))
+
+
+class TestBrokerOperation(BrokerTest):
+
+    def test_writer_pumps_stdin_and_output(self):
+        container = self.client.create_container(tty=True, stdin_open=True, echo=True)
+        self.client.start(container)
+        operation = BrokerOperation(self.path, container['Id'])
+        stream = operation.sockets()
+        expect(len(operation.start(sockets=stream))).to(equal(2))
+        stream.close()
+
+    def test_other_viewers_only_pump_output(self):
+        container = self.client.create_container(output=b'hello\n')
+        writer = BrokerOperation(self.path, container['Id'])
+        viewer = BrokerOperation(self.path, container['Id'])
+        streams = [writer.sockets(), viewer.sockets()]
+        expect(len(viewer.start(sockets=streams[1]))).to(equal(1))
+        expect(viewer.israw()).to(equal(False))
+        for stream in streams:
+            stream.close()
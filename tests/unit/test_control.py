@@ -0,0 +1,182 @@
+# dockerpty: test_control.py.
+#
+# Copyright 2014 Chris Corbyn <chris@w3style.co.uk>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from expects import expect, equal, be_a, be_true, raise_error
+from dockerpty.control import Executor, Pool
+from dockerpty.loop import Loop
+from dockerpty.pty import PseudoTerminal, RunOperation
+from dockerpty.testing import FakeDocker
+
+import os
+import tempfile
+import threading
+import time
+
+
+class Client(object):
+
+    def __init__(self, delay=0):
+        self.delay = delay
+        self.closed = False
+
+    def inspect_container(self, container):
+        time.sleep(self.delay)
+        return {'Id': container, 'Client': self}
+
+    def fail(self):
+        raise IOError("daemon went away")
+
+    def close(self):
+        self.closed = True
+
+
+class TestPool(object):
+
+    def test_reuses_idle_clients(self):
+        created = []
+        pool = Pool(lambda: created.append(Client()) or created[-1])
+        first = pool.inspect_container('a')['Client']
+        second = pool.inspect_container('b')['Client']
+        expect(second).to(equal(first))
+        expect(len(created)).to(equal(1))
+        expect((pool.stats.misses, pool.stats.hits)).to(equal((1, 1)))
+
+    def test_never_creates_more_than_size_clients(self):
+        created = []
+        pool = Pool(lambda: created.append(Client(0.02)) or created[-1], size=2)
+        threads = [threading.Thread(target=pool.inspect_container, args=('a',))
+                   for _ in range(6)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        expect(len(created)).to(equal(2))
+        expect(pool.stats.calls('inspect_container')).to(equal(6))
+        expect(pool.stats.waits > 0).to(be_true)
+
+    def test_records_latency(self):
+        pool = Pool(lambda: Client(0.01))
+        pool.inspect_container('a')
+        mean, worst = pool.stats.latency('inspect_container')
+        expect(mean >= 0.01).to(be_true)
+        expect(worst >= mean).to(be_true)
+
+    def test_errors_are_counted_and_the_client_returned(self):
+        pool = Pool(Client, size=1)
+        expect(pool.fail).to(raise_error(IOError))
+        expect(pool.stats.errors).to(equal(1))
+        expect(pool.inspect_container('a')['Id']).to(equal('a'))
+
+    def test_close_closes_clients(self):
+        pool = Pool(Client)
+        client = pool.inspect_container('a')['Client']
+        pool.close()
+        expect(client.closed).to(be_true)
+        expect(lambda: pool.inspect_container('a')).to(raise_error(RuntimeError))
+
+    def test_invalid_size(self):
+        expect(lambda: Pool(Client, size=0)).to(raise_error(ValueError))
+
+    def test_sessions_run_through_the_pool(self):
+        docker = FakeDocker()
+        pool = Pool(lambda: docker)
+        container = docker.create_container(output=b'pooled', tty=True)
+        stdout = tempfile.TemporaryFile()
+        try:
+            operation = RunOperation(pool, container, stdin=open(os.devnull, 'rb'),
+                                     stdout=stdout, logs=0, interactive=False)
+            PseudoTerminal(pool, operation).start(handle_winch=False)
+        finally:
+            docker.close()
+        stdout.seek(0)
+        expect(stdout.read()).to(equal(b'pooled'))
+        expect(pool.stats.calls('attach_socket') > 0).to(be_true)
+        expect(pool.stats.misses).to(equal(1))
+
+
+def run_until(loop, condition, timeout=1):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        loop.run_once(0.05)
+
+
+class TestExecutor(object):
+
+    def setup_method(self, method):
+        self.loop = Loop()
+        self.executor = Executor(self.loop)
+
+    def teardown_method(self, method):
+        self.executor.close()
+        self.loop.close()
+
+    def test_callbacks_run_on_the_loop_thread(self):
+        results = []
+        callback = lambda f: results.append((f.result(), threading.current_thread()))
+        self.executor.submit(callback, lambda a, b: a + b, 1, 2)
+        run_until(self.loop, lambda: results)
+        expect(results).to(equal([(3, threading.current_thread())]))
+
+    def test_exceptions_are_delivered(self):
+        errors = []
+        self.executor.submit(lambda f: errors.append(f.exception()), Client().fail)
+        run_until(self.loop, lambda: errors)
+        expect(errors[0]).to(be_a(IOError))
+
+    def test_submit_latest_replaces_waiting_calls(self):
+        calls = []
+        started = threading.Event()
+        release = threading.Event()
+
+        def resize(size):
+            calls.append(size)
+            started.set()
+            release.wait(1)
+
+        self.executor.submit_latest('resize', None, resize, 1)
+        started.wait(1)
+        for size in (2, 3, 4):
+            self.executor.submit_latest('resize', None, resize, size)
+        release.set()
+        deadline = time.time() + 1
+        while len(calls) < 2 and time.time() < deadline:
+            time.sleep(0.01)
+        time.sleep(0.05)
+        expect(calls).to(equal([1, 4]))
+
+
+def test_resize_does_not_block_the_pty():
+    class SlowOperation(object):
+        sizes = []
+
+        def israw(self):
+            return True
+
+        def resize(self, height, width):
+            time.sleep(0.2)
+            self.sizes.append((height, width))
+
+    operation = SlowOperation()
+    pty = PseudoTerminal(None, operation)
+    pty.loop = Loop()
+    pty.executor = Executor(pty.loop)
+    started = time.time()
+    pty.resize((24, 80))
+    expect(time.time() - started < 0.1).to(be_true)
+    run_until(pty.loop, lambda: operation.sizes)
+    expect(operation.sizes).to(equal([(24, 80)]))
+    pty.executor.close()
+    pty.loop.close()
@@ -0,0 +1,103 @@
+# dockerpty: test_frames.py.
+#
+# Copyright 2014 Chris Corbyn <chris@w3style.co.uk>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from expects import expect, equal, be_false, be_true, raise_error
+import dockerpty.frames as frames
+from dockerpty.transform import as_bytes
+
+import random
+
+
+def random_frames(rng, count=50):
+    return [(rng.choice((frames.STDIN, frames.STDOUT, frames.STDERR, frames.SYSTEMERR)),
+             bytes(bytearray(rng.getrandbits(8) for _ in range(rng.choice((0, 1, 7, 8, 100, 5000))))))
+            for _ in range(count)]
+
+
+def random_splits(rng, data):
+    cuts = sorted(rng.sample(range(len(data) + 1), min(len(data) + 1, rng.randint(0, 40))))
+    return [data[a:b] for a, b in zip([0] + cuts, cuts + [len(data)])]
+
+
+def merge(pieces):
+    """
+    Join consecutive pieces of the same stream, dropping frame boundaries.
+    """
+
+    merged = []
+    for stream, data in pieces:
+        if merged and merged[-1][0] == stream:
+            merged[-1] = (stream, merged[-1][1] + as_bytes(data))
+        else:
+            merged.append((stream, as_bytes(data)))
+    return merged
+
+
+def test_encode():
+    expect(frames.encode(frames.STDERR, b'abc')).to(
+        equal(b'\x02\x00\x00\x00\x00\x00\x00\x03abc')
+    )
+
+
+def test_encode_into():
+    buffer = bytearray(32)
+    offset = frames.encode_into(buffer, 0, frames.STDIN, b'ab')
+    offset = frames.encode_into(buffer, offset, frames.STDOUT, b'c')
+    expect(offset).to(equal(19))
+    expect(as_bytes(buffer[:offset])).to(
+        equal(frames.encode(frames.STDIN, b'ab') + frames.encode(frames.STDOUT, b'c'))
+    )
+
+
+def test_encode_into_a_full_buffer():
+    expect(lambda: frames.encode_into(bytearray(9), 0, 1, b'ab')).to(raise_error(ValueError))
+
+
+def test_parse_returns_complete_frames_and_offset():
+    data = frames.encode(1, b'ab') + frames.encode(2, b'cd')[:-1]
+    parsed, offset = frames.parse(data)
+    expect([(s, as_bytes(p)) for s, p in parsed]).to(equal([(1, b'ab')]))
+    expect(offset).to(equal(10))
+
+
+def test_round_trip_with_random_splits():
+    rng = random.Random(41)
+    for _ in range(200):
+        sent = random_frames(rng, rng.randint(0, 20))
+        data = b''.join(frames.encode(s, p) for s, p in sent)
+        decoder = frames.Decoder()
+        pieces = []
+        for chunk in random_splits(rng, data):
+            pieces.extend(decoder.feed(chunk))
+        expect(decoder.pending()).to(be_false)
+        expect(all(len(p) for s, p in pieces)).to(be_true)
+        expect(merge(pieces)).to(equal(merge([(s, p) for s, p in sent if p])))
+
+
+def test_round_trip_one_byte_at_a_time():
+    sent = [(1, b'hello'), (2, b''), (2, b'world'), (3, b'!')]
+    data = b''.join(frames.encode(s, p) for s, p in sent)
+    decoder = frames.Decoder()
+    pieces = []
+    for i in range(len(data)):
+        pieces.extend(decoder.feed(data[i:i + 1]))
+    expect(merge(pieces)).to(equal([(1, b'hello'), (2, b'world'), (3, b'!')]))
+
+
+def test_pending_mid_frame():
+    decoder = frames.Decoder()
+    decoder.feed(frames.encode(1, b'abc')[:9])
+    expect(decoder.pending()).to(be_true)
@@ -0,0 +1,75 @@
+# dockerpty: test_init.py.
+#
+# Copyright 2014 Chris Corbyn <chris@w3style.co.uk>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from expects import expect, equal, be_empty, contain, raise_error
+import dockerpty
+
+import json
+import os
+import subprocess
+import sys
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+HEAVY = ['dockerpty.pty', 'dockerpty.session', 'dockerpty.tty', 'ssl', 'termios', 'six']
+
+
+def modules_loaded_by(statement, modules=HEAVY):
+    """
+    Returns the `modules` loaded by running `statement` in a fresh
+    interpreter.
+    """
+
+    script = "import sys, json; before = set(sys.modules); {0}; " \
+             "print(json.dumps(sorted(set(sys.modules) - before)))".format(statement)
+    output = subprocess.check_output([sys.executable, '-c', script], cwd=ROOT)
+    loaded = json.loads(output.decode('utf-8'))
+    return [m for m in modules if m in loaded]
+
+
+def test_import_does_not_load_pty():
+    expect(modules_loaded_by('import dockerpty')).to(be_empty)
+
+
+def test_import_io_does_not_load_pty():
+    expect(modules_loaded_by('import dockerpty.io')).to(be_empty)
+
+
+def test_attribute_access_loads_pty():
+    loaded = modules_loaded_by('import dockerpty; dockerpty.PseudoTerminal')
+    expect(loaded).to(contain('dockerpty.pty'))
+    expect(loaded).not_to(contain('ssl'))
+
+
+def test_pty_does_not_load_concurrent_futures():
+    # a backport on Python 2
+    statement = 'import dockerpty.pty, dockerpty.session'
+    expect(modules_loaded_by(statement, ['concurrent.futures'])).to(be_empty)
+
+
+def test_lazy_attributes_resolve():
+    from dockerpty.pty import RunOperation
+    expect(dockerpty.RunOperation).to(equal(RunOperation))
+
+
+def test_submodules_are_attributes():
+    script = 'import dockerpty; dockerpty.io.Stream; dockerpty.tty.Terminal'
+    subprocess.check_call([sys.executable, '-c', script], cwd=ROOT)
+
+
+def test_unknown_attribute_raises():
+    expect(lambda: dockerpty.NoSuchThing).to(raise_error(AttributeError))
@@ -16,13 +16,20 @@
 
 from expects import expect, equal, be_none, be_true, be_false, raise_error
 from io import StringIO, BytesIO
+import dockerpty.frames as frames
 import dockerpty.io as io
+import dockerpty.transform as transform
+from dockerpty.loop import Loop
+from tests.util import ssl_socketpair
 
+import errno
 import sys
 import os
 import fcntl
+import resource
 import socket
 import tempfile
+import threading
 import six
 
 
@@ -82,8 +89,163 @@ def test_select_returns_streams_for_writing():
     expect(io.select([a, b], [a, b], timeout=0)).to(equal(([], [a, b])))
 
 
+def test_select_watches_descriptors_above_fd_setsize():
+    if io.SELECT_LIMIT is not None or resource.getrlimit(resource.RLIMIT_NOFILE)[0] <= 1100:
+        return
+    a, b = socket.socketpair()
+    high = 1100
+    os.dup2(a.fileno(), high)
+    try:
+        b.send(b'x')
+        expect(io.select([high], [], timeout=1)[0]).to(equal([high]))
+    finally:
+        os.close(high)
+        a.close()
+        b.close()
+
+
+def test_parse_keys_converts_ctrl_keys():
+    expect(io.parse_keys('ctrl-p,ctrl-q')).to(equal(b'\x10\x11'))
+
+
+def test_parse_keys_accepts_plain_characters():
+    expect(io.parse_keys('ctrl-a, x')).to(equal(b'\x01x'))
+
+
+def test_parse_keys_rejects_invalid_keys():
+    expect(lambda: io.parse_keys('ctrl-pq')).to(raise_error(ValueError))
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestTokenBucket(object):
+
+    def test_starts_full(self):
+        bucket = io.TokenBucket(10, burst=20, clock=FakeClock())
+        expect(bucket.available()).to(equal(20))
+
+    def test_refills_at_rate_up_to_burst(self):
+        clock = FakeClock()
+        bucket = io.TokenBucket(10, burst=20, clock=clock)
+        bucket.consume(20)
+        clock.now += 0.5
+        expect(bucket.available()).to(equal(5))
+        clock.now += 10
+        expect(bucket.available()).to(equal(20))
+
+    def test_allow_does_not_count_a_larger_request(self):
+        bucket = io.TokenBucket(1000, clock=FakeClock())
+        expect(bucket.allow(4096)).to(equal(1000))
+        expect(bucket.throttled).to(equal(0))
+
+    def test_deadline_is_when_a_byte_is_available(self):
+        clock = FakeClock()
+        bucket = io.TokenBucket(10, clock=clock)
+        bucket.consume(10)
+        expect(bucket.deadline()).to(equal(100.1))
+
+    def test_rejects_non_positive_rate(self):
+        expect(lambda: io.TokenBucket(0)).to(raise_error(ValueError))
+
+
+class TestWaker(object):
+
+    def test_wake_makes_it_readable(self):
+        waker = io.Waker()
+        expect(io.select([waker], [], timeout=0)).to(equal(([], [])))
+        waker.wake()
+        expect(io.select([waker], [], timeout=0)).to(equal(([waker], [])))
+        waker.close()
+
+    def test_clear_drains_wake_ups(self):
+        waker = io.Waker()
+        waker.wake()
+        waker.wake()
+        waker.clear()
+        expect(io.select([waker], [], timeout=0)).to(equal(([], [])))
+        waker.close()
+
+
+class TestKeyMatcher(object):
+
+    def test_forwards_data_without_the_sequence(self):
+        matcher = io.KeyMatcher(b'\x10\x11')
+        expect(matcher.feed(b'ls\n')).to(equal(b'ls\n'))
+        expect(matcher.matched).to(be_false)
+
+    def test_matches_sequence_within_a_chunk(self):
+        matcher = io.KeyMatcher(b'\x10\x11')
+        expect(matcher.feed(b'ls\x10\x11rest')).to(equal(b'ls'))
+        expect(matcher.matched).to(be_true)
+
+    def test_matches_sequence_split_across_chunks(self):
+        matcher = io.KeyMatcher(b'\x10\x11')
+        expect(matcher.feed(b'ls\x10')).to(equal(b'ls'))
+        expect(matcher.matched).to(be_false)
+        expect(matcher.feed(b'\x11')).to(equal(b''))
+        expect(matcher.matched).to(be_true)
+
+    def test_releases_held_bytes_when_sequence_does_not_follow(self):
+        matcher = io.KeyMatcher(b'\x10\x11')
+        expect(matcher.feed(b'\x10')).to(equal(b''))
+        expect(matcher.feed(b'a')).to(equal(b'\x10a'))
+        expect(matcher.matched).to(be_false)
+
+    def test_flush_returns_held_bytes(self):
+        matcher = io.KeyMatcher(b'\x10\x11')
+        matcher.feed(b'a\x10')
+        expect(matcher.flush()).to(equal(b'\x10'))
+        expect(matcher.flush()).to(equal(b''))
+
+
 class TestStream(object):
 
+    def test_socket_streams_are_specialized(self):
+        a, b = socket.socketpair()
+        expect(isinstance(io.Stream(a), io.SocketStream)).to(be_true)
+
+    def test_file_streams_are_specialized(self):
+        with tempfile.TemporaryFile() as f:
+            expect(isinstance(io.Stream(f), io.FileStream)).to(be_true)
+
+    def test_streams_accept_new_attributes(self):
+        a, b = socket.socketpair()
+        stream = io.Stream(a)
+        stream.name = 'stdin'
+        expect(stream.name).to(equal('stdin'))
+
+    def test_other_subclasses_read_and_write(self):
+        class Counted(io.Stream):
+            def __init__(self, fd):
+                super(Counted, self).__init__(fd)
+                self.reads = 0
+
+            def read(self, n=4096):
+                self.reads += 1
+                return super(Counted, self).read(n)
+
+        a, b = socket.socketpair()
+        stream = Counted(a)
+        expect(stream.write(b'ping')).to(equal(4))
+        expect(b.recv(16)).to(equal(b'ping'))
+        b.send(b'pong')
+        expect(stream.read(16)).to(equal(b'pong'))
+        expect(stream.reads).to(equal(1))
+        stream.close()
+        expect(b.recv(16)).to(equal(b''))
+
+        with tempfile.TemporaryFile() as f:
+            stream = Counted(f)
+            stream.write(b'data')
+            f.seek(0)
+            expect(stream.read(16)).to(equal(b'data'))
+
     def test_fileno_delegates_to_file_descriptor(self):
         stream = io.Stream(sys.stdout)
         expect(stream.fileno()).to(equal(sys.stdout.fileno()))
@@ -149,6 +311,47 @@ class TestStream(object):
         expect(read).to(equal(b'6789'))
         expect(stream.needs_write()).to(be_false)
 
+    def test_write_some_bypasses_buffer(self):
+        a, b = socket.socketpair()
+        a = WriteLimitedWrapper(a, 5)
+        stream = io.Stream(a)
+        expect(stream.write_some(b'123456789')).to(equal(5))
+        expect(stream.needs_write()).to(be_false)
+        expect(b.recv(1024)).to(equal(b'12345'))
+
+    def test_write_some_returns_zero_when_it_would_block(self):
+        a, b = socket.socketpair()
+        a.setblocking(False)
+        stream = io.Stream(a)
+        while stream.write_some(b'x' * 65536):
+            pass
+        expect(stream.write_some(b'x')).to(equal(0))
+
+    def test_write_buffers_when_it_would_block(self):
+        a, b = socket.socketpair()
+        a.setblocking(False)
+        stream = io.Stream(a)
+        while stream.write_some(b'x' * 65536):
+            pass
+        expect(stream.write(b'y')).to(equal(1))
+        expect(stream.do_write()).to(equal(0))
+        expect(stream.needs_write()).to(be_true)
+
+    def test_socket_io_is_used_as_a_socket(self):
+        if not hasattr(socket, 'SocketIO'):
+            return  # Python 2
+        a, b = socket.socketpair()
+        stream = io.Stream(socket.SocketIO(a, 'rwb'))
+        b.sendall(b'ping')
+        expect(stream.read(32)).to(equal(b'ping'))
+        stream.write(b'pong')
+        stream.shutdown_write()
+        b.settimeout(1)
+        expect(b.recv(32)).to(equal(b'pong'))
+        expect(b.recv(32)).to(equal(b''))
+        stream.close()
+        expect(b.recv(16)).to(equal(b''))
+
     def test_close(self):
         a, b = socket.socketpair()
         stream = io.Stream(a)
@@ -167,6 +370,81 @@ class TestStream(object):
         stream.do_write()
         expect(is_fd_closed(a.fileno())).to(be_true)
 
+    def test_shutdown_write_leaves_the_socket_readable(self):
+        a, b = socket.socketpair()
+        stream = io.Stream(a)
+        stream.write(b'abc')
+        stream.shutdown_write()
+        expect(b.recv(10)).to(equal(b'abc'))
+        expect(b.recv(10)).to(equal(b''))
+        b.sendall(b'reply')
+        expect(stream.read(10)).to(equal(b'reply'))
+
+    def test_shutdown_write_waits_for_pending_data(self):
+        a, b = socket.socketpair()
+        stream = io.Stream(WriteLimitedWrapper(a, 5))
+        stream.write(b'123456789')
+        stream.shutdown_write()
+        expect(b.recv(10)).to(equal(b'12345'))
+        stream.do_write()
+        expect(b.recv(10)).to(equal(b'6789'))
+        expect(b.recv(10)).to(equal(b''))
+
+class TestSSLSocketStream(object):
+
+    def setup_method(self, method):
+        self.server, self.client = ssl_socketpair()
+
+    def teardown_method(self, method):
+        self.server.close()
+        self.client.close()
+
+    def test_ssl_sockets_get_an_ssl_stream(self):
+        stream = io.Stream(self.client)
+        expect(isinstance(stream, io.SSLSocketStream)).to(be_true)
+        expect(repr(stream)).to(equal('Stream({0})'.format(self.client)))
+
+    def test_buffered_reports_decrypted_data(self):
+        stream = io.Stream(self.client)
+        self.server.sendall(b'x' * 1000)
+        expect(stream.read(10)).to(equal(b'x' * 10))
+        expect(stream.buffered()).to(equal(990))
+        expect(stream.read(4096)).to(equal(b'x' * 990))
+        expect(stream.buffered()).to(equal(0))
+
+    def test_read_with_nothing_to_read_raises_eagain(self):
+        stream = io.Stream(self.client)
+        stream.set_blocking(False)
+        try:
+            stream.read()
+            raised = None
+        except OSError as e:
+            raised = e.errno
+        expect(raised).to(equal(errno.EAGAIN))
+
+    def test_pump_drains_pending_bytes_without_waiting(self):
+        data = os.urandom(1 << 20)
+        writer = threading.Thread(target=self.server.sendall, args=(data,))
+        writer.start()
+
+        out = tempfile.TemporaryFile()
+        stream = io.Stream(self.client)
+        pump = io.Pump(stream, io.Stream(out), propagate_close=False)
+        pump.set_blocking(False)
+        loop = Loop()
+        group = loop.add([pump])
+        received = 0
+        while received < len(data):
+            # a stall would leave select() waiting out the timeout
+            loop.run_once(timeout=5)
+            received = out.tell()
+        writer.join()
+        loop.close()
+
+        out.seek(0)
+        expect(out.read() == data).to(be_true)
+
+
 class SlowStream(object):
     def __init__(self, chunks):
         self.chunks = chunks
@@ -214,7 +492,8 @@ class TestDemuxer(object):
         ])
 
         demuxer = io.Demuxer(slow_stream)
-        expect(demuxer.read(32)).to(equal(b'foo'))
+        expect(demuxer.read(32)).to(equal(b'f'))
+        expect(demuxer.read(32)).to(equal(b'oo'))
         expect(demuxer.read(32)).to(equal(b'd'))
 
     def test_reading_size_from_slow_stream(self):
@@ -226,7 +505,9 @@ class TestDemuxer(object):
         ])
 
         demuxer = io.Demuxer(slow_stream)
+        expect(lambda: demuxer.read(32)).to(raise_error(OSError))
         expect(demuxer.read(32)).to(equal(b'foo'))
+        expect(lambda: demuxer.read(32)).to(raise_error(OSError))
         expect(demuxer.read(32)).to(equal(b'd'))
 
     def test_reading_partial_chunk(self):
@@ -239,6 +520,16 @@ class TestDemuxer(object):
         expect(demuxer.read(2)).to(equal(b'o'))
         expect(demuxer.read(2)).to(equal(b'd'))
 
+    def test_reading_many_frames_from_one_read(self):
+        data = b''.join(frames.encode(frames.STDOUT, c) for c in (b'a', b'bc', b'def'))
+        demuxer = io.Demuxer(six.BytesIO(data))
+        expect(demuxer.read(64)).to(equal(b'a'))
+        expect(demuxer.buffered()).to(be_true)
+        expect(demuxer.read(2)).to(equal(b'bc'))
+        expect(demuxer.read(2)).to(equal(b'de'))
+        expect(demuxer.read(2)).to(equal(b'f'))
+        expect(demuxer.read(2)).to(be_none)
+
     def test_write_delegates_to_stream(self):
         s = StringIO()
         demuxer = io.Demuxer(s)
@@ -251,6 +542,74 @@ class TestDemuxer(object):
         expect(repr(demuxer)).to(equal("Demuxer(%s)" % s))
 
 
+class TestRingBuffer(object):
+
+    def test_keeps_everything_until_full(self):
+        ring = io.RingBuffer(8)
+        ring.write(b'abc')
+        ring.write(b'def')
+        expect(ring.getvalue()).to(equal(b'abcdef'))
+        expect(len(ring)).to(equal(6))
+
+    def test_overwrites_oldest_data_when_wrapping(self):
+        ring = io.RingBuffer(8)
+        ring.write(b'abcdef')
+        ring.write(b'ghij')
+        expect(ring.getvalue()).to(equal(b'cdefghij'))
+        expect(len(ring.chunks())).to(equal(2))
+
+    def test_write_larger_than_size_keeps_the_tail(self):
+        ring = io.RingBuffer(4)
+        ring.write(b'ab')
+        ring.write(b'0123456789')
+        expect(ring.getvalue()).to(equal(b'6789'))
+
+    def test_storage_is_not_reallocated(self):
+        ring = io.RingBuffer(4)
+        storage = ring.buffer
+        for _ in range(10):
+            ring.write(b'abc')
+        expect(ring.buffer is storage).to(be_true)
+        expect(ring.getvalue()).to(equal(b'cabc'))
+
+    def test_replay_writes_to_stream(self):
+        ring = io.RingBuffer(4)
+        ring.write(b'abcdef')
+        s = BytesIO()
+        ring.replay(s)
+        expect(s.getvalue()).to(equal(b'cdef'))
+
+    def test_clear(self):
+        ring = io.RingBuffer(4)
+        ring.write(b'abc')
+        ring.clear()
+        expect(ring.getvalue()).to(equal(b''))
+
+    def test_rejects_non_positive_size(self):
+        expect(lambda: io.RingBuffer(0)).to(raise_error(ValueError))
+
+
+class TestTap(object):
+
+    def test_read_records_data(self):
+        recorder = BytesIO()
+        tap = io.Tap(BytesIO(b'food'), recorder)
+        expect(tap.read(3)).to(equal(b'foo'))
+        expect(tap.read(3)).to(equal(b'd'))
+        expect(recorder.getvalue()).to(equal(b'food'))
+
+    def test_write_delegates_to_stream(self):
+        s = BytesIO()
+        tap = io.Tap(s, BytesIO())
+        tap.write(b'test')
+        expect(s.getvalue()).to(equal(b'test'))
+
+    def test_repr(self):
+        s = BytesIO()
+        tap = io.Tap(s, BytesIO())
+        expect(repr(tap)).to(equal("Tap(%s)" % s))
+
+
 class TestPump(object):
 
     def test_fileno_delegates_to_from_stream(self):
@@ -271,6 +630,17 @@ class TestPump(object):
         pump = io.Pump(a, b)
         expect(pump.flush(3)).to(equal(2))
 
+    def test_half_close_shuts_down_writing_at_eof(self):
+        a, b = socket.socketpair()
+        stream = io.Stream(a)
+        pump = io.Pump(BytesIO(b'in'), stream, half_close=True)
+        pump.flush()
+        expect(pump.flush()).to(be_none)
+        expect(b.recv(10)).to(equal(b'in'))
+        expect(b.recv(10)).to(equal(b''))
+        b.sendall(b'out')
+        expect(stream.read(10)).to(equal(b'out'))
+
     def test_repr(self):
         a = StringIO(u'fo')
         b = StringIO()
@@ -294,3 +664,163 @@ class TestPump(object):
 
         pump.flush()
         expect(pump.is_done()).to(be_true)
+
+    def test_flush_reads_no_more_than_limits_allow(self):
+        clock = FakeClock()
+        a = BytesIO(b'0123456789')
+        b = BytesIO()
+        pump = io.Pump(a, b, limits=[io.TokenBucket(4, clock=clock)])
+        expect(pump.flush()).to(equal(4))
+        expect(pump.readable()).to(be_false)
+        expect(pump.flush()).to(equal(0))
+        expect(pump.deadline()).to(equal(100.25))
+
+        clock.now += 0.5
+        expect(pump.readable()).to(be_true)
+        expect(pump.deadline()).to(be_none)
+        expect(pump.flush()).to(equal(2))
+        expect(b.getvalue()).to(equal(b'012345'))
+
+    def test_only_reads_held_back_count_as_throttled(self):
+        bucket = io.TokenBucket(1000, clock=FakeClock())
+        pump = io.Pump(BytesIO(b'x' * 100), BytesIO(), limits=[bucket])
+        expect(pump.flush()).to(equal(100))
+        expect(bucket.throttled).to(equal(0))
+
+        pump = io.Pump(BytesIO(b'x' * 2000), BytesIO(), limits=[bucket])
+        expect(pump.flush()).to(equal(900))
+        expect(bucket.throttled).to(equal(1))
+
+    def test_shared_limit_applies_to_several_pumps(self):
+        bucket = io.TokenBucket(4, clock=FakeClock())
+        one = io.Pump(BytesIO(b'abc'), BytesIO(), limits=[bucket])
+        two = io.Pump(BytesIO(b'def'), BytesIO(), limits=[bucket])
+        expect(one.flush()).to(equal(3))
+        expect(two.flush()).to(equal(1))
+
+    def test_flush_applies_transforms(self):
+        b = BytesIO()
+        pump = io.Pump(BytesIO(b'a\nbc'), b,
+                       propagate_close=False,
+                       transforms=[transform.Lines(), transform.Prefix(b'> ')])
+        pump.flush(3)
+        expect(b.getvalue()).to(equal(b'> a\n'))
+        pump.flush(3)
+        pump.flush(3)
+        expect(b.getvalue()).to(equal(b'> a\n> bc'))
+
+    def test_flush_stops_at_detach_keys(self):
+        a = BytesIO(b'ls\x10\x11rest')
+        b = BytesIO()
+        pump = io.Pump(a, b, wait_for_output=False, detach_keys=b'\x10\x11')
+        expect(pump.flush()).to(be_none)
+        expect(pump.detached).to(be_true)
+        expect(pump.eof).to(be_true)
+        expect(b.getvalue()).to(equal(b'ls'))
+        expect(b.closed).to(be_false)
+
+    def test_flush_forwards_held_bytes_at_eof(self):
+        a = BytesIO(b'ls\x10')
+        b = BytesIO()
+        pump = io.Pump(a, b, propagate_close=False, detach_keys=b'\x10\x11')
+        pump.flush()
+        pump.flush()
+        expect(pump.detached).to(be_false)
+        expect(b.getvalue()).to(equal(b'ls\x10'))
+
+
+class StalledStream(object):
+    """
+    A stream which accepts no data until it is resumed.
+    """
+
+    def __init__(self):
+        self.data = b''
+        self.stalled = True
+        self.closed = False
+
+    def write_some(self, data):
+        if self.stalled:
+            return 0
+        self.data += data.tobytes()
+        return len(data)
+
+    def close(self):
+        self.closed = True
+
+
+class TestBroadcastPump(object):
+
+    def test_flush_writes_to_every_sink(self):
+        a, b = BytesIO(), BytesIO()
+        pump = io.BroadcastPump(BytesIO(b'food'), [io.Sink(a), io.Sink(b)])
+        expect(pump.flush(3)).to(equal(3))
+        pump.flush(3)
+        expect(a.getvalue()).to(equal(b'food'))
+        expect(b.getvalue()).to(equal(b'food'))
+
+    def test_slow_sink_does_not_stall_others_when_dropping(self):
+        fast, slow = BytesIO(), StalledStream()
+        pump = io.BroadcastPump(BytesIO(b'abcdefgh'),
+                                [io.Sink(fast), io.Sink(slow, io.Sink.DROP, limit=4)])
+        pump.flush(3)
+        pump.flush(3)
+        pump.flush(3)
+        expect(pump.readable()).to(be_true)
+        expect(fast.getvalue()).to(equal(b'abcdefgh'))
+        expect(pump.sinks[1].dropped).to(equal(4))
+
+        slow.stalled = False
+        expect(pump.write_streams()).to(equal([pump.sinks[1]]))
+        pump.sinks[1].do_write()
+        expect(slow.data).to(equal(b'efgh'))
+
+    def test_slow_sink_is_disconnected(self):
+        fast, slow = BytesIO(), StalledStream()
+        sink = io.Sink(slow, io.Sink.DISCONNECT, limit=2)
+        pump = io.BroadcastPump(BytesIO(b'abc'), [io.Sink(fast), sink])
+        pump.flush()
+        expect(sink.disconnected).to(be_true)
+        expect(slow.closed).to(be_true)
+        expect(len(pump.sinks)).to(equal(1))
+
+    def test_slow_sink_blocks_reading(self):
+        slow = StalledStream()
+        pump = io.BroadcastPump(BytesIO(b'abc'), [io.Sink(slow, limit=2)])
+        pump.flush()
+        expect(pump.readable()).to(be_false)
+        expect(pump.is_done()).to(be_false)
+
+        slow.stalled = False
+        pump.sinks[0].do_write()
+        expect(pump.readable()).to(be_true)
+
+    def test_buffer_is_discarded_once_written_everywhere(self):
+        pump = io.BroadcastPump(BytesIO(b'x' * 100), [io.Sink(BytesIO())])
+        pump.flush(10)
+        pump.flush(10)
+        expect(len(pump.buffer)).to(equal(0))
+        expect(pump.base).to(equal(20))
+
+    def test_eof_closes_sinks_once_drained(self):
+        slow = StalledStream()
+        pump = io.BroadcastPump(BytesIO(b'abc'), [io.Sink(slow)])
+        pump.flush()
+        expect(pump.flush()).to(be_none)
+        expect(slow.closed).to(be_false)
+
+        slow.stalled = False
+        pump.sinks[0].do_write()
+        expect(slow.closed).to(be_true)
+        expect(pump.is_done()).to(be_true)
+
+    def test_write_to_socket_sinks(self):
+        a, b = socket.socketpair()
+        c, d = socket.socketpair()
+        pump = io.BroadcastPump(BytesIO(b'test'), [io.Sink(io.Stream(a)), io.Sink(io.Stream(c))])
+        pump.flush()
+        expect(b.recv(32)).to(equal(b'test'))
+        expect(d.recv(32)).to(equal(b'test'))
+
+    def test_rejects_unknown_policy(self):
+        expect(lambda: io.Sink(BytesIO(), 'wait')).to(raise_error(ValueError))
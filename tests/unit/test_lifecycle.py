@@ -0,0 +1,91 @@
+# dockerpty: test_lifecycle.py.
+#
+# Copyright 2014 Chris Corbyn <chris@w3style.co.uk>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from expects import expect, equal, be_true, raise_error
+import dockerpty.io as io
+from dockerpty.lifecycle import CancelToken, Counters, Lifecycle
+
+import socket
+
+
+class Broken(object):
+    def close(self):
+        raise IOError("close failed")
+
+
+def test_lifecycle_closes_streams_on_error():
+    counters = Counters()
+    a, b = socket.socketpair()
+    stream = io.Stream(a)
+
+    def session():
+        with Lifecycle(counters) as lifecycle:
+            lifecycle.adopt((None, stream))
+            raise RuntimeError("boom")
+
+    expect(session).to(raise_error(RuntimeError))
+    expect(stream.closed).to(be_true)
+    expect(counters.open).to(equal(0))
+    b.close()
+
+
+def test_lifecycle_discards_pending_writes():
+    a, b = socket.socketpair()
+    stream = io.Stream(a)
+    stream.buffer = b'unsent'
+    with Lifecycle(Counters()) as lifecycle:
+        lifecycle.adopt(io.Demuxer(stream))
+    expect(stream.closed).to(be_true)
+    b.close()
+
+
+def test_lifecycle_closes_the_rest_when_one_fails():
+    counters = Counters()
+    a, b = socket.socketpair()
+    stream = io.Stream(a)
+    with Lifecycle(counters) as lifecycle:
+        lifecycle.adopt([stream, Broken()])
+    expect(stream.closed).to(be_true)
+    expect((counters.open, counters.errors)).to(equal((0, 1)))
+    b.close()
+
+
+def test_cancel_token_calls_callbacks_once():
+    calls = []
+    token = CancelToken()
+    token.add_callback(lambda: calls.append(1))
+    token.cancel()
+    token.cancel()
+    expect(calls).to(equal([1]))
+
+
+def test_cancel_token_calls_late_callbacks_now():
+    calls = []
+    token = CancelToken()
+    token.cancel()
+    token.add_callback(lambda: calls.append(1))
+    expect(calls).to(equal([1]))
+
+
+def test_removed_callbacks_are_not_called():
+    calls = []
+    callback = lambda: calls.append(1)
+    token = CancelToken()
+    token.add_callback(callback)
+    token.remove_callback(callback)
+    token.cancel()
+    expect(calls).to(equal([]))
+    expect(token.cancelled).to(be_true)
@@ -0,0 +1,150 @@
+# dockerpty: test_logs.py.
+#
+# Copyright 2014 Chris Corbyn <chris@w3style.co.uk>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from expects import expect, equal, be_none, raise_error
+import dockerpty.logs as logs
+
+import errno
+
+
+NOW = 1500000000.0
+
+
+class Chunks(object):
+    """
+    A live stream returning `chunks` one read at a time, then EOF.
+    """
+
+    def __init__(self, *chunks):
+        self.chunks = list(chunks)
+
+    def read(self, n=4096):
+        if not self.chunks:
+            return None
+        return self.chunks.pop(0)
+
+
+def entries(*lines, **kwargs):
+    when = kwargs.get('when', NOW)
+    return [(int(when * 1e9), line) for line in lines]
+
+
+def read_all(stream):
+    out = []
+    while True:
+        try:
+            data = stream.read()
+        except OSError as e:
+            if e.errno != errno.EAGAIN:
+                raise
+            continue
+        if data is None:
+            return b''.join(out)
+        out.append(data)
+
+
+def test_parse_timestamp():
+    expect(logs.parse_timestamp(b'2017-07-14T02:40:00.5Z')).to(equal(int(NOW * 1e9) + 500000000))
+    expect(logs.parse_timestamp('2017-07-14T04:40:00+02:00')).to(equal(int(NOW * 1e9)))
+
+
+def test_parse_timestamp_rejects_garbage():
+    expect(lambda: logs.parse_timestamp('yesterday')).to(raise_error(ValueError))
+
+
+def test_format_timestamp_round_trips():
+    ns = int(NOW * 1e9) + 123456789
+    expect(logs.parse_timestamp(logs.format_timestamp(ns))).to(equal(ns))
+
+
+def test_split_entries():
+    data = b'2017-07-14T02:40:00Z one\n2017-07-14T02:40:01.25Z two\r\nmore\n'
+    expect(logs.split_entries(data)).to(equal([
+        (int(NOW * 1e9), b'one\n'),
+        (int(NOW) * 10**9 + 1250000000, b'two\r\nmore\n'),
+    ]))
+
+
+def test_first_params_use_since_and_tail():
+    cursor = logs.Cursor(since=NOW + 0.5, tail=10)
+    params = cursor.params('stdout')
+    expect((params['since'], params['tail'], params['stderr'])).to(equal((int(NOW), 10, False)))
+
+
+def test_params_resume_from_position_less_margin():
+    cursor = logs.Cursor(tail=10, margin=2.0)
+    cursor.advance('stdout', b'x', int(NOW * 1e9))
+    params = cursor.params('stdout')
+    expect((params['since'], params['tail'])).to(equal((int(NOW) - 2, 'all')))
+
+
+def test_unread_skips_what_was_seen():
+    cursor = logs.Cursor()
+    cursor.advance('stdout', b'one\ntw', int(NOW * 1e9))
+    unread = cursor.unread('stdout', entries(b'zero\n', b'one\n', b'two\n', b'three\n'))
+    expect(b''.join(p for _, p in unread)).to(equal(b'o\nthree\n'))
+
+
+def test_unread_keeps_everything_when_the_seen_output_is_gone():
+    cursor = logs.Cursor()
+    cursor.advance('stdout', b'rotated away\n', int(NOW * 1e9))
+    unread = cursor.unread('stdout', entries(b'one\n'))
+    expect(unread).to(equal(entries(b'one\n')))
+
+
+def test_unread_filters_by_since_first():
+    cursor = logs.Cursor(since=NOW + 1)
+    unread = cursor.unread('stdout', entries(b'old\n') + entries(b'new\n', when=NOW + 1))
+    expect([p for _, p in unread]).to(equal([b'new\n']))
+
+
+def test_resume_replays_then_reads_live():
+    cursor = logs.Cursor()
+    resume = logs.Resume(Chunks(b'live\n'), cursor, 'stdout', entries(b'old\n'), NOW + 10)
+    expect(read_all(resume)).to(equal(b'old\nlive\n'))
+
+
+def test_resume_drops_live_output_repeating_the_log():
+    cursor = logs.Cursor()
+    resume = logs.Resume(Chunks(b'tw', b'o\nthr', b'ee\nfour\n'), cursor, 'stdout',
+                         entries(b'one\n', b'two\n', b'three\n'), NOW)
+    expect(read_all(resume)).to(equal(b'one\ntwo\nthree\nfour\n'))
+
+
+def test_resume_keeps_live_output_which_only_resembles_the_log():
+    cursor = logs.Cursor()
+    resume = logs.Resume(Chunks(b'two\nfive\n'), cursor, 'stdout',
+                         entries(b'one\n', b'two\n', b'three\n'), NOW)
+    expect(read_all(resume)).to(equal(b'one\ntwo\nthree\ntwo\nfive\n'))
+
+
+def test_resume_only_matches_output_logged_after_attaching():
+    cursor = logs.Cursor(margin=1.0)
+    resume = logs.Resume(Chunks(b'one\n'), cursor, 'stdout', entries(b'one\n'), NOW + 5)
+    expect(read_all(resume)).to(equal(b'one\none\n'))
+
+
+def test_resume_advances_the_cursor():
+    cursor = logs.Cursor(keep=8)
+    resume = logs.Resume(Chunks(b'live\n'), cursor, 'stdout', entries(b'old\n'), NOW + 10)
+    read_all(resume)
+    expect(cursor.positions['stdout'].seen).to(equal(b'old\nlive\n'[-8:]))
+    expect(cursor.positions['stdout'].since > int(NOW * 1e9)).to(equal(True))
+
+
+def test_resume_at_eof_returns_none():
+    resume = logs.Resume(Chunks(), logs.Cursor(), 'stdout', [], NOW)
+    expect(resume.read()).to(be_none)
@@ -0,0 +1,148 @@
+# dockerpty: test_loop.py.
+#
+# Copyright 2014 Chris Corbyn <chris@w3style.co.uk>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from expects import expect, equal, be_none, be_true, be_a, be_below
+import dockerpty.io as io
+import dockerpty.transform as transform
+from dockerpty.loop import Loop, Timeout
+
+import socket
+
+
+def run_until(loop, group, limit=2):
+    deadline = io.clock() + limit
+    while not group.done and io.clock() < deadline:
+        loop.run_once(timeout=limit)
+
+
+class TestTimers(object):
+
+    def setup_method(self, method):
+        self.loop = Loop()
+        self.calls = []
+
+    def teardown_method(self, method):
+        self.loop.close()
+
+    def test_timers_run_in_order(self):
+        now = io.clock()
+        self.loop.call_at(now + 0.02, self.calls.append, 'b')
+        self.loop.call_at(now + 0.01, self.calls.append, 'a')
+        while len(self.calls) < 2:
+            self.loop.run_once()
+        expect(self.calls).to(equal(['a', 'b']))
+
+    def test_cancelled_timers_do_not_run(self):
+        self.loop.call_later(0, self.calls.append, 'a').cancel()
+        self.loop.call_later(0.01, self.calls.append, 'b')
+        while not self.calls:
+            self.loop.run_once()
+        expect(self.calls).to(equal(['b']))
+
+    def test_select_waits_until_the_soonest_timer(self):
+        self.loop.call_later(0.02, self.calls.append, 'a')
+        started = io.clock()
+        self.loop.run_once(timeout=5)
+        expect(self.calls).to(equal(['a']))
+        expect(io.clock() - started).to(be_below(1))
+
+    def test_no_timers_means_no_timeout(self):
+        expect(self.loop._next_timer()).to(be_none)
+
+
+class TestGroupTimeouts(object):
+
+    def setup_method(self, method):
+        self.loop = Loop()
+        self.ours, self.theirs = socket.socketpair()
+        self.stream = io.Stream(self.ours)
+        self.stream.set_blocking(False)
+        self.out = io.Stream(open('/dev/null', 'wb'))
+
+    def teardown_method(self, method):
+        self.loop.close()
+        self.ours.close()
+        self.theirs.close()
+        self.out.close()
+
+    def pumps(self):
+        return [io.Pump(self.stream, self.out, propagate_close=False)]
+
+    def test_idle_group_times_out(self):
+        group = self.loop.add(self.pumps(), idle_timeout=0.05)
+        run_until(self.loop, group)
+        expect(group.error).to(be_a(Timeout))
+
+    def test_activity_postpones_the_idle_timeout(self):
+        group = self.loop.add(self.pumps(), idle_timeout=0.1)
+        started = io.clock()
+        while io.clock() - started < 0.2:
+            self.theirs.send(b'x')
+            self.loop.run_once(timeout=0.02)
+        expect(group.error).to(be_none)
+        run_until(self.loop, group)
+        expect(group.error).to(be_a(Timeout))
+
+    def test_deadline_applies_despite_activity(self):
+        group = self.loop.add(self.pumps(), timeout=0.05)
+        started = io.clock()
+        while not group.done and io.clock() - started < 2:
+            self.theirs.send(b'x')
+            self.loop.run_once(timeout=0.01)
+        expect(group.error).to(be_a(Timeout))
+
+    def test_keepalive_called_while_idle(self):
+        pings = []
+        group = self.loop.add(self.pumps(), keepalive=0.02, on_keepalive=pings.append,
+                              timeout=0.11)
+        run_until(self.loop, group)
+        expect(len(pings) >= 3).to(be_true)
+        expect(pings[0]).to(equal(group))
+
+    def test_finished_group_cancels_its_timers(self):
+        group = self.loop.add(self.pumps(), idle_timeout=60, timeout=60)
+        group.cancel()
+        self.loop.run_once(timeout=0)
+        expect(group.done).to(be_true)
+        expect(self.loop._next_timer()).to(be_none)
+
+
+class TestTransforms(object):
+
+    def setup_method(self, method):
+        self.loop = Loop()
+        self.ours, self.theirs = socket.socketpair()
+        self.stream = io.Stream(self.ours)
+        self.stream.set_blocking(False)
+        self.reader, self.writer = socket.socketpair()
+        self.reader.settimeout(0)
+
+    def teardown_method(self, method):
+        self.loop.close()
+        for sock in (self.ours, self.theirs, self.reader, self.writer):
+            sock.close()
+
+    def test_held_bytes_are_released_without_more_input(self):
+        intercept = transform.Intercept({b'\x1b[21~': lambda s: None}, timeout=0.02)
+        pump = io.Pump(self.stream, io.Stream(self.writer), transforms=[intercept])
+        self.loop.add([pump])
+        self.theirs.send(b'\x1b')
+        started = io.clock()
+        self.loop.run_once(timeout=5)
+        expect(intercept.held).to(equal(b'\x1b'))
+        self.loop.run_once(timeout=5)
+        expect(self.reader.recv(16)).to(equal(b'\x1b'))
+        expect(io.clock() - started).to(be_below(1))
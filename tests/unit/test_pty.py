@@ -0,0 +1,292 @@
+# dockerpty: test_pty.py.
+#
+# Copyright 2014 Chris Corbyn <chris@w3style.co.uk>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from expects import expect, equal, be_above, be_true, contain, raise_error
+from dockerpty.pty import PseudoTerminal, RunOperation, ExecOperation, exec_create
+import dockerpty.io as io
+from dockerpty.lifecycle import CancelToken
+from dockerpty.loop import Timeout
+from dockerpty.testing import FakeDocker
+import dockerpty.logs as logs
+import dockerpty.records as records
+
+import os
+import sys
+import tempfile
+import threading
+import time
+
+
+def pipe(data=b'', close=True):
+    r, w = os.pipe()
+    os.write(w, data)
+    if close:
+        os.close(w)
+    return os.fdopen(r, 'rb')
+
+
+def contents(f):
+    f.seek(0)
+    return f.read()
+
+
+def run(client, container, stdin=None, **kwargs):
+    stdout = tempfile.TemporaryFile()
+    stderr = tempfile.TemporaryFile()
+    operation = RunOperation(client, container, stdin=stdin or pipe(),
+                             stdout=stdout, stderr=stderr, **kwargs)
+    PseudoTerminal(client, operation).start(handle_winch=False)
+    return operation, contents(stdout), contents(stderr)
+
+
+def execute(client, container, command, interactive=False, stdin=None):
+    stdout = tempfile.TemporaryFile()
+    exec_id = exec_create(client, container, command, interactive=interactive)
+    operation = ExecOperation(client, exec_id, interactive=interactive,
+                              stdin=stdin or pipe(), stdout=stdout)
+    PseudoTerminal(client, operation).start(handle_winch=False)
+    return operation, contents(stdout)
+
+
+class TestRunOperation(object):
+
+    def setup_method(self, method):
+        self.client = FakeDocker()
+
+    def teardown_method(self, method):
+        self.client.close()
+
+    def test_tty_output_is_raw(self):
+        container = self.client.create_container(output=b'hello\r\n', tty=True)
+        operation, out, err = run(self.client, container, logs=0)
+        expect(out).to(equal(b'hello\r\n'))
+        expect(err).to(equal(b''))
+
+    def test_non_tty_output_is_demultiplexed(self):
+        container = self.client.create_container(output=b'out' * 5000, errors=b'err')
+        operation, out, err = run(self.client, container, logs=0)
+        expect(out).to(equal(b'out' * 5000))
+        expect(err).to(equal(b'err'))
+
+    def test_stdin_reaches_the_container(self):
+        container = self.client.create_container(tty=True, stdin_open=True, echo=True)
+        operation, out, err = run(self.client, container, stdin=pipe(b'ping\n'), logs=0)
+        expect(out).to(equal(b'ping\n'))
+
+    def test_exit_code(self):
+        container = self.client.create_container(output=b'x', exit_code=3)
+        operation, out, err = run(self.client, container, logs=0)
+        expect(operation.exit_code()).to(equal(3))
+
+    def test_logs_replay_earlier_output(self):
+        container = self.client.create_container(output=b'before', tty=True)
+        self.client.start(container)
+        self.client.wait(container, timeout=5)
+        operation, out, err = run(self.client, container, logs=1)
+        expect(out).to(equal(b'before'))
+
+    def test_resume_replays_the_tail(self):
+        container = self.client.create_container(output=b'one\ntwo\nthree\n', tty=True)
+        self.client.start(container)
+        self.client.wait(container, timeout=5)
+        operation, out, err = run(self.client, container, resume=logs.Cursor(tail=2))
+        expect(out).to(equal(b'two\nthree\n'))
+
+    def test_resume_reads_running_output_once(self):
+        # whole lines, each written at once, so none is in progress on attaching
+        script = 'import time\nfor i in range(1000):\n    print(i)\n    time.sleep(0.0005)'
+        container = self.client.create_container(command=[sys.executable, '-u', '-c', script])
+        output = b''.join('{0}\n'.format(i).encode('ascii') for i in range(1000))
+        self.client.start(container)
+        time.sleep(0.1)
+
+        # a slow logs call, so output arrives on both it and the live stream
+        fetch = self.client.logs
+        self.client.logs = lambda *args, **kwargs: time.sleep(0.05) or fetch(*args, **kwargs)
+
+        cursor = logs.Cursor()
+        operation, out, err = run(self.client, container, resume=cursor)
+        expect(out).to(equal(output))
+
+        operation, out, err = run(self.client, container, resume=cursor)
+        expect(out).to(equal(b''))
+
+    def test_idle_timeout(self):
+        container = self.client.create_container(tty=True, stdin_open=True, echo=True)
+        operation = RunOperation(self.client, container, stdin=pipe(close=False),
+                                 stdout=tempfile.TemporaryFile(), logs=0)
+        start = lambda: PseudoTerminal(self.client, operation).start(handle_winch=False,
+                                                                     idle_timeout=0.05)
+        expect(start).to(raise_error(Timeout))
+
+    def test_output_rate(self):
+        container = self.client.create_container(output=b'x' * 2000, rate=10000, chunk=500)
+        started = time.time()
+        operation, out, err = run(self.client, container, logs=0)
+        expect(out).to(equal(b'x' * 2000))
+        expect(time.time() - started).to(be_above(0.1))
+
+    def test_local_pty_orders_and_translates_output(self):
+        container = self.client.create_container(output=b'out\n', errors=b'err\n')
+        operation, out, err = run(self.client, container, logs=0, local_pty=True)
+        expect(out).to(equal(b'out\r\nerr\r\n'))
+        expect(err).to(equal(b''))
+
+    def test_local_pty_edits_input_by_line(self):
+        container = self.client.create_container(stdin_open=True, echo=True)
+        # a typo rubbed out, then EOF to close the container's stdin
+        stdin = pipe(b'pimg\x7f\x7fng\n\x04')
+        operation, out, err = run(self.client, container, stdin=stdin, logs=0, local_pty=True)
+        # the local echo, then what the container read
+        expect(out.endswith(b'ng\r\nping\r\n')).to(be_true)
+
+    def test_merged_output_is_recorded_in_order(self):
+        container = self.client.create_container(output=b'out', errors=b'err')
+        merged = tempfile.TemporaryFile()
+        operation, out, err = run(self.client, container, logs=0, merged=merged)
+        merged.seek(0)
+        found = list(records.iterate(merged))
+        expect([(s, p) for _, s, p in found]).to(equal([(1, b'out'), (2, b'err')]))
+        expect((out, err)).to(equal((b'', b'')))
+
+    def test_resize(self):
+        container = self.client.create_container(tty=True, output=b'x')
+        operation = RunOperation(self.client, container, logs=0)
+        operation.resize(height=30, width=100)
+        expect(self.client.containers[container['Id']].size).to(equal((30, 100)))
+
+
+class TestPseudoTerminalLifecycle(object):
+
+    def setup_method(self, method):
+        self.client = FakeDocker()
+
+    def teardown_method(self, method):
+        self.client.close()
+
+    def open_fds(self):
+        return len(os.listdir('/proc/self/fd'))
+
+    def test_sockets_are_closed_after_each_session(self):
+        container = self.client.create_container(output=b'x', tty=True)
+        run(self.client, container, logs=0)
+        before = self.open_fds()
+        for _ in range(20):
+            run(self.client, container, logs=0)
+        expect(self.open_fds()).to(equal(before))
+
+    def test_sockets_are_closed_when_starting_fails(self):
+        container = self.client.create_container(output=b'x', tty=True, stdin_open=True)
+        attached = []
+        attach_socket = self.client.attach_socket
+
+        def record(*args, **kwargs):
+            attached.append(attach_socket(*args, **kwargs))
+            return attached[-1]
+
+        def fail(*args, **kwargs):
+            raise IOError("daemon went away")
+
+        self.client.attach_socket = record
+        self.client.start = fail
+
+        expect(lambda: run(self.client, container, logs=0)).to(raise_error(IOError))
+        expect(len(attached)).to(equal(3))
+        expect([s.fileno() for s in attached]).to(equal([-1, -1, -1]))
+
+    def test_cancel_token(self):
+        container = self.client.create_container(tty=True, stdin_open=True, echo=True)
+        operation = RunOperation(self.client, container, stdin=pipe(close=False),
+                                 stdout=tempfile.TemporaryFile(), logs=0)
+        pty = PseudoTerminal(self.client, operation)
+        token = CancelToken()
+        threading.Timer(0.05, token.cancel).start()
+        pty.start(handle_winch=False, cancel=token)
+        expect(pty.cancelled).to(be_true)
+
+    def test_resize_requests_are_handled_on_the_loop(self):
+        container = self.client.create_container(tty=True, stdin_open=True, echo=True)
+        operation = RunOperation(self.client, container, stdin=pipe(close=False),
+                                 stdout=tempfile.TemporaryFile(), logs=0)
+        pty = PseudoTerminal(self.client, operation)
+        threads = []
+        pty.resize = lambda size=None: threads.append(threading.current_thread())
+
+        def interrupt():
+            pty.request_resize()
+            pty.detach()
+
+        threading.Timer(0.05, interrupt).start()
+        pty.start(handle_winch=False)
+        # once on starting, then on request
+        expect(threads).to(equal([threading.current_thread()] * 2))
+
+    def test_stdin_blocking_mode_is_restored(self):
+        container = self.client.create_container(output=b'x', tty=True)
+        stdin = pipe()
+        operation, out, err = run(self.client, container, stdin=stdin, logs=0)
+        expect(io.set_blocking(stdin)).to(be_true)
+
+
+class TestExecOperation(object):
+
+    def setup_method(self, method):
+        self.client = FakeDocker()
+        self.container = self.client.create_container(command='sleep 10', tty=True)
+        self.client.start(self.container)
+
+    def teardown_method(self, method):
+        self.client.close()
+
+    def test_local_command_output(self):
+        operation, out = execute(self.client, self.container, ['echo', 'hello'])
+        expect(out).to(equal(b'hello\n'))
+        expect(operation.exit_code()).to(equal(0))
+
+    def test_local_command_on_a_tty(self):
+        operation, out = execute(self.client, self.container, 'tty -s && echo yes',
+                                 interactive=True, stdin=pipe(close=False))
+        expect(out).to(contain(b'yes'))
+
+    def test_stdin_is_sent_to_the_command(self):
+        operation, out = execute(self.client, self.container, 'head -n 1; exit 4',
+                                 interactive=True, stdin=pipe(b'hi\n', close=False))
+        expect(out).to(contain(b'hi'))
+        expect(operation.exit_code()).to(equal(4))
+
+    def test_stdin_is_closed_when_not_interactive(self):
+        operation, out = execute(self.client, self.container, 'cat; echo done')
+        expect(out).to(equal(b'done\n'))
+
+    def test_stdin_eof_does_not_cut_off_output(self):
+        data = os.urandom(1 << 20)
+        stdin = tempfile.TemporaryFile()
+        stdin.write(data)
+        stdin.seek(0)
+        stdout = tempfile.TemporaryFile()
+        exec_id = self.client.exec_create(self.container, 'cat', stdin=True, tty=False)
+        operation = ExecOperation(self.client, exec_id, stdin=stdin, stdout=stdout)
+        PseudoTerminal(self.client, operation).start(handle_winch=False)
+        expect(contents(stdout) == data).to(be_true)
+
+    def test_scripted_execs(self):
+        client = FakeDocker(on_exec=lambda container, cmd: {'output': b' '.join(cmd)})
+        container = client.create_container(command='sleep 10')
+        try:
+            operation, out = execute(client, container, [b'a', b'b'])
+            expect(out).to(equal(b'a b'))
+        finally:
+            client.close()
@@ -0,0 +1,66 @@
+# dockerpty: test_records.py.
+#
+# Copyright 2014 Chris Corbyn <chris@w3style.co.uk>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from expects import expect, equal, raise_error
+import dockerpty.frames as frames
+from dockerpty.transform import as_bytes
+import dockerpty.records as records
+
+import io
+
+
+class Chunks(object):
+
+    def __init__(self, *chunks):
+        self.chunks = list(chunks)
+
+    def read(self, n=4096):
+        return self.chunks.pop(0) if self.chunks else None
+
+
+def clock():
+    return 1500000000.5
+
+
+def test_records_round_trip():
+    data = records.encode(1, frames.STDOUT, b'out') + records.encode(2, frames.STDERR, b'')
+    parsed, offset = records.parse(data + b'\x00' * 5)
+    expect([(ns, s, as_bytes(p)) for ns, s, p in parsed]).to(equal([
+        (1, frames.STDOUT, b'out'),
+        (2, frames.STDERR, b''),
+    ]))
+    expect(offset).to(equal(len(data)))
+
+
+def test_iterate_reads_records_split_anywhere():
+    data = b''.join(records.encode(n, frames.STDOUT, b'x' * n) for n in range(20))
+    found = list(records.iterate(io.BytesIO(data), size=7))
+    expect([(ns, len(p)) for ns, _, p in found]).to(equal([(n, n) for n in range(20)]))
+
+
+def test_recorder_keeps_the_order_of_frames():
+    data = frames.encode(frames.STDOUT, b'one') + frames.encode(frames.STDERR, b'two') + \
+        frames.encode(frames.STDOUT, b'three')
+    recorder = records.Recorder(Chunks(data[:5], data[5:]), clock=clock)
+    expect(lambda: recorder.read()).to(raise_error(OSError))
+
+    parsed, _ = records.parse(recorder.read())
+    expect([(ns, s, as_bytes(p)) for ns, s, p in parsed]).to(equal([
+        (1500000000500000000, frames.STDOUT, b'one'),
+        (1500000000500000000, frames.STDERR, b'two'),
+        (1500000000500000000, frames.STDOUT, b'three'),
+    ]))
+    expect(recorder.read()).to(equal(None))
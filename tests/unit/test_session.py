@@ -0,0 +1,120 @@
+# dockerpty: test_session.py.
+#
+# Copyright 2014 Chris Corbyn <chris@w3style.co.uk>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from expects import expect, equal, be_true, be_false, raise_error
+from dockerpty.lifecycle import counters
+from dockerpty.pty import RunOperation
+from dockerpty.session import Session
+from dockerpty.testing import FakeDocker
+from tests.util import FakeClient
+
+import os
+import tempfile
+import threading
+import time
+
+
+def pipe(data=b'', close=False):
+    r, w = os.pipe()
+    os.write(w, data)
+    if close:
+        os.close(w)
+    return os.fdopen(r, 'rb')
+
+
+def contents(f):
+    f.seek(0)
+    return f.read()
+
+
+class TestSession(object):
+
+    def create_session(self, stdin, stdout, **kwargs):
+        client = FakeClient(**kwargs)
+        operation = RunOperation(client, 'c', stdin=stdin, stdout=stdout,
+                                 logs=0, detach_keys='ctrl-p,ctrl-q')
+        return client, Session(client, operation)
+
+    def test_detach_keys_park_session_and_reattach_reuses_sockets(self):
+        stdout = tempfile.TemporaryFile()
+        client, session = self.create_session(pipe(b'ls\n\x10\x11'), stdout, output=b'hello')
+
+        expect(session.attach()).to(be_true)
+        expect(client.container['stdin'].recv(32)).to(equal(b'ls\n'))
+        expect(contents(stdout)).to(equal(b'hello'))
+
+        client.container['stdout'].send(b' world')
+        client.container['stdout'].close()
+        stdout = tempfile.TemporaryFile()
+        expect(session.attach(stdin=pipe(), stdout=stdout)).to(be_false)
+
+        expect(contents(stdout)).to(equal(b'hello world'))
+        expect(client.attached).to(equal(2))
+
+    def test_detach_from_another_thread(self):
+        client, session = self.create_session(pipe(), tempfile.TemporaryFile())
+
+        def detach():
+            while session.pty is None:
+                time.sleep(0.01)
+            session.detach()
+
+        thread = threading.Thread(target=detach)
+        thread.start()
+        expect(session.attach()).to(be_true)
+        thread.join()
+
+    def test_attach_after_finish_raises(self):
+        client, session = self.create_session(pipe(), tempfile.TemporaryFile(), eof=True)
+        expect(session.attach()).to(be_false)
+        expect(lambda: session.attach()).to(raise_error(RuntimeError))
+
+    def test_sockets_are_closed_when_finished(self):
+        client, session = self.create_session(pipe(), tempfile.TemporaryFile(), eof=True)
+        before = counters.open
+        expect(session.attach()).to(be_false)
+        expect(counters.open).to(equal(before))
+        client.container['stdin'].settimeout(1)
+        expect(client.container['stdin'].recv(32)).to(equal(b''))
+
+    def test_sockets_are_closed_when_attach_fails(self):
+        client, session = self.create_session(pipe(), tempfile.TemporaryFile())
+        before = counters.open
+
+        def fail(*args, **kwargs):
+            raise IOError("daemon went away")
+
+        info = client.inspect_container('c')
+        info['State']['Running'] = False
+        client.inspect_container = lambda container: info
+        client.start = fail
+        expect(lambda: session.attach()).to(raise_error(IOError))
+        expect(counters.open).to(equal(before))
+        client.container['stdin'].settimeout(1)
+        expect(client.container['stdin'].recv(32)).to(equal(b''))
+
+    def test_local_pty_output_is_kept_in_scrollback(self):
+        client = FakeDocker()
+        try:
+            container = client.create_container(output=b'out\n')
+            operation = RunOperation(client, container, stdin=pipe(close=True),
+                                     stdout=tempfile.TemporaryFile(), logs=0,
+                                     local_pty=True)
+            session = Session(client, operation)
+            expect(session.attach()).to(be_false)
+            expect(session.scrollback.getvalue()).to(equal(b'out\r\n'))
+        finally:
+            client.close()
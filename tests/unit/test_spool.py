@@ -0,0 +1,107 @@
+# dockerpty: test_spool.py.
+#
+# Copyright 2014 Chris Corbyn <chris@w3style.co.uk>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from expects import expect, equal, be_true, be_false, raise_error
+import dockerpty
+import dockerpty.io as io
+from dockerpty.spool import Spool
+from dockerpty.testing import FakeDocker
+
+import mmap
+import os
+import shutil
+import sys
+import tempfile
+
+
+EXTENT = mmap.ALLOCATIONGRANULARITY
+
+
+def test_write_appends_data():
+    with Spool(extent=EXTENT) as spool:
+        expect(spool.write(b'hello ')).to(equal(6))
+        spool.write(b'world')
+        spool.close()
+        expect(spool.getbuffer().tobytes()).to(equal(b'hello world'))
+        expect(spool.size).to(equal(11))
+
+
+def test_write_grows_past_the_first_extent():
+    data = os.urandom(EXTENT * 3 + 17)
+    with Spool(extent=EXTENT) as spool:
+        for i in range(0, len(data), 1000):
+            spool.write(data[i:i + 1000])
+        expect(len(spool.map) >= len(data)).to(be_true)
+        expect(os.fstat(spool.file.fileno()).st_size).to(equal(len(spool.map)))
+        spool.close()
+        expect(len(spool.map)).to(equal(len(data)))
+        expect(spool.getbuffer() == data).to(be_true)
+
+
+def test_close_truncates_the_file():
+    tmp = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmp, 'out')
+        with Spool(path, extent=EXTENT) as spool:
+            spool.write(b'abc')
+            spool.close()
+            expect(os.path.getsize(path)).to(equal(3))
+        with open(path, 'rb') as f:
+            expect(f.read()).to(equal(b'abc'))
+    finally:
+        shutil.rmtree(tmp)
+
+
+def test_empty_spool_has_empty_buffer():
+    with Spool(extent=EXTENT) as spool:
+        spool.close()
+        expect(spool.getbuffer().tobytes()).to(equal(b''))
+
+
+def test_write_after_close_raises():
+    with Spool(extent=EXTENT) as spool:
+        spool.close()
+        expect(lambda: spool.write(b'x')).to(raise_error(ValueError))
+
+
+def test_pump_into_spool():
+    data = os.urandom(EXTENT * 2)
+    with tempfile.TemporaryFile() as f, Spool(extent=EXTENT) as spool:
+        f.write(data)
+        f.seek(0)
+        pump = io.Pump(io.Stream(f), spool)
+        while pump.flush() is not None:
+            pass
+        expect(spool.closed).to(be_true)
+        expect(spool.getbuffer() == data).to(be_true)
+
+
+def test_spool_is_stream_like():
+    with Spool(extent=EXTENT) as spool:
+        expect(io.as_stream(spool)).to(equal(spool))
+        expect(spool.isatty()).to(be_false)
+        expect(spool.needs_write()).to(be_false)
+
+
+def test_exec_into_an_empty_spool():
+    script = 'import sys\nsys.stdout.write("x" * 100000)'
+    with FakeDocker() as client, Spool(extent=EXTENT) as spool:
+        container = client.create_container(command=['sleep', '5'])
+        client.start(container)
+        dockerpty.exec_command(client, container, [sys.executable, '-c', script],
+                               interactive=False, stdout=spool)
+        expect(spool.size).to(equal(100000))
+        expect(spool.getbuffer() == b'x' * 100000).to(be_true)
@@ -0,0 +1,144 @@
+# dockerpty: test_transform.py.
+#
+# Copyright 2014 Chris Corbyn <chris@w3style.co.uk>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from expects import expect, equal, be, be_none, raise_error
+import dockerpty.transform as transform
+from dockerpty.transform import as_bytes
+
+import zlib
+
+
+def feed_all(stage, chunks):
+    out = [as_bytes(stage.feed(c)) for c in chunks]
+    out.append(stage.flush())
+    return out
+
+
+def test_as_bytes_copies_buffers():
+    expect(as_bytes(b'ab')).to(equal(b'ab'))
+    expect(as_bytes(memoryview(b'abc')[1:])).to(equal(b'bc'))
+    expect(as_bytes(bytearray(b'ab'))).to(equal(b'ab'))
+
+class TestLines(object):
+
+    def test_passes_whole_lines_through(self):
+        lines = transform.Lines()
+        expect(lines.feed(b'a\nb\n')).to(equal(b'a\nb\n'))
+
+    def test_holds_partial_lines_across_chunks(self):
+        out = feed_all(transform.Lines(), [b'ab', b'c\nde', b'f', b'\ng'])
+        expect(out).to(equal([b'', b'abc\n', b'', b'def\n', b'g']))
+
+    def test_accepts_memoryviews(self):
+        lines = transform.Lines()
+        expect(as_bytes(lines.feed(memoryview(b'a\nb')))).to(equal(b'a\n'))
+        expect(lines.flush()).to(equal(b'b'))
+
+    def test_terminates_the_last_line(self):
+        lines = transform.Lines(terminate=True)
+        expect(lines.feed(b'a\nb')).to(equal(b'a\n'))
+        expect(lines.flush()).to(equal(b'b\n'))
+        expect(lines.flush()).to(equal(b''))
+
+
+class TestPrefix(object):
+
+    def test_prefixes_every_line(self):
+        prefix = transform.Prefix(b'web | ')
+        expect(prefix.feed(b'a\nb\n')).to(equal(b'web | a\nweb | b\n'))
+
+    def test_handles_partial_lines(self):
+        out = feed_all(transform.Prefix(b'> '), [b'ab', b'c\nd', b'\n'])
+        expect(out).to(equal([b'> ab', b'c\n> d', b'\n', b'']))
+
+
+class TestCompress(object):
+
+    def test_output_decompresses_incrementally(self):
+        compress = transform.Compress()
+        decompressor = zlib.decompressobj()
+        expect(decompressor.decompress(compress.feed(b'hello '))).to(equal(b'hello '))
+        expect(decompressor.decompress(compress.feed(b'world'))).to(equal(b'world'))
+        decompressor.decompress(compress.flush())
+        expect(decompressor.eof).to(equal(True))
+
+
+def test_apply_chains_stages():
+    stages = [transform.Lines(), transform.Prefix(b'> ')]
+    expect(transform.apply(stages, b'a\nb')).to(equal(b'> a\n'))
+    expect(transform.finish(stages)).to(equal(b'> b'))
+
+
+class TestIntercept(object):
+
+    def setup_method(self, method):
+        self.seen = []
+
+    def handler(self, sequence):
+        self.seen.append(sequence)
+
+    def test_passes_other_input_through_untouched(self):
+        intercept = transform.Intercept({b'\x10\x11': self.handler})
+        data = b'x' * 65536
+        expect(intercept.feed(data)).to(be(data))
+
+    def test_calls_handlers_and_drops_their_sequences(self):
+        intercept = transform.Intercept({b'\x10\x11': self.handler, b'\x1b[21~': self.handler})
+        expect(as_bytes(intercept.feed(b'ab\x10\x11cd\x1b[21~e'))).to(equal(b'abcde'))
+        expect(self.seen).to(equal([b'\x10\x11', b'\x1b[21~']))
+
+    def test_forwards_what_handlers_return(self):
+        intercept = transform.Intercept({b'\x01': lambda s: b'A'})
+        expect(as_bytes(intercept.feed(b'\x01'))).to(equal(b'A'))
+        expect(as_bytes(intercept.feed(b'x\x01y'))).to(equal(b'xAy'))
+
+    def test_finds_sequences_split_across_chunks(self):
+        intercept = transform.Intercept({b'\x1b[21~': self.handler})
+        out = feed_all(intercept, [b'ab\x1b[', b'21', b'~c\x1b', b'x'])
+        expect(out).to(equal([b'ab', b'', b'c', b'\x1bx', b'']))
+        expect(self.seen).to(equal([b'\x1b[21~']))
+
+    def test_flush_returns_held_bytes(self):
+        intercept = transform.Intercept({b'\x10\x11': self.handler})
+        expect(feed_all(intercept, [b'a\x10'])).to(equal([b'a', b'\x10']))
+
+    def test_pasted_text_is_not_searched(self):
+        intercept = transform.Intercept({b'\x10\x11': self.handler}, bracketed_paste=True)
+        paste = transform.PASTE_START + b'a\x10\x11b' + transform.PASTE_END
+        out = feed_all(intercept, [paste[:10], paste[10:-3], paste[-3:] + b'\x10\x11'])
+        expect(b''.join(out)).to(equal(paste))
+        expect(self.seen).to(equal([b'\x10\x11']))
+
+    def test_paste_start_split_across_chunks(self):
+        intercept = transform.Intercept({b'\x01': self.handler}, bracketed_paste=True)
+        paste = b'0~pasted \x01 text' + transform.PASTE_END
+        out = feed_all(intercept, [b'abc\x1b[20', paste])
+        expect(b''.join(out)).to(equal(b'abc\x1b[20' + paste))
+        expect(self.seen).to(equal([]))
+
+    def test_held_bytes_are_released_after_the_timeout(self):
+        intercept = transform.Intercept({b'\x1b[21~': self.handler}, timeout=0.05,
+                                        clock=lambda: 100.0)
+        expect(intercept.feed(b'\x1b')).to(equal(b''))
+        expect(intercept.deadline()).to(equal(100.05))
+        expect(transform.release([intercept], 100.01)).to(equal(b''))
+        expect(transform.release([intercept], 100.05)).to(equal(b'\x1b'))
+        expect(intercept.deadline()).to(be_none)
+        expect(self.seen).to(equal([]))
+
+    def test_rejects_empty_sequences(self):
+        expect(lambda: transform.Intercept({b'': self.handler})).to(raise_error(ValueError))
+        expect(lambda: transform.Intercept({})).to(raise_error(ValueError))
@@ -14,13 +14,14 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from expects import expect, equal, be_none, be_true, be_false
+from expects import expect, equal, be, be_none, be_true, be_false
 import dockerpty.tty as tty
 import tests.util as util
 
 import os
 import pty
 import termios
+import six
 import tempfile
 
 
@@ -41,6 +42,80 @@ def test_size_returns_a_tuple_for_a_tty():
     expect(tty.size(fd)).to(equal((43, 120)))
 
 
+def test_size_falls_back_to_the_environment_as_ints():
+    saved = dict((k, os.environ.get(k)) for k in ('LINES', 'COLUMNS'))
+    os.environ.update(LINES='40', COLUMNS='132')
+    try:
+        with tempfile.TemporaryFile() as t:
+            expect(tty._size(t)).to(equal((40, 132)))
+    finally:
+        for k, v in saved.items():
+            if v is None:
+                os.environ.pop(k, None)
+            else:
+                os.environ[k] = v
+
+
+class Descriptor(object):
+    """
+    Another file object for a descriptor.
+    """
+
+    def __init__(self, fileno):
+        self.number = fileno
+
+    def fileno(self):
+        return self.number
+
+
+class TestState(object):
+
+    def setup_method(self, method):
+        fd, __ = pty.openpty()
+        self.fd = os.fdopen(fd)
+
+    def teardown_method(self, method):
+        self.fd.close()
+
+    def test_state_is_shared_by_users_of_a_file(self):
+        expect(tty.state(self.fd)).to(be(tty.state(self.fd)))
+
+    def test_state_is_shared_by_files_for_one_descriptor(self):
+        other = Descriptor(self.fd.fileno())
+        expect(tty.state(other)).to(be(tty.state(self.fd)))
+
+        first = tty.Terminal(self.fd, raw=True)
+        second = tty.Terminal(other, raw=True)
+        first.start()
+        second.start()
+        first.stop()
+        expect(israw(self.fd)).to(be_true)
+        second.stop()
+        expect(israw(self.fd)).to(be_false)
+
+    def test_size_is_kept_until_invalidated(self):
+        util.set_pty_size(self.fd, (43, 120))
+        state = tty.State(self.fd)
+        expect(state.size()).to(equal((43, 120)))
+        util.set_pty_size(self.fd, (50, 80))
+        expect(state.size()).to(equal((43, 120)))
+        state.invalidate()
+        expect(state.size()).to(equal((50, 80)))
+
+    def test_size_of_a_non_tty_is_none(self):
+        expect(tty.State(six.BytesIO()).size()).to(be_none)
+
+    def test_raw_mode_lasts_until_the_last_session_stops(self):
+        first = tty.Terminal(self.fd, raw=True)
+        second = tty.Terminal(self.fd, raw=True)
+        first.start()
+        second.start()
+        first.stop()
+        expect(israw(self.fd)).to(be_true)
+        second.stop()
+        expect(israw(self.fd)).to(be_false)
+
+
 class TestTerminal(object):
 
     def test_start_when_raw(self):
@@ -83,3 +158,32 @@ class TestTerminal(object):
         fd = 'some_fd'
         terminal = tty.Terminal(fd, raw=True)
         expect(repr(terminal)).to(equal("Terminal(some_fd, raw=True)"))
+
+
+class TestLocalPTY(object):
+
+    def setup_method(self, method):
+        self.local = tty.LocalPTY(tempfile.TemporaryFile(), size=(30, 100))
+
+    def teardown_method(self, method):
+        self.local.close()
+
+    def test_size_is_set_on_the_slave(self):
+        expect(tty.size(self.local.slave.stream.fd)).to(equal((30, 100)))
+
+    def test_output_is_translated_by_the_line_discipline(self):
+        self.local.slave.write(b'hello\n')
+        expect(self.local.master.read()).to(equal(b'hello\r\n'))
+
+    def test_master_reads_eof_once_the_output_ends(self):
+        self.local.slave.write(b'bye\n')
+        self.local.slave.close()
+        expect(self.local.master.read()).to(equal(b'bye\r\n'))
+        expect(self.local.master.read()).to(be_none)
+
+    def test_a_reading_slave_closes_on_its_next_read(self):
+        self.local.slave.reading = True
+        self.local.slave.close()
+        expect(self.local.slave.buffered()).to(be_true)
+        expect(self.local.slave.read()).to(be_none)
+        expect(self.local.slave.stream.closed).to(be_true)
@@ -0,0 +1,222 @@
+# dockerpty: test_websocket.py.
+#
+# Copyright 2014 Chris Corbyn <chris@w3style.co.uk>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from expects import expect, equal, contain, raise_error
+from dockerpty.websocket import (
+    FrameParser, ProtocolError, Server, accept_key, allowed_origin, encode_frame, unmask,
+    OP_BINARY, OP_CLOSE, OP_PING, OP_PONG, OP_TEXT,
+)
+from tests.util import FakeClient
+
+import json
+import socket
+import time
+
+
+MASK = b'\x01\x02\x03\x04'
+
+UPGRADE = (
+    b'GET /containers/abc/attach HTTP/1.1\r\n'
+    b'Host: localhost\r\n'
+    b'Upgrade: websocket\r\n'
+    b'Connection: Upgrade\r\n'
+    b'Sec-WebSocket-Key: dGhlIHNhbXBsZSBub25jZQ==\r\n'
+    b'Sec-WebSocket-Version: 13\r\n\r\n'
+)
+
+
+def run(server, times=5):
+    for _ in range(times):
+        server.loop.run_once(0.05)
+
+
+def receive(sock):
+    sock.settimeout(1)
+    data = b''
+    while b'\r\n\r\n' not in data:
+        data += sock.recv(4096)
+    head, rest = data.split(b'\r\n\r\n', 1)
+    return head, rest
+
+
+def connect(client):
+    server = Server(client)
+    ours, theirs = socket.socketpair()
+    server.add_connection(theirs)
+    ours.sendall(UPGRADE)
+    run(server)
+    head, rest = receive(ours)
+    return server, ours, head, rest
+
+
+def test_accept_key():
+    # the example from RFC 6455
+    expect(accept_key('dGhlIHNhbXBsZSBub25jZQ==')).to(
+        equal('s3pPLMBiTxaQ9kYGzzhZRbK+xOo=')
+    )
+
+
+def test_masked_frames_round_trip():
+    for size in (0, 5, 125, 126, 65535, 65536):
+        payload = b'x' * size
+        frame = encode_frame(OP_BINARY, payload, mask=MASK)
+        expect(FrameParser().feed(frame)).to(equal([(True, OP_BINARY, payload)]))
+
+
+def test_unmask_xors_with_the_repeated_mask():
+    expect(unmask(b'\x01\x02\x03\x04\x05', MASK)).to(equal(b'\x00\x00\x00\x00\x04'))
+
+
+def test_allowed_origin():
+    headers = {'host': 'localhost:8022'}
+    expect(allowed_origin(headers)).to(equal(True))
+    expect(allowed_origin(dict(headers, origin='http://localhost:8022'))).to(equal(True))
+    expect(allowed_origin(dict(headers, origin='https://evil.example'))).to(equal(False))
+    expect(allowed_origin(dict(headers, origin='https://evil.example'),
+                          ['https://evil.example'])).to(equal(True))
+
+
+def test_parser_holds_partial_frames():
+    parser = FrameParser()
+    frame = encode_frame(OP_TEXT, b'hello', mask=MASK)
+    expect(parser.feed(frame[:3])).to(equal([]))
+    expect(parser.feed(frame[3:] + frame)).to(equal([
+        (True, OP_TEXT, b'hello'),
+        (True, OP_TEXT, b'hello'),
+    ]))
+
+
+def test_parser_rejects_huge_frames():
+    parser = FrameParser(max_size=10)
+    frame = encode_frame(OP_BINARY, b'x' * 11)
+    expect(lambda: parser.feed(frame)).to(raise_error(ProtocolError))
+
+
+class TestServer(object):
+
+    def test_upgrades_and_streams_container_output(self):
+        client = FakeClient(output=b'$ ')
+        server, ours, head, rest = connect(client)
+        expect(head).to(contain(b'101 Switching Protocols'))
+        expect(head).to(contain(b's3pPLMBiTxaQ9kYGzzhZRbK+xOo='))
+
+        while len(rest) < 4:
+            rest += ours.recv(4096)
+        expect(FrameParser().feed(rest)).to(equal([(True, OP_BINARY, b'$ ')]))
+
+    def test_binary_frames_are_written_to_stdin(self):
+        client = FakeClient()
+        server, ours, head, rest = connect(client)
+        ours.sendall(encode_frame(OP_BINARY, b'ls\n', mask=MASK))
+        run(server)
+        client.container['stdin'].settimeout(1)
+        expect(client.container['stdin'].recv(4096)).to(equal(b'ls\n'))
+
+    def test_large_frames_are_written_in_full(self):
+        client = FakeClient()
+        server, ours, head, rest = connect(client)
+        ours.sendall(encode_frame(OP_BINARY, b'x' * 10000, mask=MASK))
+        run(server)
+        stdin = client.container['stdin']
+        stdin.settimeout(1)
+        data = b''
+        while len(data) < 10000:
+            data += stdin.recv(65536)
+        expect(data).to(equal(b'x' * 10000))
+
+    def test_text_frames_resize_the_pty(self):
+        client = FakeClient()
+        server, ours, head, rest = connect(client)
+        message = json.dumps({'type': 'resize', 'rows': 24, 'cols': 80})
+        ours.sendall(encode_frame(OP_TEXT, message.encode('utf-8'), mask=MASK))
+        deadline = time.time() + 1
+        while not client.resized and time.time() < deadline:
+            run(server, 1)
+        expect(client.resized).to(equal([(24, 80)]))
+
+    def test_pings_are_answered(self):
+        client = FakeClient()
+        server, ours, head, rest = connect(client)
+        ours.sendall(encode_frame(OP_PING, b'hi', mask=MASK))
+        run(server)
+        frames = FrameParser().feed(rest + ours.recv(4096))
+        expect(frames).to(equal([(True, OP_PONG, b'hi')]))
+
+    def test_container_exit_closes_the_connection(self):
+        client = FakeClient(output=b'bye', eof=True)
+        server, ours, head, rest = connect(client)
+        run(server)
+        expect(server.connections).to(equal(set()))
+        data = rest
+        while True:
+            chunk = ours.recv(4096)
+            if not chunk:
+                break
+            data += chunk
+        frames = FrameParser().feed(data)
+        expect(frames[0]).to(equal((True, OP_BINARY, b'bye')))
+        expect(frames[-1][1]).to(equal(OP_CLOSE))
+
+    def test_browser_close_ends_the_session(self):
+        client = FakeClient()
+        server, ours, head, rest = connect(client)
+        expect(len(server.connections)).to(equal(1))
+        ours.sendall(encode_frame(OP_CLOSE, b'\x03\xe8', mask=MASK))
+        run(server)
+        expect(server.connections).to(equal(set()))
+        expect(server.loop.groups).to(equal([]))
+
+    def test_ending_with_output_unsent_closes_the_socket(self):
+        client = FakeClient()
+        server, ours, head, rest = connect(client)
+        connection, = server.connections
+        connection.stream.stream.set_blocking(False)
+        while not connection.stream.needs_write():
+            connection.stream.write(b'x' * 65536)
+        connection.group.cancel()
+        run(server)
+        expect(server.connections).to(equal(set()))
+        expect(connection.sock.fileno()).to(equal(-1))
+
+    def test_unknown_paths_are_refused(self):
+        server = Server(FakeClient())
+        ours, theirs = socket.socketpair()
+        server.add_connection(theirs)
+        ours.sendall(UPGRADE.replace(b'/containers/abc/attach', b'/nope'))
+        run(server)
+        head, rest = receive(ours)
+        expect(head).to(contain(b'404 Not Found'))
+        expect(server.connections).to(equal(set()))
+
+    def test_requests_without_upgrade_are_refused(self):
+        server = Server(FakeClient())
+        ours, theirs = socket.socketpair()
+        server.add_connection(theirs)
+        ours.sendall(b'GET / HTTP/1.1\r\nHost: localhost\r\n\r\n')
+        run(server)
+        head, rest = receive(ours)
+        expect(head).to(contain(b'400 Bad Request'))
+
+    def test_cross_origin_requests_are_refused(self):
+        server = Server(FakeClient())
+        ours, theirs = socket.socketpair()
+        server.add_connection(theirs)
+        ours.sendall(UPGRADE.replace(b'Host: localhost\r\n',
+                                     b'Host: localhost\r\nOrigin: https://evil.example\r\n'))
+        run(server)
+        head, rest = receive(ours)
+        expect(head).to(contain(b'403 Forbidden'))
+        expect(server.connections).to(equal(set()))
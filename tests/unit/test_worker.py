@@ -0,0 +1,81 @@
+# dockerpty: test_worker.py.
+#
+# Copyright 2014 Chris Corbyn <chris@w3style.co.uk>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from expects import expect, equal, be_none, be_true, raise_error
+from dockerpty.pty import PseudoTerminal, RunOperation
+from dockerpty.testing import FakeDocker
+from tests.util import FakeClient
+
+
+def start_worker(client):
+    operation = RunOperation(client, 'c', logs=0)
+    return PseudoTerminal(client, operation).start_background()
+
+
+class TestWorker(object):
+
+    def test_output_is_queued_and_exit_code_resolved(self):
+        client = FakeClient(output=b'hello', status=3)
+        worker = start_worker(client)
+
+        expect(worker.output.get(timeout=5)).to(equal(b'hello'))
+        client.container['stdout'].close()
+
+        expect(worker.wait(timeout=5)).to(equal(3))
+        expect(worker.output.get(timeout=5)).to(be_none)
+
+    def test_send_writes_to_container_stdin(self):
+        client = FakeClient()
+        worker = start_worker(client)
+        worker.send(b'ls\n')
+
+        while 'stdin' not in client.container:
+            pass
+        client.container['stdin'].settimeout(5)
+        expect(client.container['stdin'].recv(32)).to(equal(b'ls\n'))
+        worker.stop(timeout=5)
+
+    def test_stop_returns_none_from_wait(self):
+        worker = start_worker(FakeClient())
+        worker.stop(timeout=5)
+        expect(worker.thread.is_alive()).not_to(be_true)
+        expect(worker.wait(timeout=5)).to(be_none)
+        expect(worker.exit_code.cancelled()).to(be_true)
+
+    def test_send_after_close_stdin_raises(self):
+        worker = start_worker(FakeClient())
+        worker.close_stdin()
+        expect(lambda: worker.send(b'x')).to(raise_error(ValueError))
+        worker.stop(timeout=5)
+
+    def test_errors_are_set_on_the_future(self):
+        client = FakeClient()
+        client.inspect_container = None
+        worker = start_worker(client)
+        expect(lambda: worker.wait(timeout=5)).to(raise_error(TypeError))
+
+    def test_local_pty(self):
+        client = FakeDocker()
+        try:
+            container = client.create_container(output=b'out\n', exit_code=2)
+            operation = RunOperation(client, container, logs=0, local_pty=True)
+            worker = PseudoTerminal(client, operation).start_background()
+
+            expect(worker.wait(timeout=5)).to(equal(2))
+            chunks = list(iter(lambda: worker.output.get(timeout=5), None))
+            expect(b''.join(chunks)).to(equal(b'out\r\n'))
+        finally:
+            client.close()
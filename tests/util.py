@@ -19,8 +19,11 @@ import termios
 import struct
 import fcntl
 import select
+import socket
 import os
 import re
+import ssl
+import threading
 import time
 import six
 
@@ -152,3 +155,74 @@ def container_running(client, container, duration=2):
     time.sleep(duration)
     config = client.inspect_container(container)
     return config['State']['Running']
+
+
+class FakeClient(object):
+    """
+    Just enough of docker.Client to attach to a tty container.
+    """
+
+    def __init__(self, output=b'', eof=False, status=0):
+        self.attached = 0
+        self.resized = []
+        self.status = status
+        self.container = {}
+        self.output = output
+        self.eof = eof
+
+    def inspect_container(self, container):
+        return {
+            'State': {'Running': True},
+            'Config': {
+                'Tty': True,
+                'AttachStdin': True,
+                'AttachStdout': True,
+                'AttachStderr': False,
+            },
+        }
+
+    def wait(self, container):
+        return {'StatusCode': self.status}
+
+    def resize(self, container, height, width):
+        self.resized.append((height, width))
+
+    def attach_socket(self, container, params):
+        self.attached += 1
+        ours, theirs = socket.socketpair()
+        key = 'stdin' if params.get('stdin') else 'stdout'
+        self.container[key] = theirs
+        if key == 'stdout':
+            theirs.send(self.output)
+            if self.eof:
+                theirs.close()
+        return ours
+
+
+SSL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ssl')
+
+
+def ssl_socketpair():
+    """
+    Returns a connected pair of (server, client) ssl sockets, handshaken.
+
+    The server uses the self-signed certificate in tests/ssl/.
+    """
+
+    server_ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    server_ctx.load_cert_chain(os.path.join(SSL_DIR, 'cert.pem'),
+                               os.path.join(SSL_DIR, 'key.pem'))
+    client_ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+    client_ctx.check_hostname = False
+    client_ctx.verify_mode = ssl.CERT_NONE
+
+    a, b = socket.socketpair()
+    server = server_ctx.wrap_socket(a, server_side=True, do_handshake_on_connect=False)
+    client = client_ctx.wrap_socket(b, do_handshake_on_connect=False)
+
+    thread = threading.Thread(target=server.do_handshake)
+    thread.start()
+    client.do_handshake()
+    thread.join()
+
+    return server, client